@@ -0,0 +1,112 @@
+import atexit
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import File
+from . import jobs
+
+# Access counts are buffered per process and written in one batch when
+# either limit is reached, so reads never wait on a row update
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 30  # seconds
+
+_lock = threading.Lock()
+_pending = {}  # file id -> (hits, last access)
+_last_flush = time.monotonic()
+_timer = None  # flushes a partial batch FLUSH_INTERVAL after its first entry
+
+
+def half_life():
+    return timedelta(days=getattr(settings, 'DRIVE_ACCESS_HALF_LIFE_DAYS', 7)).total_seconds()
+
+
+def decayed_score(score, last_accessed_at, now):
+    """Access score as of now: halves every DRIVE_ACCESS_HALF_LIFE_DAYS"""
+    if not score or last_accessed_at is None:
+        return 0.0
+    age = max((now - last_accessed_at).total_seconds(), 0)
+    return score * 0.5 ** (age / half_life())
+
+
+def record_access(file_obj):
+    """Count a download or preview of file_obj, promoting it if it is cold"""
+    global _timer
+    now = timezone.now()
+    with _lock:
+        hits, _ = _pending.get(file_obj.id, (0, None))
+        _pending[file_obj.id] = (hits + 1, now)
+        due = len(_pending) >= FLUSH_SIZE or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if not due and _timer is None:
+            # Counts reach the row FLUSH_INTERVAL after the first hit even
+            # when no further access comes in
+            _timer = threading.Timer(FLUSH_INTERVAL, flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+    if file_obj.tier == 'cold':
+        promote(file_obj)
+    if due:
+        flush()
+
+
+def promote(file_obj):
+    # One queued promotion per file, however many requests read it meanwhile
+    if cache.add(f'promote:{file_obj.id}', True, 300):
+        jobs.enqueue('promote_file', file_id=file_obj.id)
+
+
+def flush_in_background():
+    try:
+        flush()
+    finally:
+        # The timer thread's connection would otherwise stay open
+        connections.close_all()
+
+
+def flush():
+    """Write buffered access counts. Returns the number of rows updated."""
+    global _last_flush, _timer
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+
+    # Concurrent flushes from other processes may overwrite each other's
+    # increments; the score is a heuristic, so that is an accepted loss
+    files = File.objects.only('id', 'access_score', 'last_accessed_at').in_bulk(list(pending))
+    for file_id, file_obj in files.items():
+        hits, accessed_at = pending[file_id]
+        file_obj.access_score = decayed_score(file_obj.access_score, file_obj.last_accessed_at, accessed_at) + hits
+        file_obj.last_accessed_at = accessed_at
+    File.objects.bulk_update(files.values(), ['access_score', 'last_accessed_at'])
+    return len(files)
+
+
+atexit.register(flush)
+
+
+def cold_candidates(now=None):
+    """
+    Hot files not read for DRIVE_COLD_AFTER_DAYS, ordered by id. Files never
+    read count from their upload time. Chunked files stay hot, since their
+    chunks are shared with other versions and files.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=getattr(settings, 'DRIVE_COLD_AFTER_DAYS', 30))
+    return File.objects.filter(
+        Q(last_accessed_at__lt=cutoff) | Q(last_accessed_at__isnull=True, created_at__lt=cutoff),
+        tier='hot', current_version__isnull=True,
+    ).order_by('id')
+
+
+def is_cold(file_obj, now):
+    return decayed_score(file_obj.access_score, file_obj.last_accessed_at, now) < getattr(settings, 'DRIVE_COLD_MAX_SCORE', 1.0)
@@ -0,0 +1,64 @@
+import atexit
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from .models import RecentActivity
+
+# "viewed" and "downloaded" entries are written for many reads at once, so
+# read-only requests do not take the database write lock
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 10  # seconds
+
+_lock = threading.Lock()
+_pending = []  # unsaved RecentActivity instances
+_last_flush = time.monotonic()
+_timer = None  # flushes a partial batch FLUSH_INTERVAL after its first entry
+
+
+def record_read(user, action, item_name, item_type):
+    """Log a view or download; it appears in the activity list within FLUSH_INTERVAL seconds"""
+    entry = RecentActivity(user=user, action=action, item_name=item_name, item_type=item_type, timestamp=timezone.now())
+    if not getattr(settings, 'DRIVE_BATCH_READ_ACTIVITY', True):
+        entry.save()
+        return
+    global _timer
+    with _lock:
+        _pending.append(entry)
+        due = len(_pending) >= FLUSH_SIZE or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if not due and _timer is None:
+            # Without further reads the batch would otherwise wait, and be
+            # lost if the process is killed, until the next one comes in
+            _timer = threading.Timer(FLUSH_INTERVAL, flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+    if due:
+        flush()
+
+
+def flush_in_background():
+    try:
+        flush()
+    finally:
+        # The timer thread's connection would otherwise stay open
+        connections.close_all()
+
+
+def flush():
+    """Write buffered entries. Returns the number written."""
+    global _last_flush, _timer
+    with _lock:
+        pending = list(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+    RecentActivity.objects.bulk_create(pending)
+    return len(pending)
+
+
+atexit.register(flush)
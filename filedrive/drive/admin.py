@@ -1,10 +1,110 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
 from .models import UserProfile, Folder, File, Trash, RecentActivity, StorageSettings
+from . import jobs, operations
+
+# Below this many rows an exact COUNT(*) is cheap enough
+EXACT_COUNT_BELOW = 10000
+# Ids per background job queued by bulk actions
+JOB_BATCH_SIZE = 500
+
+
+def estimated_count(model):
+    """Row count of model's table from database statistics, or None if unknown"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+                [table],
+            )
+        else:
+            # The largest id is read from the end of the primary key
+            cursor.execute(f"SELECT MAX({connection.ops.quote_name(model._meta.pk.column)}) FROM {connection.ops.quote_name(table)}")
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Use the estimated size of unfiltered changelists of large tables instead of COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate >= EXACT_COUNT_BELOW:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows: estimated counts,
+    no second count for the "show all" link and searches that use indexes.
+    The search box matches an exact owner username or, when prefix_field is
+    set, a case-sensitive prefix of that field.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
+    owner_field = 'owner'
+    prefix_field = None
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        condition = Q(pk__in=[])
+        user_id = User.objects.filter(username=search_term).values_list('id', flat=True).first()
+        if user_id is not None:
+            condition |= Q(**{f'{self.owner_field}_id': user_id})
+        if self.prefix_field:
+            # A range on the column instead of LIKE, so a plain index answers it
+            condition |= Q(**{f'{self.prefix_field}__gte': search_term, f'{self.prefix_field}__lt': search_term + '\U0010ffff'})
+        return queryset.filter(condition), False
+
+    def get_actions(self, request):
+        # The stock action loads every selected object and its relations
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+def queue_in_batches(kind, ids, key):
+    """Queue one job per JOB_BATCH_SIZE ids. Returns the number of ids."""
+    total = 0
+    batch = []
+    for item_id in ids:
+        batch.append(item_id)
+        if len(batch) >= JOB_BATCH_SIZE:
+            jobs.enqueue(kind, **{key: batch})
+            total += len(batch)
+            batch = []
+    if batch:
+        jobs.enqueue(kind, **{key: batch})
+        total += len(batch)
+    return total
+
+
+class MoveFilesForm(ActionForm):
+    folder = forms.IntegerField(required=False, label="Target folder id")
+
 
 @admin.register(StorageSettings)
 class StorageSettingsAdmin(admin.ModelAdmin):
-    list_display = ['id', 'space_per_user_gb']
-    
+    list_display = ['id', 'space_per_user_gb', 'user_bandwidth_limit', 'share_bandwidth_limit', 'max_concurrent_transfers']
+
     def space_per_user_gb(self, obj):
         return f"{obj.space_per_user / (1024*1024*1024):.2f} GB"
     space_per_user_gb.short_description = "Space per user"
@@ -13,38 +113,105 @@ class StorageSettingsAdmin(admin.ModelAdmin):
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'gender', 'date_of_birth']
     list_filter = ['gender']
-    search_fields = ['user__username']
+    list_select_related = ['user']
+    search_fields = ['=user__username']
+    autocomplete_fields = ['user']
 
 @admin.register(Folder)
-class FolderAdmin(admin.ModelAdmin):
+class FolderAdmin(LargeTableAdmin):
     list_display = ['name', 'owner', 'parent', 'created_at', 'is_public']
     list_filter = ['is_public', 'created_at']
-    search_fields = ['name', 'owner__username']
+    list_select_related = ['owner', 'parent']
+    search_fields = ['name']
+    search_help_text = "Folder name prefix (case-sensitive) or exact owner username"
+    prefix_field = 'name'
+    autocomplete_fields = ['owner']
+    raw_id_fields = ['parent']
+    actions = ['purge_folders']
+
+    @admin.action(description="Permanently delete selected folders and their contents")
+    def purge_folders(self, request, queryset):
+        count = queue_in_batches('purge_items', queryset.values_list('id', flat=True).iterator(), 'folders')
+        self.message_user(request, f"Queued permanent deletion of {count} folders.", messages.SUCCESS)
 
 @admin.register(File)
-class FileAdmin(admin.ModelAdmin):
-    list_display = ['name', 'owner', 'folder', 'size', 'file_type', 'created_at', 'is_public']
-    list_filter = ['file_type', 'is_public', 'created_at']
-    search_fields = ['name', 'owner__username']
+class FileAdmin(LargeTableAdmin):
+    list_display = ['name', 'owner', 'folder', 'size', 'stored_size', 'file_type', 'created_at', 'is_public']
+    list_filter = ['category', 'tier', 'is_public', 'created_at']
+    list_select_related = ['owner', 'folder']
+    search_fields = ['name']
+    search_help_text = "File name prefix (case-sensitive) or exact owner username"
+    prefix_field = 'name'
+    autocomplete_fields = ['owner']
+    raw_id_fields = ['folder', 'current_version']
+    action_form = MoveFilesForm
+    actions = ['purge_files', 'move_files', 'recompute_usage']
+
+    @admin.action(description="Permanently delete selected files")
+    def purge_files(self, request, queryset):
+        count = queue_in_batches('purge_items', queryset.values_list('id', flat=True).iterator(), 'files')
+        self.message_user(request, f"Queued permanent deletion of {count} files.", messages.SUCCESS)
+
+    @admin.action(description="Move selected files to the target folder")
+    def move_files(self, request, queryset):
+        folder_id = request.POST.get('folder', '')
+        folder = Folder.objects.filter(id=folder_id).select_related('owner').first() if folder_id.isdigit() else None
+        if folder is None:
+            self.message_user(request, "Enter the id of an existing target folder.", messages.ERROR)
+            return
+        # Only the folder owner's files can move into it
+        ids = list(queryset.filter(owner_id=folder.owner_id).values_list('id', flat=True))
+        moved = 0
+        for start in range(0, len(ids), JOB_BATCH_SIZE):
+            moved += operations.move_files(folder.owner, ids[start:start + JOB_BATCH_SIZE], folder)
+        self.message_user(request, f"Moved {moved} files of {folder.owner.username} to '{folder.name}'.", messages.SUCCESS)
+
+    @admin.action(description="Recompute sizes and checksums from storage")
+    def recompute_usage(self, request, queryset):
+        count = queue_in_batches('measure_files', queryset.values_list('id', flat=True).iterator(), 'file_ids')
+        self.message_user(request, f"Queued measuring of {count} files.", messages.SUCCESS)
 
 @admin.register(Trash)
-class TrashAdmin(admin.ModelAdmin):
+class TrashAdmin(LargeTableAdmin):
     list_display = ['owner', 'item_name', 'item_type', 'deleted_at']
     list_filter = ['deleted_at']
+    list_select_related = ['owner', 'file', 'folder']
     search_fields = ['owner__username']
-    
+    search_help_text = "Exact owner username"
+    autocomplete_fields = ['owner']
+    raw_id_fields = ['file', 'folder']
+    actions = ['purge_trash']
+
     def item_name(self, obj):
-        if obj.file:
+        if obj.file_id:
             return obj.file.name
         return obj.folder.name
-    
+
     def item_type(self, obj):
-        if obj.file:
+        if obj.file_id:
             return "File"
         return "Folder"
 
+    @admin.action(description="Permanently delete the items in selected trash entries")
+    def purge_trash(self, request, queryset):
+        entries = queryset.values_list('file_id', 'folder_id')
+        files = queue_in_batches('purge_items', (file_id for file_id, _ in entries.filter(file__isnull=False).iterator()), 'files')
+        folders = queue_in_batches('purge_items', (folder_id for _, folder_id in entries.filter(folder__isnull=False).iterator()), 'folders')
+        self.message_user(request, f"Queued permanent deletion of {files} files and {folders} folders.", messages.SUCCESS)
+
 @admin.register(RecentActivity)
-class RecentActivityAdmin(admin.ModelAdmin):
+class RecentActivityAdmin(LargeTableAdmin):
     list_display = ['user', 'action', 'item_name', 'item_type', 'timestamp']
-    list_filter = ['action', 'item_type', 'timestamp']
-    search_fields = ['user__username', 'item_name']
\ No newline at end of file
+    list_filter = ['timestamp']
+    list_select_related = ['user']
+    search_fields = ['user__username']
+    search_help_text = "Exact username"
+    owner_field = 'user'
+    autocomplete_fields = ['user']
+    actions = ['delete_activities']
+
+    @admin.action(description="Delete selected activities")
+    def delete_activities(self, request, queryset):
+        # Nothing refers to activities, so this is a single DELETE
+        count, _ = queryset.delete()
+        self.message_user(request, f"Deleted {count} activities.", messages.SUCCESS)
@@ -0,0 +1,455 @@
+import hashlib
+import json
+import re
+import time
+from functools import wraps
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags, quote_etag
+from .filetypes import CATEGORY_CHOICES
+from .forms import FileForm
+from .models import File, Folder, Trash
+from . import archives, chunking, jobs, listing_cache, media, metrics, operations, throttle, versions
+
+# Most ids accepted by one batch stat request
+MAX_BATCH = 500
+# Most chunks in one version manifest (at least 12 GB at the minimum chunk size)
+MAX_MANIFEST = 50000
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Field name -> (columns to load, value getter). Clients choose fields with
+# ?fields=a,b,c and only those columns are selected.
+FILE_FIELDS = {
+    'id': (['id'], lambda f: f.id),
+    'type': ([], lambda f: 'file'),
+    'name': (['name'], lambda f: f.name),
+    'folder': (['folder'], lambda f: f.folder_id),
+    'owner': (['owner__username'], lambda f: f.owner.username),
+    'size': (['size'], lambda f: f.size),
+    'category': (['category', 'mime_type', 'name'], lambda f: f.get_file_category()),
+    'mime_type': (['mime_type'], lambda f: f.mime_type),
+    'checksum': (['checksum'], lambda f: f.checksum),
+    'is_public': (['is_public'], lambda f: f.is_public),
+    'created_at': (['created_at'], lambda f: f.created_at),
+    'modified_at': (['modified_at'], lambda f: f.modified_at),
+}
+FOLDER_FIELDS = {
+    'id': (['id'], lambda f: f.id),
+    'type': ([], lambda f: 'folder'),
+    'name': (['name'], lambda f: f.name),
+    'parent': (['parent'], lambda f: f.parent_id),
+    'owner': (['owner__username'], lambda f: f.owner.username),
+    'is_public': (['is_public'], lambda f: f.is_public),
+    'created_at': (['created_at'], lambda f: f.created_at),
+    'modified_at': (['modified_at'], lambda f: f.modified_at),
+}
+# Listings are served from listing_cache, which keeps these
+LISTING_FIELDS = ['id', 'type', 'name', 'size', 'category', 'mime_type', 'is_public', 'modified_at']
+
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def api_view(*methods):
+    """JSON errors instead of redirects for anonymous users and wrong methods"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return error('Authentication required.', 401)
+            if request.method not in methods:
+                response = error('Method not allowed.', 405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def requested_fields(request, available):
+    """Fields named by ?fields=, or all of them. Returns None if one is unknown."""
+    fields = [name for name in request.GET.get('fields', '').split(',') if name]
+    if not fields:
+        return list(available)
+    if any(name not in available for name in fields):
+        return None
+    return fields
+
+
+def select(queryset, fields, spec):
+    """Load only the columns the fields need, joining the owner only if asked for"""
+    columns = {column for name in fields for column in spec[name][0]} | {'id'}
+    if 'owner' in fields:
+        queryset = queryset.select_related('owner')
+    return queryset.only(*columns)
+
+
+def serialize(item, fields, spec):
+    return {name: spec[name][1](item) for name in fields}
+
+
+def visible(queryset, user):
+    """Items the user may stat: their own and public ones"""
+    return queryset.filter(Q(owner=user) | Q(is_public=True))
+
+
+def field_error(available):
+    return error(f"Unknown field. Available: {', '.join(available)}.", 400)
+
+
+@api_view('GET')
+def file_detail(request, file_id):
+    fields = requested_fields(request, FILE_FIELDS)
+    if fields is None:
+        return field_error(FILE_FIELDS)
+    file_obj = select(visible(File.objects.filter(id=file_id), request.user), fields, FILE_FIELDS).first()
+    if file_obj is None:
+        return error('File not found.', 404)
+    return JsonResponse(serialize(file_obj, fields, FILE_FIELDS))
+
+
+@api_view('GET')
+def folder_detail(request, folder_id):
+    fields = requested_fields(request, FOLDER_FIELDS)
+    if fields is None:
+        return field_error(FOLDER_FIELDS)
+    folder = select(visible(Folder.objects.filter(id=folder_id), request.user), fields, FOLDER_FIELDS).first()
+    if folder is None:
+        return error('Folder not found.', 404)
+    return JsonResponse(serialize(folder, fields, FOLDER_FIELDS))
+
+
+def parse_ids(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+@api_view('GET')
+def batch_stat(request):
+    """GET /api/stat/?files=1,2&folders=3 stats many items in two queries"""
+    try:
+        file_ids = parse_ids(request.GET.get('files', ''))
+        folder_ids = parse_ids(request.GET.get('folders', ''))
+    except ValueError:
+        return error('Ids must be comma-separated integers.', 400)
+    if len(file_ids) + len(folder_ids) > MAX_BATCH:
+        return error(f'At most {MAX_BATCH} ids per request.', 400)
+
+    requested = [name for name in request.GET.get('fields', '').split(',') if name]
+    if any(name not in FILE_FIELDS and name not in FOLDER_FIELDS for name in requested):
+        return field_error(sorted(set(FILE_FIELDS) | set(FOLDER_FIELDS)))
+    file_fields = [name for name in requested if name in FILE_FIELDS] if requested else list(FILE_FIELDS)
+    folder_fields = [name for name in requested if name in FOLDER_FIELDS] if requested else list(FOLDER_FIELDS)
+
+    files = folders = []
+    if file_ids:
+        files = select(visible(File.objects.filter(id__in=file_ids), request.user), file_fields, FILE_FIELDS)
+    if folder_ids:
+        folders = select(visible(Folder.objects.filter(id__in=folder_ids), request.user), folder_fields, FOLDER_FIELDS)
+    found_files = {file_obj.id: serialize(file_obj, file_fields, FILE_FIELDS) for file_obj in files}
+    found_folders = {folder.id: serialize(folder, folder_fields, FOLDER_FIELDS) for folder in folders}
+    return JsonResponse({
+        'files': [found_files[file_id] for file_id in file_ids if file_id in found_files],
+        'folders': [found_folders[folder_id] for folder_id in folder_ids if folder_id in found_folders],
+        'missing': {
+            'files': [file_id for file_id in file_ids if file_id not in found_files],
+            'folders': [folder_id for folder_id in folder_ids if folder_id not in found_folders],
+        },
+    })
+
+
+@api_view('GET')
+def folder_children(request, folder_id):
+    """
+    One page of a folder's contents. The ETag is derived from the folder's
+    generation, so an unchanged folder is answered with 304 without loading
+    the listing at all.
+    """
+    folder = Folder.objects.filter(id=folder_id, owner=request.user).only('id', 'generation').first()
+    if folder is None:
+        return error('Folder not found.', 404)
+
+    fields = requested_fields(request, LISTING_FIELDS)
+    if fields is None:
+        return field_error(LISTING_FIELDS)
+    category = request.GET.get('type', '')
+    sort = request.GET.get('sort', listing_cache.DEFAULT_SORT)
+    if category and category not in dict(CATEGORY_CHOICES):
+        return error('Unknown type.', 400)
+    if sort not in listing_cache.SORTS:
+        return error('Unknown sort.', 400)
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        return error('Invalid page.', 400)
+
+    version = f'{folder.id}:{folder.generation}:{sort}:{category}:{page}:{",".join(fields)}'
+    etag = quote_etag(hashlib.md5(version.encode()).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    listing = listing_cache.get_listing(folder, sort, category, page)
+    items = [dict(row, type='folder') for row in listing['folders']] + [dict(row, type='file') for row in listing['files']]
+    response = JsonResponse({
+        'folder': folder.id,
+        'page': listing['page'],
+        'num_pages': listing['num_pages'],
+        'count': listing['count'],
+        'items': [{name: item[name] for name in fields if name in item} for item in items],
+    })
+    response['ETag'] = etag
+    return response
+
+
+@api_view('POST')
+def create_folder(request):
+    name = request.POST.get('name', '').strip()
+    if not name:
+        return error('A name is required.', 400)
+    parent = None
+    if request.POST.get('parent'):
+        parent = Folder.objects.filter(id=request.POST['parent'], owner=request.user).first()
+        if parent is None:
+            return error('Parent folder not found.', 404)
+    folder = operations.create_folder(request.user, Folder(name=name[:255], parent=parent))
+    return JsonResponse(serialize(folder, FOLDER_FIELDS, FOLDER_FIELDS), status=201)
+
+
+@api_view('POST')
+@throttle.throttled_upload
+def upload_file(request):
+    folder = None
+    if request.POST.get('folder'):
+        folder = Folder.objects.filter(id=request.POST['folder'], owner=request.user).first()
+        if folder is None:
+            return error('Folder not found.', 404)
+    form = FileForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Invalid upload.', 'fields': form.errors}, status=400)
+    file_obj = form.save(commit=False)
+    file_obj.folder = folder
+    try:
+        operations.add_file(request.user, file_obj)
+    except operations.QuotaExceeded:
+        return error('Not enough storage space.', 413)
+    return JsonResponse(serialize(file_obj, FILE_FIELDS, FILE_FIELDS), status=201)
+
+
+def owned_item(user, item_type, item_id):
+    model = {'files': File, 'folders': Folder}.get(item_type)
+    if model is None:
+        return None
+    return model.objects.filter(id=item_id, owner=user).first()
+
+
+@api_view('POST')
+def trash_item(request, item_type, item_id):
+    item = owned_item(request.user, item_type, item_id)
+    if item is None:
+        return error('Not found.', 404)
+    if Trash.objects.filter(**{operations.item_type(item): item}).exists():
+        return error('Already in trash.', 409)
+    entry = operations.trash(request.user, item)
+    return JsonResponse({'trash_id': entry.id, 'type': operations.item_type(item), 'id': item.id})
+
+
+@api_view('POST')
+def restore_item(request, item_type, item_id):
+    item = owned_item(request.user, item_type, item_id)
+    if item is None:
+        return error('Not found.', 404)
+    entry = Trash.objects.filter(owner=request.user, **{operations.item_type(item): item}).first()
+    if entry is None:
+        return error('Not in trash.', 409)
+    operations.restore(request.user, entry)
+    return JsonResponse({'type': operations.item_type(item), 'id': item.id})
+
+
+def json_body(request):
+    """The request body as a JSON object, or None if it is not one"""
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def manifest(body, key):
+    """A list of chunk hashes from the request body, or None if invalid"""
+    hashes = body.get(key)
+    if not isinstance(hashes, list) or len(hashes) > MAX_MANIFEST:
+        return None
+    if not all(isinstance(chunk_hash, str) and HASH_RE.match(chunk_hash) for chunk_hash in hashes):
+        return None
+    return hashes
+
+
+def prepare_chunked(file_obj):
+    """Queue conversion of a whole file to chunks, once however often it is asked for"""
+    if cache.add(f'chunk_file:{file_obj.id}', True, 300):
+        jobs.enqueue('chunk_file', file_id=file_obj.id)
+    return JsonResponse({'status': 'preparing', 'retry_after': throttle.RETRY_AFTER}, status=202)
+
+
+def version_error(exc):
+    if isinstance(exc, versions.MissingChunks):
+        return JsonResponse({'error': 'Chunks missing.', 'missing': exc.hashes}, status=409)
+    return error('Not enough storage space.', 413)
+
+
+def serialize_version(version, file_obj):
+    return {
+        'number': version.number,
+        'size': version.size,
+        'checksum': version.checksum,
+        'created_at': version.created_at,
+        'current': version.id == file_obj.current_version_id,
+    }
+
+
+@api_view('POST')
+def missing_chunks(request):
+    """
+    Upload handshake: {"hashes": [...]} in, the ones the user has to upload
+    out. Chunks count as present only if the user uploaded them or already
+    has them in one of their files, whatever other users have stored.
+    With "file", that file is first converted to chunks if it is not yet,
+    and the client is asked to retry meanwhile.
+    """
+    body = json_body(request)
+    hashes = manifest(body, 'hashes') if body is not None else None
+    if hashes is None:
+        return error('Expected {"hashes": [sha256, ...]}.', 400)
+    if body.get('file') is not None:
+        file_obj = File.objects.filter(id=body['file'], owner=request.user).first()
+        if file_obj is None:
+            return error('File not found.', 404)
+        if not file_obj.is_chunked():
+            return prepare_chunked(file_obj)
+    return JsonResponse({'missing': versions.missing_chunks(request.user, hashes), 'chunking': chunking.parameters()})
+
+
+@api_view('PUT')
+def upload_chunk(request, chunk_hash):
+    """PUT the raw bytes of one chunk; they must hash to the URL's sha256"""
+    if not HASH_RE.match(chunk_hash):
+        return error('Invalid chunk hash.', 400)
+    transfer_limits = throttle.limits()
+    if not throttle.acquire_transfer(request.user, transfer_limits):
+        return throttle.too_many_transfers()
+    started = time.perf_counter()
+    try:
+        buckets = throttle.buckets_for(request.user, transfer_limits)
+        data = bytearray()
+        # Read the stream directly: request.body is capped well below a chunk
+        while piece := request.read(64 * 1024):
+            if buckets:
+                throttle.consume(buckets, len(piece))
+            data += piece
+            if len(data) > chunking.MAX_SIZE:
+                return error(f'Chunks are at most {chunking.MAX_SIZE} bytes.', 413)
+    finally:
+        throttle.release_transfer(request.user, transfer_limits)
+    try:
+        chunk, created = versions.receive_chunk(request.user, bytes(data), chunk_hash)
+    except versions.InvalidChunk as e:
+        return error(str(e), 400)
+    metrics.record_transfer('upload', len(data), time.perf_counter() - started)
+    return JsonResponse({'hash': chunk.hash, 'size': chunk.size}, status=201 if created else 200)
+
+
+@api_view('POST')
+def create_chunked_file(request):
+    """Create a file from uploaded chunks: {"name", "folder", "chunks": [...]}"""
+    body = json_body(request)
+    hashes = manifest(body, 'chunks') if body is not None else None
+    name = body.get('name') if body is not None else None
+    if hashes is None or not isinstance(name, str) or not name.strip():
+        return error('Expected {"name": ..., "chunks": [sha256, ...]}.', 400)
+    folder = None
+    if body.get('folder') is not None:
+        folder = Folder.objects.filter(id=body['folder'], owner=request.user).first()
+        if folder is None:
+            return error('Folder not found.', 404)
+    try:
+        file_obj = versions.create_file(request.user, name.strip()[:255], folder, hashes)
+    except (versions.MissingChunks, operations.QuotaExceeded) as e:
+        return version_error(e)
+    return JsonResponse(serialize(file_obj, FILE_FIELDS, FILE_FIELDS), status=201)
+
+
+@api_view('GET', 'POST')
+def file_versions(request, file_id):
+    """List a file's versions, or commit a new one from {"chunks": [...]}"""
+    if request.method == 'GET':
+        file_obj = visible(File.objects.filter(id=file_id), request.user).first()
+        if file_obj is None:
+            return error('File not found.', 404)
+        return JsonResponse({'versions': [serialize_version(version, file_obj) for version in file_obj.versions.all()]})
+
+    file_obj = File.objects.filter(id=file_id, owner=request.user).first()
+    if file_obj is None:
+        return error('File not found.', 404)
+    body = json_body(request)
+    hashes = manifest(body, 'chunks') if body is not None else None
+    if hashes is None:
+        return error('Expected {"chunks": [sha256, ...]}.', 400)
+    if not file_obj.is_chunked():
+        return prepare_chunked(file_obj)
+    try:
+        version = versions.add_version(request.user, file_obj, hashes)
+    except (versions.MissingChunks, operations.QuotaExceeded) as e:
+        return version_error(e)
+    return JsonResponse(serialize_version(version, file_obj), status=201)
+
+
+@api_view('GET')
+def archive_listing(request, file_id):
+    """Members of a zip or tar file, read from its central directory or headers"""
+    file_obj = visible(File.objects.filter(id=file_id), request.user).first()
+    if file_obj is None:
+        return error('File not found.', 404)
+    try:
+        listing = archives.get_listing(file_obj)
+    except archives.ArchiveError as e:
+        return error(str(e), 422)
+    return JsonResponse({
+        'format': listing['format'],
+        'count': listing['count'],
+        'truncated': listing['truncated'],
+        'members': [
+            {'name': member['name'], 'size': member['size'], 'modified': member['modified'], 'dir': member['dir']}
+            for member in listing['members']
+        ],
+    })
+
+
+@api_view('GET')
+def gallery(request):
+    """
+    The user's images and videos across all folders, newest capture first.
+    Pass the returned cursor as ?after= for the next page.
+    """
+    try:
+        filters = media.parse_filters(request.GET)
+    except ValueError:
+        return error('Invalid kind, size or cursor.', 400)
+    items, next_cursor = media.gallery_page(request.user, **filters)
+    return JsonResponse({
+        'next': next_cursor,
+        'items': [{
+            'id': item.file_id,
+            'name': item.file.name,
+            'size': item.file.size,
+            'kind': item.kind,
+            'width': item.width,
+            'height': item.height,
+            'orientation': item.orientation,
+            'duration': item.duration,
+            'captured_at': item.captured_at,
+            'thumbnail': item.thumbnail_url(),
+        } for item in items],
+    })
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DriveConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'drive'
+
+    def ready(self):
+        # Register job handlers
+        from . import tasks  # noqa: F401
+        from . import storage
+        storage.check_compression()
+
+        if getattr(settings, 'DRIVE_BATCH_LAST_LOGIN', False):
+            from django.contrib.auth.signals import user_logged_in
+            from . import logins
+            user_logged_in.disconnect(dispatch_uid='update_last_login')
+            user_logged_in.connect(logins.record_login, dispatch_uid='drive_record_login')
@@ -0,0 +1,183 @@
+import tarfile
+import zipfile
+from datetime import datetime, timezone as dt_timezone
+from django.core.cache import cache
+
+# Members kept in a cached listing; larger archives are listed partially
+MAX_MEMBERS = 5000
+TIMEOUT = 24 * 60 * 60
+# Leading bytes of compressed streams; a tar inside one cannot be listed
+# without decompressing everything before each header
+COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00', b'\x28\xb5\x2f\xfd')
+
+
+class ArchiveError(Exception):
+    """The file is not an archive that can be browsed"""
+
+
+def cache_key(file_obj):
+    # Any new content changes the size, version or modification time
+    modified = int(file_obj.modified_at.timestamp())
+    return f'archive:{file_obj.id}:{file_obj.current_version_id or 0}:{file_obj.size}:{modified}'
+
+
+def open_seekable(file_obj):
+    """Open the content for random access. Compressed-at-rest files cannot seek cheaply."""
+    if file_obj.encoding:
+        raise ArchiveError('Archives stored compressed cannot be browsed.')
+    return file_obj.open_content()
+
+
+def detect_format(fh):
+    fh.seek(0)
+    head = fh.read(512)
+    if head.startswith(COMPRESSED_MAGIC):
+        raise ArchiveError('Compressed tar archives cannot be browsed.')
+    if head[257:262] == b'ustar':
+        return 'tar'
+    if zipfile.is_zipfile(fh):
+        return 'zip'
+    raise ArchiveError('Unsupported archive format.')
+
+
+def zip_time(date_time):
+    try:
+        return datetime(*date_time)
+    except ValueError:
+        return None
+
+
+def list_zip(fh):
+    # Only the central directory at the end of the file is read
+    with zipfile.ZipFile(fh) as archive:
+        infos = archive.infolist()
+    members = [{
+        'name': info.filename,
+        'size': info.file_size,
+        'modified': zip_time(info.date_time),
+        'dir': info.is_dir(),
+    } for info in infos[:MAX_MEMBERS]]
+    return members, len(infos)
+
+
+def list_tar(fh):
+    # Reading a header seeks past the member's data to the next header
+    members = []
+    count = 0
+    with tarfile.open(fileobj=fh, mode='r:') as archive:
+        while (info := archive.next()) is not None:
+            count += 1
+            if count <= MAX_MEMBERS and (info.isfile() or info.isdir()):
+                members.append({
+                    'name': info.name,
+                    'size': info.size,
+                    'modified': datetime.fromtimestamp(info.mtime, dt_timezone.utc),
+                    'dir': info.isdir(),
+                    'offset': info.offset_data,
+                })
+    return members, count
+
+
+def build_listing(file_obj):
+    with open_seekable(file_obj) as fh:
+        archive_format = detect_format(fh)
+        fh.seek(0)
+        try:
+            members, count = list_zip(fh) if archive_format == 'zip' else list_tar(fh)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            raise ArchiveError(f'Damaged archive: {e}')
+    return {'format': archive_format, 'count': count, 'truncated': count > MAX_MEMBERS, 'members': members}
+
+
+def get_listing(file_obj):
+    """Members of an archive, from the cache while the file is unchanged. Raises ArchiveError."""
+    key = cache_key(file_obj)
+    listing = cache.get(key)
+    if listing is None:
+        try:
+            listing = build_listing(file_obj)
+        except ArchiveError as e:
+            # Remember failures too, so the file page does not retry every time
+            listing = {'error': str(e)}
+        cache.set(key, listing, TIMEOUT)
+    if 'error' in listing:
+        raise ArchiveError(listing['error'])
+    return listing
+
+
+class MemberStream:
+    """Read one member; closing it also closes the archive and the file under it"""
+
+    def __init__(self, reader, *closables):
+        self.reader = reader
+        self.closables = closables
+
+    def read(self, size=-1):
+        return self.reader.read(size)
+
+    def close(self):
+        self.reader.close()
+        for closable in self.closables:
+            closable.close()
+
+
+class Slice:
+    """size bytes of fh starting at offset"""
+
+    def __init__(self, fh, offset, size):
+        fh.seek(offset)
+        self.fh = fh
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.remaining = 0
+
+
+def open_member(file_obj, name):
+    """Open one regular member of an archive for streaming. Returns (stream, size)."""
+    listing = get_listing(file_obj)
+    entry = next((member for member in listing['members'] if member['name'] == name), None)
+    if entry is not None and entry['dir']:
+        raise ArchiveError('Not a file.')
+    if entry is None and not listing['truncated']:
+        raise ArchiveError('No such member.')
+
+    fh = open_seekable(file_obj)
+    try:
+        if listing['format'] == 'tar':
+            if entry is None:
+                # Beyond the cached listing: find its header the slow way
+                with tarfile.open(fileobj=fh, mode='r:') as archive:
+                    info = archive.getmember(name)
+                if not info.isfile():
+                    raise ArchiveError('Not a file.')
+                entry = {'offset': info.offset_data, 'size': info.size}
+            return MemberStream(Slice(fh, entry['offset'], entry['size']), fh), entry['size']
+
+        archive = zipfile.ZipFile(fh)
+        try:
+            info = archive.getinfo(name)
+            if info.is_dir():
+                raise ArchiveError('Not a file.')
+            # Decompressed on the fly while streaming
+            return MemberStream(archive.open(info), archive, fh), info.file_size
+        except BaseException:
+            archive.close()
+            raise
+    except KeyError:
+        fh.close()
+        raise ArchiveError('No such member.')
+    except (RuntimeError, NotImplementedError, zipfile.BadZipFile, tarfile.TarError) as e:
+        # Encrypted members and unsupported compression methods
+        fh.close()
+        raise ArchiveError(f'Cannot extract this member: {e}')
+    except BaseException:
+        fh.close()
+        raise
@@ -0,0 +1,76 @@
+import hashlib
+import io
+import re
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from .models import UserProfile
+
+# Square renditions kept for every profile photo; the largest is what
+# UserProfile.photo points at
+SIZES = (32, 64, 256)
+QUALITY = 80
+AVATAR_DIR = 'avatars'
+NAME_RE = re.compile(r'^avatars/([0-9a-f]{16})-(\d+)\.webp$')
+FILE_RE = re.compile(r'^([0-9a-f]{16})-(\d+)\.webp$')
+
+
+def rendition_name(digest, size):
+    return f'{AVATAR_DIR}/{digest}-{size}.webp'
+
+
+def rendition_for(name, size):
+    """File name of the smallest rendition at least size pixels wide, or None for an unprocessed photo"""
+    match = NAME_RE.match(name or '')
+    if match is None:
+        return None
+    size = next((s for s in SIZES if s >= size), SIZES[-1])
+    return f'{match.group(1)}-{size}.webp'
+
+
+def render(fileobj):
+    """Crop an image to a square and encode every rendition as WebP. Returns (digest, {size: bytes})."""
+    largest = SIZES[-1]
+    with Image.open(fileobj) as image:
+        # Let the JPEG decoder downscale while decoding instead of
+        # materializing every pixel of a phone photo
+        image.draft('RGB', (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image.convert('RGB'), (largest, largest), Image.Resampling.LANCZOS)
+
+    renditions = {}
+    for size in SIZES:
+        resized = image if size == largest else image.resize((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, 'WEBP', quality=QUALITY, method=6)
+        renditions[size] = buffer.getvalue()
+    digest = hashlib.sha256(renditions[largest]).hexdigest()[:16]
+    return digest, renditions
+
+
+def process(profile):
+    """Replace the profile's uploaded photo with its renditions"""
+    original = profile.photo.name
+    if not original or NAME_RE.match(original):
+        return False
+    with profile.photo.open('rb') as fh:
+        digest, renditions = render(fh)
+    # Content-hashed names never change meaning, so existing files are reused
+    for size, data in renditions.items():
+        name = rendition_name(digest, size)
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(data))
+    profile.photo.name = rendition_name(digest, SIZES[-1])
+    profile.save(update_fields=['photo'])
+    remove_photo(original)
+    return True
+
+
+def remove_photo(name):
+    """Delete a photo, or all renditions of one, once no profile refers to it"""
+    if not name or UserProfile.objects.filter(photo=name).exists():
+        return
+    match = NAME_RE.match(name)
+    names = [rendition_name(match.group(1), size) for size in SIZES] if match else [name]
+    for stale in names:
+        default_storage.delete(stale)
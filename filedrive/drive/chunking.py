@@ -0,0 +1,74 @@
+"""
+Content-defined chunking. Boundaries depend only on the bytes around them,
+so an edit in the middle of a file changes the chunks next to the edit and
+leaves the rest identical. This module has no Django dependencies and can
+be copied into sync clients, which must use exactly these parameters.
+"""
+import hashlib
+
+MIN_SIZE = 256 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+# A boundary is wherever the low MASK_BITS bits of the gear hash are zero,
+# which gives chunks of about MIN_SIZE + 2**MASK_BITS bytes
+MASK_BITS = 20
+MASK = (1 << MASK_BITS) - 1
+READ_SIZE = MAX_SIZE
+
+_U64 = (1 << 64) - 1
+
+
+def _gear_table():
+    # Derived from sha256 rather than a random seed so every client agrees
+    return [int.from_bytes(hashlib.sha256(b'filedrive-gear-%d' % i).digest()[:8], 'big') for i in range(256)]
+
+
+GEAR = _gear_table()
+
+
+def parameters():
+    """The chunking parameters, as advertised to clients"""
+    return {
+        'algorithm': 'gear-sha256',
+        'min_size': MIN_SIZE,
+        'max_size': MAX_SIZE,
+        'mask_bits': MASK_BITS,
+        'hash': 'sha256',
+    }
+
+
+def find_cut(buffer):
+    """Length of the next chunk at the start of buffer"""
+    length = len(buffer)
+    if length <= MIN_SIZE:
+        return length
+    end = min(length, MAX_SIZE)
+    gear = GEAR
+    h = 0
+    # Nothing before MIN_SIZE can be a boundary, so hashing starts there
+    for offset, byte in enumerate(memoryview(buffer)[MIN_SIZE:end], MIN_SIZE + 1):
+        h = ((h << 1) + gear[byte]) & _U64
+        if not h & MASK:
+            return offset
+    return end
+
+
+def iter_chunks(fh):
+    """Yield the chunks of a binary stream as bytes"""
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_SIZE:
+            block = fh.read(READ_SIZE)
+            if block:
+                buffer += block
+            else:
+                eof = True
+        if not buffer:
+            return
+        cut = find_cut(buffer)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).hexdigest()
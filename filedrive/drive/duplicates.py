@@ -0,0 +1,163 @@
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db.models import Count, Min
+from django.utils import timezone
+from .models import DuplicateReport, File, Job, Trash
+from . import jobs, journal, listing_cache, storage, trashed
+
+# Bytes hashed at each end of a file for the cheap comparison pass
+EDGE_SIZE = 64 * 1024
+CACHE_TIMEOUT = 60 * 60
+
+
+def candidate_files(owner=None):
+    """Files that may be reported or trashed as duplicates"""
+    # Chunked files already share storage for identical content
+    return trashed.active_files(owner).filter(current_version__isnull=True)
+
+
+def edge_hash(row):
+    """Hash of the first and last blocks of a file, or None if it cannot be read"""
+    digest = hashlib.sha256()
+    try:
+        with open(storage.path_for(row.file, row.tier), 'rb') as fh:
+            digest.update(fh.read(EDGE_SIZE))
+            fh.seek(max(EDGE_SIZE, row.size - EDGE_SIZE))
+            digest.update(fh.read(EDGE_SIZE))
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def full_hash(row):
+    try:
+        return storage.hash_path(storage.path_for(row.file, row.tier), row.encoding)[0]
+    except OSError:
+        return None
+
+
+def resolve_size_group(rows, pool):
+    """Split files of one size into groups of identical content"""
+    known = [row for row in rows if row.checksum]
+    unknown = [row for row in rows if not row.checksum]
+
+    if known or rows[0].size <= 2 * EDGE_SIZE or any(row.encoding for row in unknown):
+        # Compared against stored checksums, small, or compressed (where the
+        # last block means decompressing everything): hash in full
+        to_hash = unknown
+    else:
+        buckets = {}
+        for row, edge in zip(unknown, pool.map(edge_hash, unknown)):
+            if edge is not None:
+                buckets.setdefault(edge, []).append(row)
+        to_hash = [row for bucket in buckets.values() if len(bucket) > 1 for row in bucket]
+
+    checksums = {row.id: row.checksum for row in known}
+    for row, checksum in zip(to_hash, pool.map(full_hash, to_hash)):
+        if checksum is not None:
+            checksums[row.id] = checksum
+            # Remember the hash so the next run and trash_duplicates can use it
+            File.objects.filter(id=row.id, checksum='').update(checksum=checksum)
+
+    by_checksum = {}
+    for file_id, checksum in checksums.items():
+        by_checksum.setdefault(checksum, []).append(file_id)
+    return [
+        {'checksum': checksum, 'size': rows[0].size, 'files': sorted(ids), 'reclaimable': rows[0].size * (len(ids) - 1)}
+        for checksum, ids in by_checksum.items()
+        if len(ids) > 1
+    ]
+
+
+def find_duplicates(owner=None, workers=4):
+    """
+    Group identical files, narrowing candidates cheaply: files with a unique
+    size are ruled out in one query, then the first and last blocks are
+    compared, and only the survivors are hashed in full.
+    """
+    files = candidate_files(owner)
+    sizes = (
+        files.order_by().values('size')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1, size__gt=0)
+        .values('size')
+    )
+    candidates = (
+        files.filter(size__in=sizes)
+        .order_by('size', 'id')
+        .values_list('id', 'size', 'checksum', 'encoding', 'file', 'tier', named=True)
+    )
+
+    groups = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _, rows in itertools.groupby(candidates.iterator(), key=lambda row: row.size):
+            groups.extend(resolve_size_group(list(rows), pool))
+    groups.sort(key=lambda group: group['reclaimable'], reverse=True)
+    return {
+        'computed_at': timezone.now().isoformat(),
+        'groups': groups,
+        'reclaimable': sum(group['reclaimable'] for group in groups),
+    }
+
+
+def cache_key(owner):
+    if owner is None:
+        return 'duplicates:all'
+    # The journal cursor moves on every change, so stale reports are never served
+    cursor, _ = journal.current_cursor(owner)
+    return f'duplicates:{owner.id}:{cursor}'
+
+
+def get_duplicates(owner=None, refresh=False, workers=4):
+    key = cache_key(owner)
+    report = None if refresh else cache.get(key)
+    if report is None:
+        report = find_duplicates(owner, workers)
+        cache.set(key, report, CACHE_TIMEOUT)
+    return report
+
+
+def scan(owner, workers=4):
+    """Scan owner's drive and keep the result as their DuplicateReport"""
+    cursor, _ = journal.current_cursor(owner)
+    report = find_duplicates(owner, workers)
+    DuplicateReport.objects.update_or_create(
+        owner=owner, defaults={'cursor': cursor, 'report': report, 'computed_at': timezone.now()},
+    )
+    return report
+
+
+def request_scan(owner):
+    """Queue a scan of owner's drive unless one is already waiting or running"""
+    pending = Job.objects.filter(kind='find_duplicates', status__in=('queued', 'running'), payload__user_id=owner.id)
+    if not pending.exists():
+        jobs.enqueue('find_duplicates', user_id=owner.id)
+
+
+def latest_report(owner):
+    """
+    Returns (report or None, current): the last scan of owner's drive, and
+    whether their drive is unchanged since. Scans are never run here.
+    """
+    saved = DuplicateReport.objects.filter(owner=owner).first()
+    if saved is None:
+        return None, False
+    cursor, _ = journal.current_cursor(owner)
+    return saved.report, saved.cursor == cursor
+
+
+def trash_duplicates(user, checksum=None):
+    """Move every copy but the oldest of each duplicate group to the trash"""
+    files = candidate_files(user).exclude(checksum='')
+    if checksum:
+        files = files.filter(checksum=checksum)
+    duplicated = files.order_by().values('checksum').annotate(count=Count('id')).filter(count__gt=1).values('checksum')
+    keep = files.filter(checksum__in=duplicated).order_by().values('checksum').annotate(keep=Min('id')).values('keep')
+    victims = list(files.filter(checksum__in=duplicated).exclude(id__in=keep))
+
+    Trash.objects.bulk_create([Trash(owner=user, file=file_obj) for file_obj in victims])
+    listing_cache.bump_generations({file_obj.folder_id for file_obj in victims})
+    journal.record_changes(user, [('trash', file_obj) for file_obj in victims])
+    return len(victims), sum(file_obj.size for file_obj in victims)
@@ -0,0 +1,192 @@
+import json
+import os
+import tarfile
+import tempfile
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Q
+from .models import Change, File, Folder, Trash
+from . import journal
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = 'manifest.json'
+
+
+def tar_header(name, size=0, mtime=None, directory=False):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime.timestamp()) if mtime else int(timezone.now().timestamp())
+    if directory:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def padding(size):
+    return b'\0' * (-size % BLOCK_SIZE)
+
+
+def iter_member(name, fh, size, mtime):
+    """Yield one tar member, reading exactly size bytes from fh"""
+    yield tar_header(name, size, mtime)
+    remaining = size
+    while remaining:
+        chunk = fh.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            # The file shrank while streaming; keep the archive well formed
+            chunk = b'\0' * remaining
+        remaining -= len(chunk)
+        yield chunk
+    yield padding(size)
+
+
+def folder_paths(user):
+    """Map folder id to its path, like Folder.get_path() but in one query"""
+    rows = {
+        folder_id: (parent_id, name)
+        for folder_id, parent_id, name in Folder.objects.filter(owner=user).values_list('id', 'parent_id', 'name')
+    }
+    paths = {}
+
+    def resolve(folder_id):
+        chain = []
+        current = folder_id
+        while current in rows and current not in paths:
+            chain.append(current)
+            current = rows[current][0]
+        prefix = paths.get(current, '')
+        for item in reversed(chain):
+            name = rows[item][1].replace('/', '_')
+            prefix = f"{prefix}/{name}" if prefix else name
+            paths[item] = prefix
+        return paths.get(folder_id, '')
+
+    for folder_id in rows:
+        resolve(folder_id)
+    return paths
+
+
+def load_manifest_header(path):
+    """Return the generated_at and cursor recorded by a previous export"""
+    with open(path) as fh:
+        manifest = json.load(fh)
+    return parse_datetime(manifest['generated_at']), manifest['cursor']
+
+
+def iter_export(user, since=None, since_cursor=None):
+    """
+    Stream a tar archive of the user's folders and files, followed by a JSON
+    manifest. Memory use does not depend on file sizes: file bodies are
+    copied in chunks and the manifest is spooled to a temporary file.
+
+    With since and since_cursor from a previous manifest, only folders and
+    files changed after that export are included and deletions are listed.
+    """
+    generated_at = timezone.now()
+    cursor, floor = journal.current_cursor(user)
+    incremental = since is not None and since_cursor is not None and since_cursor >= floor
+
+    folders = Folder.objects.filter(owner=user)
+    files = File.objects.filter(owner=user)
+    deleted = []
+    if incremental:
+        changes = Change.objects.filter(user=user, cursor__gt=since_cursor)
+        folders = folders.filter(
+            Q(modified_at__gt=since) | Q(id__in=changes.filter(item_type='folder').values('item_id'))
+        )
+        files = files.filter(
+            Q(modified_at__gt=since) | Q(id__in=changes.filter(item_type='file').values('item_id'))
+        )
+        deleted = list(changes.filter(action='delete').values_list('item_type', 'item_id'))
+
+    paths = folder_paths(user)
+    trashed_files = set(Trash.objects.filter(owner=user, file__isnull=False).values_list('file_id', flat=True))
+    trashed_folders = set(Trash.objects.filter(owner=user, folder__isnull=False).values_list('folder_id', flat=True))
+
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spool:
+        def write(text):
+            spool.write(text.encode('utf-8'))
+
+        write(json.dumps({
+            'version': 1,
+            'user': user.username,
+            'generated_at': generated_at.isoformat(),
+            'cursor': cursor,
+            'incremental': incremental,
+            'since': since.isoformat() if incremental else None,
+        })[:-1])
+
+        write(', "folders": [')
+        separator = ''
+        for folder in folders.order_by('id').iterator(chunk_size=2000):
+            path = paths[folder.id]
+            yield tar_header(path + '/', mtime=folder.modified_at, directory=True)
+            write(separator + json.dumps({
+                'id': folder.id,
+                'parent': folder.parent_id,
+                'name': folder.name,
+                'path': path,
+                'public': folder.is_public,
+                'trashed': folder.id in trashed_folders,
+                'created_at': folder.created_at.isoformat(),
+                'modified_at': folder.modified_at.isoformat(),
+            }))
+            separator = ', '
+
+        write('], "files": [')
+        separator = ''
+        previous = None
+        for file_obj in files.select_related('current_version').order_by('folder_id', 'name', 'id').iterator(chunk_size=2000):
+            folder_path = paths.get(file_obj.folder_id, '')
+            name = file_obj.name.replace('/', '_')
+            # Files sharing a name in one folder are adjacent in this ordering
+            if previous == (file_obj.folder_id, file_obj.name):
+                root, ext = os.path.splitext(name)
+                name = f"{root} ({file_obj.id}){ext}"
+            previous = (file_obj.folder_id, file_obj.name)
+            path = f"{folder_path}/{name}" if folder_path else name
+
+            entry = {
+                'id': file_obj.id,
+                'folder': file_obj.folder_id,
+                'name': file_obj.name,
+                'path': path,
+                'size': file_obj.size,
+                'mime_type': file_obj.mime_type,
+                'category': file_obj.category,
+                'public': file_obj.is_public,
+                'trashed': file_obj.id in trashed_files,
+                'created_at': file_obj.created_at.isoformat(),
+                'modified_at': file_obj.modified_at.isoformat(),
+            }
+            try:
+                fh = file_obj.open_content()
+            except OSError:
+                entry['missing'] = True
+            else:
+                with fh:
+                    if file_obj.is_chunked():
+                        # Chunks are read in sequence; there is no single file to stat
+                        size = file_obj.current_version.size
+                    elif file_obj.encoding:
+                        # Compressed files are exported with their logical size
+                        size = file_obj.size
+                    else:
+                        size = os.fstat(fh.fileno()).st_size
+                    yield from iter_member(path, fh, size, file_obj.modified_at)
+            write(separator + json.dumps(entry))
+            separator = ', '
+
+        write('], "deleted": ' + json.dumps([
+            {'type': item_type, 'id': item_id} for item_type, item_id in deleted
+        ]) + '}\n')
+
+        size = spool.tell()
+        spool.seek(0)
+        yield from iter_member(MANIFEST_NAME, spool, size, generated_at)
+
+    # End of archive
+    yield b'\0' * (BLOCK_SIZE * 2)
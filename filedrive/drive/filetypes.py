@@ -0,0 +1,178 @@
+import mimetypes
+import os
+
+# Number of leading bytes read from a stream when sniffing its type
+HEAD_SIZE = 2048
+
+CATEGORY_EXTENSIONS = {
+    'image': ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp'],
+    'video': ['mp4', 'avi', 'mov', 'wmv', 'flv', 'webm', 'mkv'],
+    'audio': ['mp3', 'wav', 'flac', 'aac', 'ogg', 'wma'],
+    'pdf': ['pdf'],
+    'word': ['doc', 'docx'],
+    'excel': ['xls', 'xlsx'],
+    'powerpoint': ['ppt', 'pptx'],
+    'text': ['txt', 'md', 'py', 'js', 'html', 'css', 'scss', 'json', 'xml', 'csv'],
+    'archive': ['zip', 'rar', 'tar', 'gz', '7z'],
+}
+
+CATEGORY_CHOICES = [
+    ('image', 'Images'),
+    ('video', 'Videos'),
+    ('audio', 'Audio'),
+    ('pdf', 'PDFs'),
+    ('word', 'Word documents'),
+    ('excel', 'Spreadsheets'),
+    ('powerpoint', 'Presentations'),
+    ('text', 'Text and code'),
+    ('archive', 'Archives'),
+    ('other', 'Other'),
+]
+
+EXTENSION_CATEGORIES = {
+    extension: category
+    for category, extensions in CATEGORY_EXTENSIONS.items()
+    for extension in extensions
+}
+
+# (offset, signature, mime type) checked against the head of the stream
+MAGIC_SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'PK\x05\x06', 'application/zip'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (257, b'ustar', 'application/x-tar'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'\xff\xfb', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', 'video/x-ms-asf'),
+    (0, b'FLV\x01', 'video/x-flv'),
+    (0, b'\x1a\x45\xdf\xa3', 'video/webm'),
+]
+
+RIFF_FORMATS = {
+    b'WEBP': 'image/webp',
+    b'WAVE': 'audio/wav',
+    b'AVI ': 'video/x-msvideo',
+}
+
+# Sniffed types that only identify a container; the extension says what is inside
+CONTAINER_TYPES = {'application/zip', 'application/x-ole-storage', 'video/webm', 'video/x-ms-asf'}
+
+MIME_CATEGORIES = {
+    'application/pdf': 'pdf',
+    'application/zip': 'archive',
+    'application/vnd.rar': 'archive',
+    'application/x-7z-compressed': 'archive',
+    'application/gzip': 'archive',
+    'application/x-tar': 'archive',
+    'application/json': 'text',
+    'application/xml': 'text',
+}
+
+# Types the browser may render from the preview URL. Anything that can run
+# script (HTML, SVG, XML) is served as a download instead.
+INLINE_TYPES = {
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp', 'image/avif',
+    'application/pdf',
+}
+INLINE_MAJOR_TYPES = ('video', 'audio')
+
+
+def category_for_extension(extension):
+    """Return the category for a bare extension such as 'png'"""
+    return EXTENSION_CATEGORIES.get(extension.lower(), 'other')
+
+
+def category_for_mime(mime_type):
+    if mime_type in MIME_CATEGORIES:
+        return MIME_CATEGORIES[mime_type]
+    major = mime_type.split('/', 1)[0]
+    if major in ('image', 'video', 'audio', 'text'):
+        return major
+    return 'other'
+
+
+def is_inline_safe(mime_type):
+    """Whether content of mime_type can be shown inline without running script"""
+    mime_type = (mime_type or '').split(';', 1)[0].strip().lower()
+    return mime_type in INLINE_TYPES or mime_type.split('/', 1)[0] in INLINE_MAJOR_TYPES
+
+
+def read_head(fileobj, size=HEAD_SIZE):
+    """Read the first bytes of a file object and restore its position"""
+    position = fileobj.tell()
+    try:
+        fileobj.seek(0)
+        return fileobj.read(size)
+    finally:
+        fileobj.seek(position)
+
+
+def sniff_mime(head):
+    """Return the MIME type identified by magic bytes, or None"""
+    if head[:4] == b'RIFF' and head[8:12] in RIFF_FORMATS:
+        return RIFF_FORMATS[head[8:12]]
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand == b'qt  ':
+            return 'video/quicktime'
+        if brand in (b'M4A ', b'M4B '):
+            return 'audio/mp4'
+        return 'video/mp4'
+    for offset, signature, mime_type in MAGIC_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime_type
+    return None
+
+
+def looks_like_text(head):
+    if b'\x00' in head:
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character may be cut off at the end of the head
+        return e.start >= len(head) - 3
+    return True
+
+
+def detect_file_type(name, fileobj=None):
+    """
+    Return (category, mime_type) for a file. The leading bytes of fileobj take
+    precedence over the extension of name; without a stream only the
+    extension is used.
+    """
+    extension = os.path.splitext(name)[1][1:].lower()
+    extension_category = category_for_extension(extension)
+    extension_mime = mimetypes.guess_type(name)[0]
+
+    head = b''
+    if fileobj is not None:
+        try:
+            head = read_head(fileobj)
+        except (OSError, ValueError):
+            head = b''
+
+    sniffed = sniff_mime(head) if head else None
+    if sniffed in CONTAINER_TYPES and extension_category != 'other':
+        # e.g. a .docx is a zip file and a .mkv shares the webm signature
+        return extension_category, extension_mime or sniffed
+    if sniffed:
+        return category_for_mime(sniffed), sniffed
+
+    if extension_category != 'other':
+        return extension_category, extension_mime or 'application/octet-stream'
+    if extension_mime:
+        return category_for_mime(extension_mime), extension_mime
+    if head and looks_like_text(head):
+        return 'text', 'text/plain'
+    return 'other', 'application/octet-stream'
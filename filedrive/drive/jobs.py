@@ -0,0 +1,137 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+# A running job whose worker has not finished it within the lease is reclaimed
+LEASE = timedelta(minutes=15)
+BACKOFF_BASE = 10  # seconds
+BACKOFF_MAX = 60 * 60
+
+
+def handler(kind):
+    """Register a function as the handler for jobs of the given kind"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, max_attempts=5, **payload):
+    """
+    Queue a job for the workers. Handlers must be idempotent: a job can run
+    more than once if a worker dies after finishing it but before recording
+    that. With DRIVE_JOBS_EAGER the handler runs immediately instead.
+    """
+    if getattr(settings, 'DRIVE_JOBS_EAGER', False):
+        HANDLERS[kind](**payload)
+        return None
+    return Job.objects.create(kind=kind, payload=payload, max_attempts=max_attempts)
+
+
+def enqueue_many(kind, payloads, max_attempts=5):
+    payloads = list(payloads)
+    if getattr(settings, 'DRIVE_JOBS_EAGER', False):
+        for payload in payloads:
+            HANDLERS[kind](**payload)
+        return
+    Job.objects.bulk_create(
+        [Job(kind=kind, payload=payload, max_attempts=max_attempts) for payload in payloads],
+        batch_size=1000,
+    )
+
+
+def claimable(now):
+    return Job.objects.filter(
+        Q(status='queued', run_at__lte=now) | Q(status='running', locked_at__lt=now - LEASE)
+    ).order_by('run_at', 'id')
+
+
+def claim(worker_id, limit=1):
+    """Atomically take up to limit due jobs for this worker"""
+    now = timezone.now()
+    claimed = []
+    if connection.features.has_select_for_update_skip_locked:
+        # Concurrent workers skip each other's locked rows instead of waiting
+        with transaction.atomic():
+            jobs = list(claimable(now).select_for_update(skip_locked=True)[:limit])
+            Job.objects.filter(id__in=[job.id for job in jobs]).update(
+                status='running', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+            )
+        claimed = jobs
+    else:
+        # SQLite fallback: compare-and-set on (status, attempts), which only
+        # one worker can win for a given job
+        for job in claimable(now)[:limit * 4]:
+            updated = Job.objects.filter(id=job.id, status=job.status, attempts=job.attempts).update(
+                status='running', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+            )
+            if updated:
+                claimed.append(job)
+                if len(claimed) >= limit:
+                    break
+
+    for job in claimed:
+        job.status = 'running'
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.attempts += 1
+    return claimed
+
+
+def backoff(attempts):
+    """Exponential backoff with jitter, in seconds"""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run(job):
+    """Run a claimed job and record the outcome. Returns True on success."""
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error(f"Job {job} failed permanently: {error}")
+            Job.objects.filter(id=job.id, locked_by=job.locked_by).update(
+                status='failed', last_error=error, finished_at=timezone.now(),
+            )
+        else:
+            retry_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+            Job.objects.filter(id=job.id, locked_by=job.locked_by).update(
+                status='queued', last_error=error, run_at=retry_at, locked_by='', locked_at=None,
+            )
+        return False
+
+    Job.objects.filter(id=job.id, locked_by=job.locked_by).update(
+        status='done', finished_at=timezone.now(), locked_at=None,
+    )
+    return True
+
+
+def queue_depth():
+    """Job counts by status plus the age of the oldest due job"""
+    counts = dict(Job.objects.order_by().values_list('status').annotate(count=Count('id')))
+    now = timezone.now()
+    oldest = Job.objects.filter(status='queued', run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+    stats = {status: counts.get(status, 0) for status, _ in Job.STATUS_CHOICES}
+    stats['oldest_due_seconds'] = (now - oldest).total_seconds() if oldest else 0
+    return stats
+
+
+def purge_finished(older_than):
+    """Delete done jobs that finished before now - older_than"""
+    deleted, _ = Job.objects.filter(status='done', finished_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,88 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Change, ChangeCursor, File
+from . import listing_cache
+
+# Columns returned by the changes endpoint, in the order of each change array
+CHANGE_FIELDS = ['cursor', 'action', 'type', 'id', 'parent', 'name', 'size', 'public']
+
+
+def allocate_cursors(user, count=1):
+    """
+    Reserve count consecutive cursor values for user and return the first.
+    Must run inside a transaction: the row lock taken by the UPDATE orders
+    concurrent writers for the same user until commit.
+    """
+    updated = ChangeCursor.objects.filter(user=user).update(value=F('value') + count)
+    if not updated:
+        try:
+            with transaction.atomic():
+                ChangeCursor.objects.create(user=user, value=count)
+        except IntegrityError:
+            # Another request created the row first
+            ChangeCursor.objects.filter(user=user).update(value=F('value') + count)
+    value = ChangeCursor.objects.filter(user=user).values_list('value', flat=True).get()
+    return value - count + 1
+
+
+def build_change(user, cursor, action, item):
+    if isinstance(item, File):
+        return Change(
+            user=user, cursor=cursor, action=action, item_type='file', item_id=item.pk,
+            parent_id=item.folder_id, name=item.name, size=item.size, is_public=item.is_public,
+        )
+    return Change(
+        user=user, cursor=cursor, action=action, item_type='folder', item_id=item.pk,
+        parent_id=item.parent_id, name=item.name, is_public=item.is_public,
+    )
+
+
+def record_changes(user, entries):
+    """Append (action, item) pairs to the user's change journal"""
+    entries = list(entries)
+    if not entries:
+        return
+    with transaction.atomic():
+        first = allocate_cursors(user, len(entries))
+        Change.objects.bulk_create([
+            build_change(user, first + offset, action, item)
+            for offset, (action, item) in enumerate(entries)
+        ])
+        # Every journaled change also invalidates the listings showing the item
+        listing_cache.bump_generations(
+            folder_id
+            for _, item in entries
+            for folder_id in ([item.folder_id] if isinstance(item, File) else [item.parent_id, item.pk])
+        )
+
+
+def record_change(user, action, item):
+    record_changes(user, [(action, item)])
+
+
+def current_cursor(user):
+    """Return (value, floor) of the user's journal"""
+    state = ChangeCursor.objects.filter(user=user).values_list('value', 'floor').first()
+    return state or (0, 0)
+
+
+def changes_since(user, cursor, limit):
+    """
+    Return (changes, next_cursor, has_more) after cursor. Within a batch only
+    the latest change for each item is kept, since every row is a snapshot.
+    """
+    rows = list(
+        Change.objects.filter(user=user, cursor__gt=cursor)
+        .order_by('cursor')
+        .values_list('cursor', 'action', 'item_type', 'item_id', 'parent_id', 'name', 'size', 'is_public')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], cursor, False
+
+    latest = {}
+    for row in rows:
+        latest[(row[2], row[3])] = row
+    changes = sorted(latest.values())
+    return changes, rows[-1][0], has_more
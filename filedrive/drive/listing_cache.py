@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.template.loader import render_to_string
+from .models import Folder
+from . import metrics
+
+PAGE_SIZE = 100
+TIMEOUT = 24 * 60 * 60
+
+# Sort name -> (label, folder ordering, file ordering); folders always come first
+SORTS = {
+    'name': ('Name (A-Z)', ['name', 'id'], ['name', 'id']),
+    '-name': ('Name (Z-A)', ['-name', '-id'], ['-name', '-id']),
+    'newest': ('Newest', ['-modified_at', '-id'], ['-modified_at', '-id']),
+    'oldest': ('Oldest', ['modified_at', 'id'], ['modified_at', 'id']),
+    'largest': ('Largest', ['name', 'id'], ['-size', 'id']),
+}
+DEFAULT_SORT = 'name'
+
+
+def get_cache():
+    return caches[getattr(settings, 'DRIVE_LISTING_CACHE', 'default')]
+
+
+def bump_generations(folder_ids):
+    """
+    Invalidate the cached listings of the given folders. Entries are keyed by
+    generation, so old ones are never looked up again and simply expire.
+    """
+    folder_ids = {folder_id for folder_id in folder_ids if folder_id is not None}
+    if folder_ids:
+        Folder.objects.filter(id__in=folder_ids).update(generation=F('generation') + 1)
+
+
+def cache_key(folder, sort, category, page, variant):
+    return f'listing:{folder.id}:{folder.generation}:{sort}:{category}:{page}:{variant}'
+
+
+def stats():
+    """Hits and misses of all processes, from the metrics snapshots"""
+    counters, _, _ = metrics.aggregate()
+    return {
+        'hits': counters.get(('drive_listing_cache_lookups_total', (('result', 'hit'),)), 0),
+        'misses': counters.get(('drive_listing_cache_lookups_total', (('result', 'miss'),)), 0),
+    }
+
+
+def build_listing(folder, sort, category, page):
+    """One page of a folder: subfolders first, then files, without those in the trash"""
+    _, folder_order, file_order = SORTS[sort]
+    subfolders = folder.children.filter(trash__isnull=True).order_by(*folder_order)
+    files = folder.files.filter(trash__isnull=True).order_by(*file_order)
+    if category:
+        files = files.filter(category=category)
+
+    folder_count = subfolders.count()
+    total = folder_count + files.count()
+    num_pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = min(max(page, 1), num_pages)
+    start, end = (page - 1) * PAGE_SIZE, page * PAGE_SIZE
+
+    folder_rows = list(subfolders.values('id', 'name', 'modified_at', 'is_public')[start:end]) if start < folder_count else []
+    file_rows = []
+    if end > folder_count:
+        for file_obj in files.only('id', 'name', 'size', 'category', 'mime_type', 'file_type', 'is_public', 'modified_at')[max(start - folder_count, 0):end - folder_count]:
+            file_rows.append({
+                'id': file_obj.id,
+                'name': file_obj.name,
+                'size': file_obj.size,
+                'category': file_obj.get_file_category(),
+                'mime_type': file_obj.mime_type,
+                'is_public': file_obj.is_public,
+                'modified_at': file_obj.modified_at,
+            })
+    return {
+        'folder': folder.id,
+        'generation': folder.generation,
+        'sort': sort,
+        'page': page,
+        'num_pages': num_pages,
+        'count': total,
+        'folders': folder_rows,
+        'files': file_rows,
+    }
+
+
+def fetch(cache, key, build):
+    value = cache.get(key)
+    if value is None:
+        metrics.inc('drive_listing_cache_lookups_total', result='miss')
+        value = build()
+        cache.set(key, value, TIMEOUT)
+    else:
+        metrics.inc('drive_listing_cache_lookups_total', result='hit')
+    return value
+
+
+def get_listing(folder, sort=DEFAULT_SORT, category='', page=1):
+    """Listing data for one page of folder, from the cache while its generation is unchanged"""
+    cache = get_cache()
+    return fetch(cache, cache_key(folder, sort, category, page, 'data'), lambda: build_listing(folder, sort, category, page))
+
+
+def get_listing_html(folder, sort=DEFAULT_SORT, category='', page=1):
+    """Rendered listing fragment for folder.html, built from the cached data when present"""
+    cache = get_cache()
+
+    def render():
+        data_key = cache_key(folder, sort, category, page, 'data')
+        listing = cache.get(data_key)
+        if listing is None:
+            listing = build_listing(folder, sort, category, page)
+            cache.set(data_key, listing, TIMEOUT)
+        return render_to_string('drive/_folder_listing.html', {
+            'folder': folder, 'listing': listing, 'sort': sort, 'category': category,
+        })
+
+    return fetch(cache, cache_key(folder, sort, category, page, 'html'), render)
@@ -0,0 +1,67 @@
+import atexit
+import threading
+import time
+from django.contrib.auth.models import User
+from django.db import connections
+from django.utils import timezone
+
+# last_login is written for many logins at once instead of one UPDATE each
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 30  # seconds
+
+_lock = threading.Lock()
+_pending = {}  # user id -> last login time
+_last_flush = time.monotonic()
+_timer = None  # flushes a partial batch FLUSH_INTERVAL after its first entry
+
+
+def record_login(sender, user, **kwargs):
+    """
+    user_logged_in receiver replacing django.contrib.auth.models.update_last_login.
+    Password reset tokens include last_login, so they stay valid until the next
+    flush, at most FLUSH_INTERVAL seconds, rather than expiring at the moment
+    of login.
+    """
+    global _timer
+    # Keep the in-memory user consistent with what will be written
+    user.last_login = timezone.now()
+    with _lock:
+        _pending[user.pk] = user.last_login
+        due = len(_pending) >= FLUSH_SIZE or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if not due and _timer is None:
+            # A quiet worker would otherwise hold the batch until the next login
+            _timer = threading.Timer(FLUSH_INTERVAL, flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+    if due:
+        flush()
+
+
+def flush_in_background():
+    try:
+        flush()
+    finally:
+        # The timer thread's connection would otherwise stay open
+        connections.close_all()
+
+
+def flush():
+    """Write buffered last_login values. Returns the number of users updated."""
+    global _last_flush, _timer
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    if not pending:
+        return 0
+    User.objects.bulk_update(
+        [User(pk=user_id, last_login=logged_in_at) for user_id, logged_in_at in pending.items()],
+        ['last_login'],
+    )
+    return len(pending)
+
+
+atexit.register(flush)
@@ -0,0 +1,62 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from drive import access, storage
+
+class Command(BaseCommand):
+    help = 'Moves files that are no longer read to cold storage (DRIVE_COLD_STORAGE_ROOT)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=0, help="Stop after moving this many files (0: no limit)")
+        parser.add_argument('--max-mb-per-sec', type=float, default=0, help="Limit copy throughput (0: unlimited)")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move")
+
+    def handle(self, *args, **options):
+        if storage.tier_root('cold') is None:
+            raise CommandError("Tiering is disabled; set DRIVE_COLD_STORAGE_ROOT")
+
+        # Pending hits from this process must count before deciding what is cold
+        access.flush()
+        now = timezone.now()
+        queryset = access.cold_candidates(now)
+        limit = options['limit']
+        max_rate = options['max_mb_per_sec'] * 1024 * 1024
+        started = time.monotonic()
+
+        # Moved files leave the candidate set, so an interrupted run simply
+        # resumes on the next invocation
+        last_id = 0
+        moved = 0
+        moved_bytes = 0
+        while not limit or moved < limit:
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for file_obj in batch:
+                if not access.is_cold(file_obj, now):
+                    continue
+                if options['dry_run']:
+                    moved += 1
+                    moved_bytes += file_obj.stored_size or file_obj.size
+                else:
+                    try:
+                        size = storage.move_to_tier(file_obj, 'cold')
+                    except OSError as e:
+                        self.stderr.write(f"Could not move file {file_obj.id}: {e}")
+                        continue
+                    if size:
+                        moved += 1
+                        moved_bytes += size
+                if limit and moved >= limit:
+                    break
+                if max_rate:
+                    behind = moved_bytes / max_rate - (time.monotonic() - started)
+                    if behind > 0:
+                        time.sleep(behind)
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} files ({moved_bytes / (1024 * 1024):.1f} MB) to cold storage"
+        ))
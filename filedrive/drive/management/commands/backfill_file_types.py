@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from drive.models import File
+from drive import filetypes
+
+class Command(BaseCommand):
+    help = 'Detects and stores the category and MIME type of files uploaded before type detection existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--extension-only', action='store_true',
+                            help="Use only the file name, without reading the first bytes from disk")
+        parser.add_argument('--all', action='store_true',
+                            help="Re-detect every file, not only those without a MIME type")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = File.objects.all() if options['all'] else File.objects.filter(mime_type='')
+        queryset = queryset.only('id', 'name', 'file').order_by('id')
+
+        last_id = 0
+        updated = 0
+        unreadable = 0
+        while True:
+            # Keyset pagination keeps each batch query cheap on large tables
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            for file_obj in batch:
+                if options['extension_only']:
+                    file_obj.category, file_obj.mime_type = filetypes.detect_file_type(file_obj.name)
+                    continue
+                try:
+                    with file_obj.open_content() as fh:
+                        file_obj.category, file_obj.mime_type = filetypes.detect_file_type(file_obj.name, fh)
+                except OSError:
+                    unreadable += 1
+                    file_obj.category, file_obj.mime_type = filetypes.detect_file_type(file_obj.name)
+
+            File.objects.bulk_update(batch, ['category', 'mime_type'])
+            updated += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Updated {updated} files")
+
+        if unreadable:
+            self.stdout.write(self.style.WARNING(f"{unreadable} files could not be read; detected from name only"))
+        self.stdout.write(self.style.SUCCESS(f"Backfilled file types for {updated} files"))
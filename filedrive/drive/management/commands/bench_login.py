@@ -0,0 +1,65 @@
+import secrets
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import Client
+from drive import logins
+
+class Command(BaseCommand):
+    help = 'Measures login throughput through the full request stack to size the auth tier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50, help="Logins per thread")
+        parser.add_argument('--threads', type=int, default=4)
+
+    def handle(self, *args, **options):
+        username = f'bench-login-{secrets.token_hex(4)}'
+        password = secrets.token_urlsafe(16)
+        user = User.objects.create_user(username, password=password)
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+
+        # Cost of one password check on its own, for comparison
+        started = time.perf_counter()
+        check_password(password, user.password)
+        hash_seconds = time.perf_counter() - started
+
+        def run(n):
+            client = Client(HTTP_HOST=host)
+            timings = []
+            try:
+                for _ in range(options['logins']):
+                    started = time.perf_counter()
+                    response = client.post('/login/', {'username': username, 'password': password})
+                    timings.append(time.perf_counter() - started)
+                    if response.status_code != 302:
+                        raise RuntimeError(f"Login failed with status {response.status_code}")
+                    client.post('/logout/')
+            finally:
+                close_old_connections()
+            return timings
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                timings = [t for result in pool.map(run, range(options['threads'])) for t in result]
+            elapsed = time.perf_counter() - started
+        finally:
+            logins.flush()
+            user.delete()
+
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(f"Password hash: {hash_seconds * 1000:.1f} ms ({user.password.split('$')[0]})")
+        self.stdout.write(
+            f"Login latency: mean {statistics.mean(timings) * 1000:.1f} ms, "
+            f"p95 {p95 * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(timings)} logins in {elapsed:.2f}s with {options['threads']} threads: "
+            f"{len(timings) / elapsed:.1f} logins/s"
+        ))
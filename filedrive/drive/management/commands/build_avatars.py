@@ -0,0 +1,48 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from drive.models import UserProfile
+from drive import avatars
+
+class Command(BaseCommand):
+    help = 'Replaces existing profile photos with avatar renditions and removes unused photo files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cleanup', action='store_true', help="Delete photo files no profile refers to")
+
+    def handle(self, *args, **options):
+        processed = 0
+        failed = 0
+        for profile in UserProfile.objects.exclude(photo='').exclude(photo__isnull=True).iterator():
+            try:
+                if avatars.process(profile):
+                    processed += 1
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"Could not process photo of {profile}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} profile photos"))
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} photos could not be read and were left as they are"))
+
+        if options['cleanup']:
+            self.cleanup()
+
+    def cleanup(self):
+        """Remove leftover uploads and renditions, such as suffixed copies of re-uploaded photos"""
+        referenced = set(UserProfile.objects.exclude(photo='').values_list('photo', flat=True))
+        keep = set(referenced)
+        for name in referenced:
+            match = avatars.NAME_RE.match(name)
+            if match:
+                keep.update(avatars.rendition_name(match.group(1), size) for size in avatars.SIZES)
+
+        removed = 0
+        for directory in ('profile_photos', avatars.AVATAR_DIR):
+            if not default_storage.exists(directory):
+                continue
+            _, files = default_storage.listdir(directory)
+            for filename in files:
+                name = f'{directory}/{filename}'
+                if name not in keep:
+                    default_storage.delete(name)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} unused photo files"))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from drive.models import Folder, File
+from drive import journal
 
 class Command(BaseCommand):
     help = 'Checks and fixes data consistency issues in the file drive'
@@ -27,15 +28,18 @@ class Command(BaseCommand):
                     for subfolder in folder.children.all():
                         subfolder.parent = root_folder
                         subfolder.save()
+                        journal.record_change(user, 'move', subfolder)
                         self.stdout.write(f"Moved folder '{subfolder.name}' to root")
                     
                     # Move files
                     for file in folder.files.all():
                         file.folder = root_folder
                         file.save()
+                        journal.record_change(user, 'move', file)
                         self.stdout.write(f"Moved file '{file.name}' to root")
                     
                     # Delete the extra root folder
+                    journal.record_change(user, 'delete', folder)
                     folder.delete()
                     self.stdout.write(f"Deleted extra root folder")
             else:
@@ -48,6 +52,7 @@ class Command(BaseCommand):
                 for file in orphaned_files:
                     file.folder = root_folder
                     file.save()
+                    journal.record_change(user, 'move', file)
                     self.stdout.write(f"Moved orphaned file '{file.name}' to root")
             
             # Check for orphaned folders (not in any folder and not root)
@@ -57,6 +62,7 @@ class Command(BaseCommand):
                 for folder in orphaned_folders:
                     folder.parent = root_folder
                     folder.save()
+                    journal.record_change(user, 'move', folder)
                     self.stdout.write(f"Moved orphaned folder '{folder.name}' to root")
             
             # Print final counts
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from drive.models import Folder
+from drive import journal
 
 class Command(BaseCommand):
     help = 'Cleans up multiple root folders for users, ensuring each user has only one root folder'
@@ -23,13 +24,16 @@ class Command(BaseCommand):
                     for subfolder in folder.children.all():
                         subfolder.parent = root_folder_to_keep
                         subfolder.save()
+                        journal.record_change(user, 'move', subfolder)
                     
                     # Move files
                     for file in folder.files.all():
                         file.folder = root_folder_to_keep
                         file.save()
+                        journal.record_change(user, 'move', file)
                     
                     # Delete the extra root folder
+                    journal.record_change(user, 'delete', folder)
                     folder.delete()
                 
                 self.stdout.write(self.style.SUCCESS(f"Cleaned up root folders for user {user.username}"))
\ No newline at end of file
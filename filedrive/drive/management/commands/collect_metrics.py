@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from drive import metrics
+
+class Command(BaseCommand):
+    help = 'Queries queue depth and storage usage for the /metrics endpoint, which never queries the database itself'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help="Keep collecting every this many seconds (0: once)")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            gauges = metrics.collect_gauges()
+            metrics.write_gauges(gauges)
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {len(gauges)} gauges to {metrics.metrics_dir()} in {time.monotonic() - started:.2f}s"
+            ))
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
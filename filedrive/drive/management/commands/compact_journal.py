@@ -0,0 +1,53 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from drive.models import Change, ChangeCursor
+
+class Command(BaseCommand):
+    help = 'Compacts the change journal so it stays bounded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help="Drop changes older than this many days")
+        parser.add_argument('--max-per-user', type=int, default=10000,
+                            help="Keep at most this many changes per user")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        superseded_total = 0
+        expired_total = 0
+
+        for state in ChangeCursor.objects.select_related('user').iterator():
+            changes = Change.objects.filter(user_id=state.user_id)
+
+            # Every change is a full snapshot of its item, so older changes to
+            # the same item can go without clients missing anything
+            latest = (
+                changes.order_by()
+                .values('item_type', 'item_id')
+                .annotate(last=Max('cursor'))
+                .values('last')
+            )
+            superseded, _ = changes.exclude(cursor__in=latest).delete()
+            superseded_total += superseded
+
+            # Anything older than the age or size limit is dropped and the floor
+            # raised, which tells clients behind it to re-crawl
+            horizon = state.value - options['max_per_user']
+            expired = changes.filter(Q(cursor__lte=horizon) | Q(timestamp__lt=cutoff))
+            top = expired.aggregate(top=Max('cursor'))['top']
+            if top is not None:
+                with transaction.atomic():
+                    ChangeCursor.objects.filter(pk=state.pk).update(floor=Greatest(F('floor'), top))
+                    deleted, _ = changes.filter(cursor__lte=top).delete()
+                expired_total += deleted
+
+            if superseded or top is not None:
+                self.stdout.write(f"Compacted journal for user {state.user.username}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {superseded_total} superseded and {expired_total} expired changes"
+        ))
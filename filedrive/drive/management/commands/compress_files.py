@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from drive.models import File
+from drive import storage
+
+class Command(BaseCommand):
+    help = 'Compresses stored files of compressible categories according to DRIVE_COMPRESSION'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if storage.compression_encoding() is None:
+            raise CommandError("Compression is disabled; set DRIVE_COMPRESSION to 'gzip' or 'zstd'")
+
+        categories = getattr(settings, 'DRIVE_COMPRESSED_CATEGORIES', ['text'])
+        queryset = File.objects.filter(encoding='', category__in=categories).order_by('id')
+
+        last_id = 0
+        compressed = 0
+        saved = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for file_obj in batch:
+                before = file_obj.stored_size or file_obj.size
+                try:
+                    if storage.compress_file(file_obj):
+                        compressed += 1
+                        saved += before - file_obj.stored_size
+                except OSError as e:
+                    self.stderr.write(f"Could not compress file {file_obj.id}: {e}")
+            last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compressed {compressed} files, saving {saved / (1024 * 1024):.1f} MB"
+        ))
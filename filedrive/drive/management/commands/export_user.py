@@ -0,0 +1,39 @@
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from drive.export import iter_export, load_manifest_header
+
+class Command(BaseCommand):
+    help = 'Streams a tar archive of a user\'s folders, files and a JSON manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('-o', '--output', help="Archive path (default: standard output)")
+        parser.add_argument('--since', metavar='MANIFEST',
+                            help="manifest.json of a previous export; only include what changed after it")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        since = since_cursor = None
+        if options['since']:
+            try:
+                since, since_cursor = load_manifest_header(options['since'])
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Could not read manifest {options['since']}: {e}")
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in iter_export(user, since=since, since_cursor=since_cursor):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,40 @@
+import os
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from drive.models import File
+from drive import duplicates
+
+class Command(BaseCommand):
+    help = 'Reports groups of identical files for one user or across the whole drive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only this user's files (default: all users)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="Threads used for hashing")
+        parser.add_argument('--cached', action='store_true', help="Reuse a cached report if one exists")
+        parser.add_argument('--limit', type=int, default=20, help="Groups to list (0: all)")
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['user']:
+            try:
+                owner = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist")
+
+        report = duplicates.get_duplicates(owner, refresh=not options['cached'], workers=options['workers'])
+        groups = report['groups']
+        shown = groups[:options['limit']] if options['limit'] else groups
+        names = File.objects.select_related('owner').in_bulk([file_id for group in shown for file_id in group['files']])
+        for group in shown:
+            self.stdout.write(
+                f"{group['checksum'][:12]}  {len(group['files'])} x {group['size']} bytes, "
+                f"{group['reclaimable']} reclaimable"
+            )
+            for file_id in group['files']:
+                file_obj = names.get(file_id)
+                if file_obj:
+                    self.stdout.write(f"    [{file_obj.owner.username}] {file_obj.id}: {file_obj.name}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(groups)} duplicate groups, {report['reclaimable'] / (1024 * 1024):.1f} MB reclaimable"
+        ))
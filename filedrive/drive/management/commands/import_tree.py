@@ -0,0 +1,192 @@
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from drive.models import Folder, File
+from drive import filetypes, jobs, journal, operations, storage
+
+def store_file(source, name, link):
+    """Copy or hardlink source into media storage, sniff its type and compress it if enabled"""
+    field = File._meta.get_field('file')
+    while True:
+        storage_name = default_storage.get_available_name(
+            field.generate_filename(None, name), max_length=field.max_length
+        )
+        destination = default_storage.path(storage_name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            if link:
+                os.link(source, destination)
+            else:
+                # Reserve the name before copying so parallel workers never share it
+                os.close(os.open(destination, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                shutil.copyfile(source, destination)
+            break
+        except FileExistsError:
+            continue
+
+    with open(destination, 'rb') as fh:
+        category, mime_type = filetypes.detect_file_type(name, fh)
+
+    encoding = ''
+    stored_size = os.path.getsize(destination)
+    if not link and storage.should_compress(category):
+        result = storage.compress_path(storage_name, storage.compression_encoding(), field.max_length)
+        if result is not None:
+            encoding = storage.compression_encoding()
+            storage_name, stored_size = result
+            os.remove(destination)
+    return storage_name, category, mime_type, encoding, stored_size
+
+class Command(BaseCommand):
+    help = 'Imports a local directory tree into a user\'s drive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('source', help="Local directory to import")
+        parser.add_argument('--folder', type=int, help="ID of the folder to import into (default: the user's root folder)")
+        parser.add_argument('--link', action='store_true', help="Hardlink files instead of copying them")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            self.user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+        source = os.path.abspath(options['source'])
+        if not os.path.isdir(source):
+            raise CommandError(f"{source} is not a directory")
+
+        if options['folder']:
+            try:
+                target = Folder.objects.get(id=options['folder'], owner=self.user)
+            except Folder.DoesNotExist:
+                raise CommandError(f"Folder {options['folder']} does not belong to {self.user.username}")
+        else:
+            target = Folder.objects.filter(owner=self.user, parent=None).first()
+            if target is None:
+                target = Folder.objects.create(name='Home', owner=self.user, parent=None)
+
+        # Everything imported lies below target
+        self.in_trash = target.in_trash
+        self.quota = operations.quota()
+        self.used = operations.used_space(self.user)
+
+        self.link = options['link']
+        self.batch_size = options['batch_size']
+        self.max_pending = options['workers'] * 4
+        self.pending = {}
+        self.rows = []
+        self.imported_files = 0
+        self.imported_bytes = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+        over_quota = False
+        with ThreadPoolExecutor(max_workers=options['workers']) as self.pool:
+            directories = deque([(source, target.id)])
+            while directories and not over_quota:
+                path, folder_id = directories.popleft()
+                over_quota = self.import_directory(path, folder_id, directories)
+            self.drain(wait_all=True)
+        self.flush()
+
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        if over_quota:
+            self.stdout.write(self.style.WARNING("Stopped: the user's storage quota is full. Re-run after freeing space to resume."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported_files} files ({self.imported_bytes / (1024 * 1024):.1f} MB) in {elapsed:.1f}s, "
+            f"{self.imported_files / elapsed:.0f} files/s, {self.imported_bytes / (1024 * 1024) / elapsed:.1f} MB/s; "
+            f"skipped {self.skipped} already imported"
+        ))
+        if self.failed:
+            self.stdout.write(self.style.WARNING(f"{self.failed} files could not be imported; re-run to retry them"))
+
+    def import_directory(self, path, folder_id, directories):
+        """Queue the files of one directory and its subdirectories; return True when over quota"""
+        subdirectories = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry)
+
+        # Existing children make the import resumable
+        existing_folders = dict(Folder.objects.filter(parent_id=folder_id).values_list('name', 'id'))
+        new_folders = [
+            Folder(name=entry.name, owner=self.user, parent_id=folder_id, in_trash=self.in_trash)
+            for entry in sorted(subdirectories, key=lambda e: e.name)
+            if entry.name not in existing_folders
+        ]
+        if new_folders:
+            Folder.objects.bulk_create(new_folders)
+            journal.record_changes(self.user, [('create', folder) for folder in new_folders])
+            existing_folders.update((folder.name, folder.id) for folder in new_folders)
+        for entry in sorted(subdirectories, key=lambda e: e.name):
+            directories.append((entry.path, existing_folders[entry.name]))
+
+        existing_files = set(File.objects.filter(folder_id=folder_id).values_list('name', flat=True))
+        for entry in sorted(files, key=lambda e: e.name):
+            if entry.name in existing_files:
+                self.skipped += 1
+                continue
+            size = entry.stat(follow_symlinks=False).st_size
+            if self.used + size > self.quota:
+                return True
+            self.used += size
+
+            if len(self.pending) >= self.max_pending:
+                self.drain()
+            future = self.pool.submit(store_file, entry.path, entry.name, self.link)
+            self.pending[future] = (entry.path, entry.name, size, folder_id)
+        return False
+
+    def drain(self, wait_all=False):
+        """Collect finished copies into File rows"""
+        if not self.pending:
+            return
+        done, _ = wait(self.pending, return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED)
+        for future in done:
+            path, name, size, folder_id = self.pending.pop(future)
+            try:
+                storage_name, category, mime_type, encoding, stored_size = future.result()
+            except OSError as e:
+                self.stderr.write(f"Could not import {path}: {e}")
+                self.failed += 1
+                self.used -= size
+                continue
+            self.rows.append(File(
+                name=name, owner=self.user, folder_id=folder_id, file=storage_name, size=size,
+                file_type=os.path.splitext(name)[1][1:].lower(), category=category, mime_type=mime_type,
+                encoding=encoding, stored_size=stored_size,
+            ))
+            self.imported_files += 1
+            self.imported_bytes += size
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        File.objects.bulk_create(self.rows)
+        journal.record_changes(self.user, [('create', file_obj) for file_obj in self.rows])
+        jobs.enqueue_many('hash_file', [{'file_id': file_obj.id} for file_obj in self.rows])
+        self.rows = []
+
+        now = time.monotonic()
+        if now - self.last_report >= 5:
+            self.last_report = now
+            elapsed = now - self.started
+            self.stdout.write(
+                f"{self.imported_files} files, {self.imported_bytes / (1024 * 1024):.1f} MB, "
+                f"{self.imported_files / elapsed:.0f} files/s"
+            )
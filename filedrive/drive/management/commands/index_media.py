@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from drive.models import File
+from drive import jobs, media
+
+class Command(BaseCommand):
+    help = 'Queues metadata extraction for images and videos uploaded before the media index existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help="Re-extract every image and video, not only unindexed ones")
+        parser.add_argument('--cleanup', action='store_true', help="Delete thumbnails no file refers to")
+
+    def handle(self, *args, **options):
+        queryset = File.objects.filter(category__in=('image', 'video')) if options['all'] else media.pending_files()
+        queryset = queryset.order_by('id').values_list('id', flat=True)
+
+        last_id = 0
+        queued = 0
+        while True:
+            # Keyset pagination keeps each batch query cheap on large tables
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            jobs.enqueue_many('extract_media', [{'file_id': file_id} for file_id in batch])
+            queued += len(batch)
+            last_id = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Queued metadata extraction for {queued} files"))
+
+        if options['cleanup']:
+            removed = media.remove_unused_thumbnails()
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} unused thumbnails"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from drive import listing_cache
+
+class Command(BaseCommand):
+    help = 'Prints hit and miss counts of the folder listing cache'
+
+    def handle(self, *args, **options):
+        stats = listing_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / lookups * 100 if lookups else 0
+        self.stdout.write(f"hits={stats['hits']} misses={stats['misses']} hit_ratio={ratio:.1f}%")
@@ -0,0 +1,117 @@
+import multiprocessing
+import random
+import secrets
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test import Client
+from drive import activity, logins, operations, quick_access
+from drive.models import File, Folder, UserProfile
+
+def run_client(user_id, reads, host, requests, write_ratio):
+    """Send requests as one user. Returns (timings, locked, failed)."""
+    client = Client(HTTP_HOST=host)
+    client.force_login(User.objects.get(id=user_id))
+    timings, locked, failed = [], 0, 0
+    try:
+        for i in range(requests):
+            started = time.perf_counter()
+            try:
+                if random.random() < write_ratio:
+                    if i % 2:
+                        response = client.post('/create-folder/', {'name': f'folder{i}'})
+                    else:
+                        response = client.post('/upload-file/', {'file': SimpleUploadedFile(f'upload{i}.txt', b'y' * 4096)})
+                else:
+                    response = client.get(random.choice(reads))
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                        response.close()
+                if response.status_code >= 400:
+                    failed += 1
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                locked += 1
+            timings.append(time.perf_counter() - started)
+    finally:
+        # Pool processes exit without running atexit handlers
+        activity.flush()
+        quick_access.flush()
+        logins.flush()
+        connections.close_all()
+    return timings, locked, failed
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs concurrent reads and writes through the full request stack and counts "database is locked" '
+        'errors. Compare the default settings with --settings filedrive.settings_production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=100, help="Requests per process")
+        parser.add_argument('--write-ratio', type=float, default=0.2, help="Share of requests that upload or create folders")
+
+    def handle(self, *args, **options):
+        tag = secrets.token_hex(4)
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        owner = User.objects.create_user(f'loadtest-owner-{tag}')
+        users = [User.objects.create_user(f'loadtest-{tag}-{n}') for n in range(options['processes'])]
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in [owner] + users])
+
+        # Public items of another user, so that every read also logs a view
+        shared = operations.create_folder(owner, Folder(name='shared', is_public=True))
+        files = []
+        for n in range(5):
+            file_obj = File(owner=owner, folder=shared, name=f'file{n}.txt', is_public=True,
+                            file=SimpleUploadedFile(f'file{n}.txt', b'x' * 4096))
+            files.append(operations.add_file(owner, file_obj))
+        reads = ['/', '/search/?q=file'] + [f'/file/{f.id}/' for f in files] + [f'/download/{f.id}/' for f in files]
+
+        try:
+            started = time.perf_counter()
+            # Separate processes, like the workers of an application server;
+            # connections must not be shared with them
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['processes'], mp_context=multiprocessing.get_context('fork')) as pool:
+                results = list(pool.map(
+                    run_client, [user.id for user in users], repeat(reads, len(users)), repeat(host, len(users)),
+                    repeat(options['requests'], len(users)), repeat(options['write_ratio'], len(users)),
+                ))
+            elapsed = time.perf_counter() - started
+        finally:
+            activity.flush()
+            logins.flush()
+            for user in [owner] + users:
+                for folder in Folder.objects.filter(owner=user, parent__isnull=True):
+                    operations.purge(user, folder)
+                for file_obj in File.objects.filter(owner=user):
+                    operations.purge(user, file_obj)
+                user.delete()
+
+        timings = sorted(t for result in results for t in result[0])
+        locked = sum(result[1] for result in results)
+        failed = sum(result[2] for result in results)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(f"Database: {connection.vendor} {connection.settings_dict['NAME']}")
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.stdout.write(f"Journal mode: {cursor.fetchone()[0]}")
+        self.stdout.write(
+            f"Latency: mean {statistics.mean(timings) * 1000:.1f} ms, "
+            f"p95 {p95 * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms"
+        )
+        summary = (
+            f"{len(timings)} requests in {elapsed:.2f}s with {options['processes']} processes: "
+            f"{len(timings) / elapsed:.1f} requests/s, {locked} \"database is locked\", {failed} other errors"
+        )
+        self.stdout.write(self.style.SUCCESS(summary) if not locked and not failed else self.style.ERROR(summary))
@@ -0,0 +1,42 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from drive.models import File, FileVersion
+from drive import versions
+
+class Command(BaseCommand):
+    help = 'Deletes file versions outside DRIVE_VERSION_RETENTION and chunks no version uses any more'
+
+    def add_arguments(self, parser):
+        keep_last, keep_days = versions.retention()
+        parser.add_argument('--keep-last', type=int, default=keep_last, help="Versions always kept per file")
+        parser.add_argument('--keep-days', type=int, default=keep_days, help="Versions younger than this are kept")
+        parser.add_argument('--grace-hours', type=int, default=24, help="Keep unused chunks this long for uploads in progress")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        version_ids = list(versions.prunable(options['keep_last'], options['keep_days']))
+        pruned = 0
+        for start in range(0, len(version_ids), batch_size):
+            pruned += self.delete(version_ids[start:start + batch_size], options['dry_run'])
+
+        if options['dry_run']:
+            # Chunks freed by this run are not counted, since nothing was deleted
+            removed, removed_bytes = versions.collect_garbage(timedelta(hours=options['grace_hours']), batch_size, dry_run=True)
+            self.stdout.write(self.style.SUCCESS(
+                f"Would delete {pruned} versions and {removed} unused chunks ({removed_bytes / (1024 * 1024):.1f} MB)"
+            ))
+            return
+        removed, removed_bytes = versions.collect_garbage(timedelta(hours=options['grace_hours']), batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {pruned} versions and {removed} unused chunks ({removed_bytes / (1024 * 1024):.1f} MB)"
+        ))
+
+    def delete(self, version_ids, dry_run):
+        if dry_run:
+            return len(version_ids)
+        # Never delete a version that is current, whatever changed since it was selected
+        current = File.objects.filter(current_version__in=version_ids).values('current_version_id')
+        deleted = FileVersion.objects.filter(id__in=version_ids).exclude(id__in=current).delete()[1]
+        return deleted.get(FileVersion._meta.label, 0)
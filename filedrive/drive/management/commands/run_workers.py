@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from drive import jobs, metrics
+
+def worker_loop(worker_id, batch_size, poll_interval, once):
+    """Claim and run jobs until stopped; in once mode, until the queue is empty"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        close_old_connections()
+        claimed = jobs.claim(worker_id, batch_size)
+        for job in claimed:
+            jobs.run(job)
+        if not claimed:
+            if once:
+                break
+            time.sleep(poll_interval)
+    connections.close_all()
+
+class Command(BaseCommand):
+    help = 'Runs background job workers for post-upload processing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+        parser.add_argument('--batch-size', type=int, default=5, help="Jobs claimed per round trip")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit when no jobs are due")
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and exit")
+        parser.add_argument('--stats-interval', type=float, default=60.0)
+        parser.add_argument('--keep-done-days', type=int, default=7)
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        host = socket.gethostname()
+
+        def args_for(n):
+            return (f"{host}:{os.getpid()}:{n}", options['batch_size'], options['poll_interval'], options['once'])
+
+        if options['processes'] <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            self.stdout.write("Starting 1 worker")
+            worker_loop(*args_for(0))
+            self.finish(options)
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=worker_loop, args=args_for(n)) for n in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} workers")
+
+        def forward(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        try:
+            last_stats = time.monotonic()
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(1.0)
+                if not options['once'] and time.monotonic() - last_stats >= options['stats_interval']:
+                    last_stats = time.monotonic()
+                    self.print_stats()
+                    metrics.write_gauges(metrics.collect_gauges())
+                    jobs.purge_finished(timedelta(days=options['keep_done_days']))
+                    connections.close_all()
+        except KeyboardInterrupt:
+            forward(signal.SIGINT, None)
+            for worker in workers:
+                worker.join()
+        self.finish(options)
+
+    def finish(self, options):
+        jobs.purge_finished(timedelta(days=options['keep_done_days']))
+        self.print_stats()
+
+    def print_stats(self):
+        stats = jobs.queue_depth()
+        self.stdout.write(
+            f"queued={stats['queued']} running={stats['running']} done={stats['done']} "
+            f"failed={stats['failed']} oldest_due={stats['oldest_due_seconds']:.0f}s"
+        )
@@ -0,0 +1,215 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Collate
+from django.utils import timezone
+from drive.models import File
+from drive import journal, storage
+
+STORAGE_PREFIX = 'user_files/'
+
+def walk_sorted(root, relative=''):
+    """
+    Yield (storage name, size) for every file under root in the same order as
+    a byte-wise sort of the full names. Directories sort as "name/" so that
+    their contents land where their paths would.
+    """
+    try:
+        with os.scandir(os.path.join(root, relative)) as entries:
+            entries = list(entries)
+    except FileNotFoundError:
+        return
+    keyed = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            keyed.append((entry.name + '/', entry, True))
+        elif entry.is_file(follow_symlinks=False):
+            keyed.append((entry.name, entry, False))
+    for key, entry, is_dir in sorted(keyed, key=lambda item: item[0]):
+        name = relative + key
+        if is_dir:
+            yield from walk_sorted(root, name)
+        else:
+            yield STORAGE_PREFIX + name, entry.stat(follow_symlinks=False).st_size
+
+class Command(BaseCommand):
+    help = 'Checks stored files against File rows: missing files, orphaned files, size and checksum mismatches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-checksums', action='store_true', help="Hash files and compare with stored checksums")
+        parser.add_argument('--record-checksums', action='store_true', help="Store checksums for rows that have none")
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+        parser.add_argument('--max-mb-per-sec', type=float, default=0, help="Limit hashing throughput (0: unlimited)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between database batches")
+        parser.add_argument('--report', help="Write every finding as a JSON line to this file")
+        parser.add_argument('--delete-missing', action='store_true', help="Delete rows whose file is missing on disk")
+        parser.add_argument('--quarantine-orphans', metavar='DIR', help="Move files without a row into DIR")
+        parser.add_argument('--grace', type=int, default=60, help="Minutes; files and rows changed more recently are never moved or deleted")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.counts = {'checked': 0, 'missing': 0, 'orphan': 0, 'size_mismatch': 0, 'checksum_mismatch': 0, 'hashed': 0}
+        self.report = open(options['report'], 'w') if options['report'] else None
+        self.pending = {}
+        self.hashed_bytes = 0
+        self.started = time.monotonic()
+
+        hashing = options['verify_checksums'] or options['record_checksums']
+        self.pool = None
+        if hashing:
+            # Workers only hash paths and never use the inherited database connection
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            self.pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=context)
+
+        try:
+            for tier, _ in storage.TIER_CHOICES:
+                root = storage.tier_root(tier)
+                if root is None:
+                    continue
+                self.tier = tier
+                self.merge(walk_sorted(os.path.join(root, STORAGE_PREFIX)), self.iter_rows(tier))
+                self.drain(wait_all=True)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+            if self.report:
+                self.report.close()
+
+        elapsed = time.monotonic() - self.started
+        summary = ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in self.counts.items())
+        style = self.style.SUCCESS if not any(self.counts[k] for k in ('missing', 'orphan', 'size_mismatch', 'checksum_mismatch')) else self.style.WARNING
+        self.stdout.write(style(f"Scrub finished in {elapsed:.1f}s: {summary}"))
+
+    def iter_rows(self, tier):
+        """Keyset scan of the File rows of one tier ordered by storage name"""
+        order = 'file'
+        if connection.vendor == 'postgresql':
+            # Match Python's byte-wise ordering of the disk walk
+            order = Collate('file', 'C')
+        queryset = File.objects.filter(tier=tier, file__startswith=STORAGE_PREFIX).order_by(order, 'id')
+        last_name, last_id = '', 0
+        while True:
+            batch = list(
+                queryset.filter(Q(file__gt=last_name) | Q(file=last_name, id__gt=last_id))
+                .values_list('id', 'owner_id', 'file', 'size', 'stored_size', 'encoding', 'checksum')[:self.options['batch_size']]
+            )
+            if not batch:
+                return
+            yield from batch
+            last_id, _, last_name = batch[-1][:3]
+            if self.options['pause']:
+                time.sleep(self.options['pause'])
+
+    def merge(self, disk, rows):
+        """Stream-join two iterators sorted by storage name"""
+        disk_item = next(disk, None)
+        row = next(rows, None)
+        while disk_item is not None or row is not None:
+            if row is None or (disk_item is not None and disk_item[0] < row[2]):
+                self.orphan(*disk_item)
+                disk_item = next(disk, None)
+            elif disk_item is None or row[2] < disk_item[0]:
+                self.missing(row)
+                row = next(rows, None)
+            else:
+                name, disk_size = disk_item
+                while row is not None and row[2] == name:
+                    self.check(row, disk_size)
+                    row = next(rows, None)
+                disk_item = next(disk, None)
+
+    def finding(self, kind, **details):
+        self.counts[kind] += 1
+        if self.report:
+            self.report.write(json.dumps({'finding': kind, **details}) + '\n')
+        if self.counts[kind] <= 20:
+            self.stdout.write(self.style.WARNING(f"{kind}: {details}"))
+
+    def stored_paths(self, name):
+        """Paths name would have on every configured tier"""
+        return [storage.path_for(name, tier) for tier, _ in storage.TIER_CHOICES if storage.tier_root(tier) is not None]
+
+    def orphan(self, name, size):
+        self.finding('orphan', tier=self.tier, name=name, size=size)
+        target = self.options['quarantine_orphans']
+        if not target:
+            return
+        # The walk and the row scan are minutes apart on a large drive: an
+        # upload may have saved its row, or still be writing, since then
+        path = storage.path_for(name, self.tier)
+        try:
+            modified = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return
+        if time.time() - modified < self.options['grace'] * 60 or File.objects.filter(file=name).exists():
+            return
+        destination = os.path.join(target, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(path, destination)
+
+    def missing(self, row):
+        file_id, name = row[0], row[2]
+        self.finding('missing', tier=self.tier, id=file_id, name=name)
+        if not self.options['delete_missing']:
+            return
+        recent = timezone.now() - timedelta(minutes=self.options['grace'])
+        with transaction.atomic():
+            # Lock the row, then confirm it still names the same missing
+            # file: tiering may have moved it, or an upload replaced it
+            file_obj = File.objects.select_for_update().filter(id=file_id, file=name, modified_at__lt=recent).first()
+            if file_obj is None or any(os.path.exists(path) for path in self.stored_paths(name)):
+                return
+            journal.record_change(file_obj.owner, 'delete', file_obj)
+            file_obj.delete()
+
+    def check(self, row, disk_size):
+        file_id, owner_id, name, size, stored_size, encoding, checksum = row
+        self.counts['checked'] += 1
+        expected = stored_size if stored_size is not None else size
+        if expected != disk_size:
+            self.finding('size_mismatch', id=file_id, name=name, expected=expected, actual=disk_size)
+
+        needs_hash = (self.options['verify_checksums'] and checksum) or (self.options['record_checksums'] and not checksum)
+        if not needs_hash:
+            return
+        if len(self.pending) >= self.options['workers'] * 2:
+            self.drain()
+        future = self.pool.submit(storage.hash_path, storage.path_for(name, self.tier), encoding)
+        self.pending[future] = row
+
+    def drain(self, wait_all=False):
+        if not self.pending:
+            return
+        done, _ = wait(self.pending, return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED)
+        for future in done:
+            file_id, owner_id, name, size, stored_size, encoding, checksum = self.pending.pop(future)
+            try:
+                digest, length = future.result()
+            except OSError as e:
+                self.stderr.write(f"Could not hash {name}: {e}")
+                continue
+            self.counts['hashed'] += 1
+            self.hashed_bytes += length
+            if checksum and digest != checksum:
+                self.finding('checksum_mismatch', id=file_id, name=name, expected=checksum, actual=digest)
+            elif not checksum and self.options['record_checksums']:
+                File.objects.filter(id=file_id, checksum='').update(checksum=digest)
+        self.throttle()
+
+    def throttle(self):
+        """Sleep until hashing is back under the configured rate"""
+        limit = self.options['max_mb_per_sec']
+        if not limit:
+            return
+        allowed_elapsed = self.hashed_bytes / (limit * 1024 * 1024)
+        behind = allowed_elapsed - (time.monotonic() - self.started)
+        if behind > 0:
+            time.sleep(behind)
@@ -0,0 +1,249 @@
+"""
+Metadata and thumbnails of images and videos. They are extracted by the
+'extract_media' job after upload and kept in MediaMetadata, so the gallery
+is a single indexed query and never opens the originals.
+"""
+import hashlib
+import io
+import json
+import re
+import shutil
+import subprocess
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from PIL import Image, ImageOps
+from .models import File, MediaMetadata
+from . import storage
+
+THUMBNAIL_SIZE = 320
+QUALITY = 75
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_RE = re.compile(r'^thumbnails/([0-9a-f]{16})\.webp$')
+PAGE_SIZE = 60
+# Seconds a single ffprobe or ffmpeg run may take
+TOOL_TIMEOUT = 60
+
+# EXIF tags
+ORIENTATION = 0x0112
+DATETIME = 0x0132
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+# Orientations that rotate by 90 degrees, swapping width and height
+TRANSPOSED = {5, 6, 7, 8}
+# Video rotation in degrees -> EXIF orientation
+ROTATIONS = {0: 1, 90: 6, 180: 3, 270: 8}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def exif_time(exif):
+    """Capture time recorded by the camera, or None"""
+    ifd = exif.get_ifd(EXIF_IFD)
+    value = ifd.get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+    try:
+        taken = datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    offset = str(ifd.get(OFFSET_TIME_ORIGINAL) or '').strip('\x00 ')
+    try:
+        return datetime.fromisoformat(taken.isoformat() + offset) if offset else timezone.make_aware(taken)
+    except ValueError:
+        # Most cameras record local time without a zone
+        return timezone.make_aware(taken)
+
+
+def encode_thumbnail(image):
+    image = image.convert('RGB')
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def image_metadata(fh):
+    """Returns ({field: value}, thumbnail bytes)"""
+    with Image.open(fh) as image:
+        exif = image.getexif()
+        orientation = exif.get(ORIENTATION, 1)
+        if orientation not in range(1, 9):
+            orientation = 1
+        width, height = image.size
+        if orientation in TRANSPOSED:
+            width, height = height, width
+        fields = {'width': width, 'height': height, 'orientation': orientation, 'captured_at': exif_time(exif)}
+        # Let the JPEG decoder downscale instead of decoding every pixel
+        image.draft('RGB', (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+        thumbnail = encode_thumbnail(ImageOps.exif_transpose(image))
+    return fields, thumbnail
+
+
+def run_tool(args):
+    """stdout of a command-line tool, or None if it is not installed or fails"""
+    if shutil.which(args[0]) is None:
+        return None
+    try:
+        result = subprocess.run(args, capture_output=True, timeout=TOOL_TIMEOUT, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout
+
+
+def video_metadata(path):
+    """Returns ({field: value}, thumbnail bytes or None); empty without ffprobe"""
+    output = run_tool(['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path])
+    if output is None:
+        return {}, None
+    try:
+        probe = json.loads(output)
+    except ValueError:
+        return {}, None
+    stream = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'video'), {})
+    container = probe.get('format', {})
+
+    rotation = stream.get('tags', {}).get('rotate')
+    if rotation is None:
+        rotation = next((data['rotation'] for data in stream.get('side_data_list', []) if 'rotation' in data), 0)
+    try:
+        orientation = ROTATIONS.get(int(float(rotation)) % 360, 1)
+    except ValueError:
+        orientation = 1
+    width, height = stream.get('width'), stream.get('height')
+    if orientation in TRANSPOSED:
+        width, height = height, width
+    try:
+        duration = float(container.get('duration') or stream.get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    created = container.get('tags', {}).get('creation_time') or stream.get('tags', {}).get('creation_time')
+    fields = {
+        'width': width, 'height': height, 'orientation': orientation, 'duration': duration,
+        'captured_at': parse_datetime(created) if created else None,
+    }
+
+    # A frame a little into the video, rotated by ffmpeg like players do
+    offset = min(1.0, duration / 2) if duration else 0
+    frame = run_tool(['ffmpeg', '-v', 'error', '-ss', str(offset), '-i', path, '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'png', '-'])
+    thumbnail = None
+    if frame:
+        with Image.open(io.BytesIO(frame)) as image:
+            thumbnail = encode_thumbnail(image)
+    return fields, thumbnail
+
+
+def save_thumbnail(data):
+    # Named by content, so identical images share one thumbnail
+    name = f'{THUMBNAIL_DIR}/{hashlib.sha256(data).hexdigest()[:16]}.webp'
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def extract(file_obj):
+    """Store the metadata and thumbnail of an image or video. Returns the MediaMetadata or None."""
+    if file_obj.category not in ('image', 'video'):
+        MediaMetadata.objects.filter(file=file_obj).delete()
+        return None
+    fields, thumbnail = {}, None
+    if file_obj.category == 'image':
+        try:
+            with file_obj.open_content() as fh:
+                fields, thumbnail = image_metadata(fh)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            # Not decodable; still listed in the gallery, without details
+            pass
+    elif not file_obj.is_chunked() and not file_obj.encoding:
+        # ffprobe seeks around the container, so it needs the file on disk
+        fields, thumbnail = video_metadata(storage.stored_path(file_obj))
+
+    fields['captured_at'] = fields.get('captured_at') or file_obj.created_at
+    fields['thumbnail'] = save_thumbnail(thumbnail) if thumbnail else ''
+    metadata, _ = MediaMetadata.objects.update_or_create(
+        file=file_obj,
+        defaults=dict(fields, owner_id=file_obj.owner_id, kind=file_obj.category, extracted_at=timezone.now()),
+    )
+    return metadata
+
+
+def encode_cursor(metadata):
+    microseconds = (metadata.captured_at - EPOCH) // timedelta(microseconds=1)
+    return f'{microseconds}-{metadata.file_id}'
+
+
+def decode_cursor(value):
+    """(captured_at, file_id) from encode_cursor. Raises ValueError."""
+    microseconds, file_id = value.rsplit('-', 1)
+    return EPOCH + timedelta(microseconds=int(microseconds)), int(file_id)
+
+
+def parse_filters(params):
+    """Gallery filters from query parameters. Raises ValueError."""
+    kind = params.get('kind', '')
+    if kind and kind not in dict(MediaMetadata.KIND_CHOICES):
+        raise ValueError('Unknown kind.')
+    filters = {'kind': kind}
+    for name in ('min_width', 'min_height'):
+        value = params.get(name, '')
+        filters[name] = int(value) if value else None
+    after = params.get('after', '')
+    filters['after'] = decode_cursor(after) if after else None
+    return filters
+
+
+def gallery_page(user, kind='', min_width=None, min_height=None, after=None, limit=PAGE_SIZE):
+    """
+    One page of user's media across all folders, newest capture first,
+    leaving out files in the trash.
+    after is the cursor of the previous page. Returns (items, next cursor or None).
+    """
+    queryset = MediaMetadata.objects.filter(
+        Q(file__folder__isnull=True) | Q(file__folder__in_trash=False), owner=user, file__trash__isnull=True,
+    )
+    if kind:
+        queryset = queryset.filter(kind=kind)
+    if min_width:
+        queryset = queryset.filter(width__gte=min_width)
+    if min_height:
+        queryset = queryset.filter(height__gte=min_height)
+    if after is not None:
+        # Keyset pagination: continue after the last item instead of counting an offset
+        captured_at, file_id = after
+        queryset = queryset.filter(Q(captured_at__lt=captured_at) | Q(captured_at=captured_at, file_id__lt=file_id))
+    items = list(
+        queryset.select_related('file')
+        .only('file_id', 'kind', 'width', 'height', 'orientation', 'duration', 'captured_at', 'thumbnail', 'file__name', 'file__size')
+        .order_by('-captured_at', '-file_id')[:limit + 1]
+    )
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def remove_unused_thumbnails(grace=timedelta(hours=1)):
+    """
+    Delete thumbnails no MediaMetadata refers to. Thumbnails younger than
+    grace are kept, since their metadata may not be saved yet. Returns the
+    number removed.
+    """
+    cutoff = timezone.now() - grace
+    try:
+        _, names = default_storage.listdir(THUMBNAIL_DIR)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for start in range(0, len(names), 500):
+        batch = [f'{THUMBNAIL_DIR}/{name}' for name in names[start:start + 500] if THUMBNAIL_RE.match(f'{THUMBNAIL_DIR}/{name}')]
+        used = set(MediaMetadata.objects.filter(thumbnail__in=batch).values_list('thumbnail', flat=True))
+        for name in batch:
+            if name not in used and default_storage.get_modified_time(name) < cutoff:
+                default_storage.delete(name)
+                removed += 1
+    return removed
+
+
+def pending_files():
+    """Images and videos without metadata, for backfilling"""
+    return File.objects.filter(category__in=('image', 'video'), media__isnull=True)
@@ -0,0 +1,348 @@
+"""
+In-process metrics, exported in the Prometheus text format. Every process
+aggregates its own counters and histograms in memory and writes a snapshot
+file to DRIVE_METRICS_DIR every few seconds; /metrics adds the snapshots of
+all processes together, so scrapes never touch the database. Gauges that
+need queries (queue depth, storage usage) are written to the same directory
+by `collect_metrics` and the run_workers supervisor.
+"""
+import atexit
+import fcntl
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+from .models import File, Job
+
+FLUSH_INTERVAL = 5  # seconds
+GAUGES_FILE = 'gauges.json'
+# Counts of exited processes, so that the exported totals never go down
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = 'snapshots.lock'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TRANSFER_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+
+# name -> (type, help)
+METRICS = {
+    'drive_http_requests_total': ('counter', 'Requests by view, method and status class'),
+    'drive_http_request_duration_seconds': ('histogram', 'Time to build the response, by view'),
+    'drive_transfers_total': ('counter', 'Completed uploads and downloads'),
+    'drive_transfer_bytes_total': ('counter', 'Bytes uploaded and downloaded'),
+    'drive_transfer_duration_seconds': ('histogram', 'Duration of uploads and downloads'),
+    'drive_listing_cache_lookups_total': ('counter', 'Folder listing cache lookups by result'),
+    'drive_orphans_adopted_total': ('counter', 'Orphaned items moved into a root folder'),
+    'drive_jobs': ('gauge', 'Background jobs by status'),
+    'drive_jobs_oldest_due_seconds': ('gauge', 'Age of the oldest due background job'),
+    'drive_storage_used_bytes_max': ('gauge', 'Quota usage of the largest user'),
+    'drive_storage_used_bytes_total': ('gauge', 'Quota usage of all users together'),
+    'drive_storage_users_near_quota': ('gauge', 'Users using at least 90% of their quota'),
+    'drive_storage_files': ('gauge', 'Number of files'),
+    'drive_disk_used_bytes': ('gauge', 'Used space on the media volume'),
+    'drive_disk_free_bytes': ('gauge', 'Free space on the media volume'),
+    'drive_metrics_collected_timestamp_seconds': ('gauge', 'When the gauges were last collected'),
+}
+BUCKETS = {
+    'drive_http_request_duration_seconds': LATENCY_BUCKETS,
+    'drive_transfer_duration_seconds': TRANSFER_BUCKETS,
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_last_flush = time.monotonic()
+
+
+def snapshot_name():
+    # Unique per process even when pids are reused
+    return f'{os.getpid()}-{int(time.time())}.json'
+
+
+def process_exited(name):
+    """Whether the process that wrote the snapshot file name has exited"""
+    try:
+        pid = int(name.split('-', 1)[0])
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # Alive, but run by another user
+        pass
+    return False
+
+
+_snapshot_name = snapshot_name()
+
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def metrics_dir():
+    return getattr(settings, 'DRIVE_METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'filedrive-metrics')
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = (name, label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    maybe_flush()
+
+
+def observe(name, value, **labels):
+    buckets = BUCKETS[name]
+    key = (name, label_key(labels))
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [0] * (len(buckets) + 3)
+        # Counts are stored per bucket and made cumulative when rendered
+        state[bisect_left(buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+    maybe_flush()
+
+
+def record_request(view, method, status, seconds):
+    method = method if method in METHODS else 'other'
+    inc('drive_http_requests_total', view=view, method=method, status=f'{status // 100}xx')
+    observe('drive_http_request_duration_seconds', seconds, view=view)
+
+
+def record_transfer(direction, nbytes, seconds):
+    inc('drive_transfers_total', direction=direction)
+    inc('drive_transfer_bytes_total', nbytes, direction=direction)
+    observe('drive_transfer_duration_seconds', seconds, direction=direction)
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), list(state)] for (name, labels), state in _histograms.items()],
+        }
+
+
+def write_json(name, data):
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    partial = f'{path}.{os.getpid()}.partial'
+    with open(partial, 'w') as fh:
+        json.dump(data, fh)
+    # Readers see either the previous snapshot or this one, never half of it
+    os.replace(partial, path)
+
+
+def maybe_flush():
+    global _last_flush
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Write this process's snapshot for the other processes' /metrics to read"""
+    global _last_flush
+    _last_flush = time.monotonic()
+    data = snapshot()
+    if data['counters'] or data['histograms']:
+        try:
+            write_json(_snapshot_name, data)
+        except OSError:
+            pass
+
+
+def write_gauges(gauges):
+    """Publish gauges given as [(name, labels, value)]"""
+    gauges = list(gauges) + [('drive_metrics_collected_timestamp_seconds', {}, time.time())]
+    write_json(GAUGES_FILE, [[name, sorted(labels.items()), value] for name, labels, value in gauges])
+
+
+def collect_gauges():
+    """Query the gauges that cannot be kept in memory. Returns [(name, labels, value)]."""
+    from . import jobs, operations
+    depth = jobs.queue_depth()
+    gauges = [('drive_jobs', {'status': status}, depth[status]) for status, _ in Job.STATUS_CHOICES]
+    gauges.append(('drive_jobs_oldest_due_seconds', {}, depth['oldest_due_seconds']))
+
+    # Aggregates only: usernames and their usage are not for the scraper to see
+    usage = operations.usage_by_user()
+    quota = operations.quota()
+    gauges.append(('drive_storage_used_bytes_max', {}, max(usage.values(), default=0)))
+    gauges.append(('drive_storage_used_bytes_total', {}, sum(usage.values())))
+    gauges.append(('drive_storage_users_near_quota', {}, sum(1 for used in usage.values() if used >= quota * 0.9)))
+    gauges.append(('drive_storage_files', {}, File.objects.count()))
+
+    disk = shutil.disk_usage(settings.MEDIA_ROOT)
+    gauges.append(('drive_disk_used_bytes', {}, disk.used))
+    gauges.append(('drive_disk_free_bytes', {}, disk.free))
+    return gauges
+
+
+def read_json(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def locked(directory, operation):
+    """Hold the snapshot lock: shared while reading, exclusive while retiring"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as fh:
+        fcntl.flock(fh, operation)
+        yield
+
+
+def add_snapshot(counters, histograms, data):
+    for name, labels, value in data['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, state in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(state))
+        for index, value in enumerate(state):
+            total[index] += value
+
+
+def retire(directory, names):
+    """Fold the snapshots of exited processes into RETIRED_FILE and remove them"""
+    with locked(directory, fcntl.LOCK_EX):
+        counters = {}
+        histograms = {}
+        add_snapshot(counters, histograms, read_json(os.path.join(directory, RETIRED_FILE)) or {'counters': [], 'histograms': []})
+        folded = []
+        for name in names:
+            # Already folded by another process when it is gone
+            data = read_json(os.path.join(directory, name))
+            if data:
+                add_snapshot(counters, histograms, data)
+                folded.append(name)
+        if not folded:
+            return
+        write_json(RETIRED_FILE, {
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), state] for (name, labels), state in histograms.items()],
+        })
+        for name in folded:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def snapshot_names(directory):
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    return [name for name in names if name.endswith('.json') and name not in (GAUGES_FILE, RETIRED_FILE, _snapshot_name)]
+
+
+def aggregate():
+    """Sum the snapshots of every process, with this process's live values instead of its file"""
+    counters = {}
+    histograms = {}
+    directory = metrics_dir()
+    # Restarted workers would otherwise leave a file behind each time; their
+    # counts move to RETIRED_FILE so that the totals do not drop
+    exited = [name for name in snapshot_names(directory) if process_exited(name)]
+    if exited:
+        retire(directory, exited)
+    add_snapshot(counters, histograms, snapshot())
+    if os.path.isdir(directory):
+        # Retiring moves counts between files; read them all in one state
+        with locked(directory, fcntl.LOCK_SH):
+            for name in [RETIRED_FILE] + snapshot_names(directory):
+                data = read_json(os.path.join(directory, name))
+                if data:
+                    add_snapshot(counters, histograms, data)
+    gauges = read_json(os.path.join(directory, GAUGES_FILE)) or []
+    return counters, histograms, [(name, tuple(map(tuple, labels)), value) for name, labels, value in gauges]
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    counters, histograms, gauges = aggregate()
+    series = {}  # name -> [(labels, lines)]
+    for (name, labels), value in counters.items():
+        series.setdefault(name, []).append((labels, [f'{name}{format_labels(labels)} {format_value(value)}']))
+    for name, labels, value in gauges:
+        series.setdefault(name, []).append((labels, [f'{name}{format_labels(labels)} {format_value(value)}']))
+    for (name, labels), state in histograms.items():
+        if name not in BUCKETS:
+            continue
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS[name] + (float('inf'),), state[:-2]):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", format_value(float(bound)))])} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {format_value(float(state[-2]))}')
+        lines.append(f'{name}_count{format_labels(labels)} {state[-1]}')
+        series.setdefault(name, []).append((labels, lines))
+
+    output = []
+    for name, (kind, help_text) in METRICS.items():
+        if name in series:
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} {kind}')
+            for _, lines in sorted(series[name], key=lambda item: item[0]):
+                output.extend(lines)
+    return '\n'.join(output) + '\n'
+
+
+class MetricsMiddleware:
+    """Count requests and time them per URL name of drive/urls.py"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        # Streaming responses are timed to their first byte; transfers are
+        # recorded separately once they finish
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        record_request(view, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+
+def reset_after_fork():
+    """A forked child starts empty; its parent keeps reporting what was counted before the fork"""
+    global _lock, _snapshot_name
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _snapshot_name = snapshot_name()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+atexit.register(flush)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='category',
+            field=models.CharField(choices=[('image', 'Images'), ('video', 'Videos'), ('audio', 'Audio'), ('pdf', 'PDFs'), ('word', 'Word documents'), ('excel', 'Spreadsheets'), ('powerpoint', 'Presentations'), ('text', 'Text and code'), ('archive', 'Archives'), ('other', 'Other')], db_index=True, default='other', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='mime_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['owner', 'category', '-created_at'], name='file_owner_category_idx'),
+        ),
+    ]
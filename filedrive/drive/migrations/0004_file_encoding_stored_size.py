@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+def fill_stored_size(apps, schema_editor):
+    File = apps.get_model('drive', 'File')
+    File.objects.filter(stored_size__isnull=True).update(stored_size=models.F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0003_change_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0006_file_path_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='access_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold')], db_index=True, default='hot', max_length=10),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0007_file_tiering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Throttle Counter',
+                'verbose_name_plural': 'Throttle Counters',
+            },
+        ),
+        migrations.AddField(
+            model_name='storagesettings',
+            name='max_concurrent_transfers',
+            field=models.PositiveIntegerField(default=8),
+        ),
+        migrations.AddField(
+            model_name='storagesettings',
+            name='share_bandwidth_limit',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storagesettings',
+            name='user_bandwidth_limit',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0008_transfer_throttling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='generation',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0009_folder_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Chunk',
+                'verbose_name_plural': 'Chunks',
+            },
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, upload_to='user_files/'),
+        ),
+        migrations.CreateModel(
+            name='FileVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('checksum', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='drive.file')),
+            ],
+            options={
+                'verbose_name': 'File Version',
+                'verbose_name_plural': 'File Versions',
+                'ordering': ['-number'],
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='current_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='drive.fileversion'),
+        ),
+        migrations.CreateModel(
+            name='VersionChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='drive.chunk')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='drive.fileversion')),
+            ],
+            options={
+                'verbose_name': 'Version Chunk',
+                'verbose_name_plural': 'Version Chunks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='fileversion',
+            constraint=models.UniqueConstraint(fields=('file', 'number'), name='fileversion_file_number_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='versionchunk',
+            constraint=models.UniqueConstraint(fields=('version', 'position'), name='versionchunk_version_position_unique'),
+        ),
+    ]
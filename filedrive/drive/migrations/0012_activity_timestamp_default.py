@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0011_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recentactivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
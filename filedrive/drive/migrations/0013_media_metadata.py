@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0012_activity_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaMetadata',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='media', serialize=False, to='drive.file')),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('video', 'Video')], max_length=10)),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('orientation', models.PositiveSmallIntegerField(default=1)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('captured_at', models.DateTimeField()),
+                ('thumbnail', models.CharField(blank=True, max_length=100)),
+                ('extracted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Media Metadata',
+                'verbose_name_plural': 'Media Metadata',
+                'indexes': [models.Index(fields=['owner', '-captured_at', '-file'], name='media_owner_captured_idx'), models.Index(fields=['owner', 'kind', '-captured_at', '-file'], name='media_owner_kind_captured_idx')],
+            },
+        ),
+    ]
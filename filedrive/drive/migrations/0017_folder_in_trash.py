@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:22
+
+from django.db import migrations, models
+
+
+def mark_trashed(apps, schema_editor):
+    Folder = apps.get_model('drive', 'Folder')
+    Trash = apps.get_model('drive', 'Trash')
+    level = list(Trash.objects.filter(folder__isnull=False).values_list('folder_id', flat=True))
+    while level:
+        children = []
+        for start in range(0, len(level), 500):
+            batch = level[start:start + 500]
+            Folder.objects.filter(id__in=batch).update(in_trash=True)
+            children.extend(Folder.objects.filter(parent_id__in=batch, in_trash=False).values_list('id', flat=True))
+        level = children
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0016_duplicate_reports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='in_trash',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.RunPython(mark_trashed, migrations.RunPython.noop),
+    ]
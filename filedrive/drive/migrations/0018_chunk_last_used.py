@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_last_used(apps, schema_editor):
+    Chunk = apps.get_model('drive', 'Chunk')
+    Chunk.objects.update(last_used_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0017_folder_in_trash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunk',
+            name='last_used_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(fill_last_used, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.urls import reverse
 from django.utils import timezone
+from . import filetypes, storage
 import os
 
 class StorageSettings(models.Model):
     space_per_user = models.BigIntegerField(default=1024*1024*1024)  # 1GB in bytes
+    user_bandwidth_limit = models.BigIntegerField(default=0)  # bytes per second per user, 0 for no limit
+    share_bandwidth_limit = models.BigIntegerField(default=0)  # bytes per second per shared file, 0 for no limit
+    max_concurrent_transfers = models.PositiveIntegerField(default=8)  # per user, 0 for no limit
     
     class Meta:
         verbose_name = "Storage Setting"
@@ -29,14 +34,48 @@ class Folder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
+    generation = models.PositiveBigIntegerField(default=0)  # bumped on every change to the listing
+    in_trash = models.BooleanField(default=False, db_index=True)  # trashed itself or below a trashed folder
     
     class Meta:
         verbose_name = "Folder"
         verbose_name_plural = "Folders"
+        indexes = [
+            models.Index(fields=['name'], name='folder_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so that a save moving the folder refreshes its old parent
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        from .listing_cache import bump_generations
+        from . import trashed
+        adding = self._state.adding
+        moved = not adding and getattr(self, '_loaded_parent_id', self.parent_id) != self.parent_id
+        # generation only moves forward through listing_cache.bump_generations
+        # and in_trash is kept by trashed.refresh; saving a stale instance must
+        # not write an older value back
+        if not adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('generation', 'in_trash')
+            ]
+        if adding and self.parent_id:
+            self.in_trash = Folder.objects.filter(id=self.parent_id, in_trash=True).exists()
+        super().save(*args, **kwargs)
+        # Any save, including one from the admin, changes the listings showing the folder
+        bump_generations([self.parent_id, getattr(self, '_loaded_parent_id', None)] + ([] if adding else [self.pk]))
+        self._loaded_parent_id = self.parent_id
+        if moved:
+            trashed.refresh(self.pk)
+    
     def get_path(self):
         path = []
         current = self
@@ -49,16 +88,30 @@ class File(models.Model):
     name = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, blank=True, null=True, related_name='files')
-    file = models.FileField(upload_to='user_files/')
+    file = models.FileField(upload_to='user_files/', db_index=True, blank=True)  # empty for chunked files
     size = models.BigIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
     file_type = models.CharField(max_length=50, blank=True, null=True)
+    category = models.CharField(max_length=20, choices=filetypes.CATEGORY_CHOICES, default='other', db_index=True)
+    mime_type = models.CharField(max_length=100, blank=True, default='')
+    encoding = models.CharField(max_length=10, blank=True, default='')  # at-rest compression, e.g. "gzip"
+    stored_size = models.BigIntegerField(blank=True, null=True)  # physical bytes on disk
+    checksum = models.CharField(max_length=64, blank=True, default='', db_index=True)  # sha256 of the content
+    tier = models.CharField(max_length=10, choices=storage.TIER_CHOICES, default='hot', db_index=True)
+    last_accessed_at = models.DateTimeField(blank=True, null=True)
+    access_score = models.FloatField(default=0)  # hits, decayed by DRIVE_ACCESS_HALF_LIFE_DAYS
+    # Set for files stored as chunks; their content is this version's chunks
+    current_version = models.ForeignKey('FileVersion', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
     
     class Meta:
         verbose_name = "File"
         verbose_name_plural = "Files"
+        indexes = [
+            models.Index(fields=['owner', 'category', '-created_at'], name='file_owner_category_idx'),
+            models.Index(fields=['name'], name='file_name_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -67,44 +120,32 @@ class File(models.Model):
         return os.path.splitext(self.name)[1][1:].lower()
     
     def get_file_category(self):
-        """Return the category of the file based on its extension"""
-        extension = self.get_extension()
-        
-        # Images
-        if extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp']:
-            return 'image'
-        
-        # Videos
-        elif extension in ['mp4', 'avi', 'mov', 'wmv', 'flv', 'webm', 'mkv']:
-            return 'video'
-        
-        # Audio
-        elif extension in ['mp3', 'wav', 'flac', 'aac', 'ogg', 'wma']:
-            return 'audio'
-        
-        # Documents
-        elif extension in ['pdf']:
-            return 'pdf'
-        elif extension in ['doc', 'docx']:
-            return 'word'
-        elif extension in ['xls', 'xlsx']:
-            return 'excel'
-        elif extension in ['ppt', 'pptx']:
-            return 'powerpoint'
-        
-        # Text
-        elif extension in ['txt', 'md', 'py', 'js', 'html', 'css', 'scss', 'json', 'xml', 'csv']:
-            return 'text'
-        
-        # Archives
-        elif extension in ['zip', 'rar', 'tar', 'gz', '7z']:
-            return 'archive'
-        
-        # Default
-        else:
-            return 'other'
+        """Return the category of the file, detected once at upload"""
+        if self.mime_type:
+            return self.category
+        # Rows that predate type detection until backfill_file_types has run
+        return filetypes.category_for_extension(self.get_extension())
+    
+    def open_content(self):
+        """Open the logical content of the file, decompressing it if stored compressed"""
+        return storage.open_content(self)
+    
+    def is_chunked(self):
+        return self.current_version_id is not None
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so that a save moving the file refreshes its old folder
+        instance._loaded_folder_id = instance.__dict__.get('folder_id')
+        return instance
+    
+    def read_text(self):
+        with self.open_content() as fh:
+            return fh.read().decode('utf-8', errors='replace')
     
     def save(self, *args, **kwargs):
+        from .listing_cache import bump_generations
         # Auto-populate name from filename if not provided
         if not self.name and self.file:
             self.name = self.file.name.split('/')[-1]
@@ -113,11 +154,22 @@ class File(models.Model):
         if not self.size and self.file:
             self.size = self.file.size
         
+        if self.stored_size is None and not self.encoding:
+            self.stored_size = self.size
+        
         # Set file type based on extension
         if not self.file_type:
             self.file_type = self.get_extension()
         
+        # Detect category and MIME type from the first bytes of a new upload
+        if not self.mime_type:
+            stream = self.file if self._state.adding and self.file else None
+            self.category, self.mime_type = filetypes.detect_file_type(self.name, stream)
+        
         super().save(*args, **kwargs)
+        # Any save, including one from the admin, changes the listings showing the file
+        bump_generations([self.folder_id, getattr(self, '_loaded_folder_id', None)])
+        self._loaded_folder_id = self.folder_id
 
 class Trash(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -133,18 +185,304 @@ class Trash(models.Model):
         if self.file:
             return f"File: {self.file.name}"
         return f"Folder: {self.folder.name}"
+    
+    def containing_folder_id(self):
+        # Looked up by id, since the item may already be purged
+        if self.file_id:
+            return File.objects.filter(id=self.file_id).values_list('folder_id', flat=True).first()
+        return Folder.objects.filter(id=self.folder_id).values_list('parent_id', flat=True).first()
+    
+    def save(self, *args, **kwargs):
+        from .listing_cache import bump_generations
+        from . import trashed
+        super().save(*args, **kwargs)
+        # Listings leave out trashed items
+        bump_generations([self.containing_folder_id()])
+        if self.folder_id:
+            trashed.refresh(self.folder_id)
+    
+    def delete(self, *args, **kwargs):
+        from .listing_cache import bump_generations
+        from . import trashed
+        folder_id = self.folder_id
+        containing_folder_id = self.containing_folder_id()
+        result = super().delete(*args, **kwargs)
+        bump_generations([containing_folder_id])
+        if folder_id:
+            trashed.refresh(folder_id)
+        return result
 
 class RecentActivity(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=255)  # e.g., "uploaded", "viewed", "deleted"
     item_name = models.CharField(max_length=255)
     item_type = models.CharField(max_length=10)  # "file" or "folder"
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         verbose_name = "Recent Activity"
         verbose_name_plural = "Recent Activities"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='activity_user_time_idx'),
+            models.Index(fields=['-timestamp'], name='activity_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} {self.action} {self.item_name}"
+
+class ChangeCursor(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='change_cursor')
+    value = models.BigIntegerField(default=0)  # last cursor handed out
+    floor = models.BigIntegerField(default=0)  # highest cursor removed by compaction
+    
+    class Meta:
+        verbose_name = "Change Cursor"
+        verbose_name_plural = "Change Cursors"
+    
+    def __str__(self):
+        return f"{self.user.username} at {self.value}"
+
+class Change(models.Model):
+    ACTION_CHOICES = [
+        ('create', 'Created'),
+        ('update', 'Updated'),
+        ('move', 'Moved'),
+        ('trash', 'Trashed'),
+        ('restore', 'Restored'),
+        ('delete', 'Deleted'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    cursor = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    item_type = models.CharField(max_length=10)  # "file" or "folder"
+    item_id = models.BigIntegerField()
+    # Snapshot of the item after the change, so a single row is enough for clients
+    parent_id = models.BigIntegerField(blank=True, null=True)
+    name = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField(blank=True, null=True)
+    is_public = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Change"
+        verbose_name_plural = "Changes"
+        ordering = ['cursor']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'cursor'], name='change_user_cursor_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} #{self.cursor} {self.action} {self.item_type} {self.item_id}"
+
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+class ThrottleCounter(models.Model):
+    """Shared counter for throttling when DRIVE_THROTTLE_STORE is 'database'"""
+    key = models.CharField(max_length=200, unique=True)
+    value = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        verbose_name = "Throttle Counter"
+        verbose_name_plural = "Throttle Counters"
+    
+    def __str__(self):
+        return f"{self.key}={self.value}"
+
+class Chunk(models.Model):
+    """A piece of file content, stored once however many versions use it"""
+    hash = models.CharField(max_length=64, unique=True)  # sha256 of the bytes
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Touched whenever an upload or conversion stores the chunk again; garbage
+    # collection's grace period counts from here
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        verbose_name = "Chunk"
+        verbose_name_plural = "Chunks"
+    
+    def __str__(self):
+        return self.hash
+    
+    @property
+    def path(self):
+        return storage.chunk_path(self.hash)
+
+class FileVersion(models.Model):
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64, blank=True, default='')  # sha256 of the content
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "File Version"
+        verbose_name_plural = "File Versions"
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'number'], name='fileversion_file_number_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.file.name} v{self.number}"
+    
+    def open(self):
+        """Open a stream of this version's content"""
+        chunks = self.chunks.order_by('position').values_list('chunk__hash', 'chunk__size')
+        return storage.ChunkedReader([(storage.chunk_path(chunk_hash), size) for chunk_hash, size in chunks])
+
+class VersionChunk(models.Model):
+    """Position of a chunk in a version's manifest"""
+    version = models.ForeignKey(FileVersion, on_delete=models.CASCADE, related_name='chunks')
+    position = models.PositiveIntegerField()
+    chunk = models.ForeignKey(Chunk, on_delete=models.PROTECT)
+    
+    class Meta:
+        verbose_name = "Version Chunk"
+        verbose_name_plural = "Version Chunks"
+        constraints = [
+            models.UniqueConstraint(fields=['version', 'position'], name='versionchunk_version_position_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.version} #{self.position}"
+
+class ChunkUpload(models.Model):
+    """
+    A chunk the user uploaded themselves. Chunks are shared between users,
+    so a manifest may only name chunks the user uploaded or already has in
+    one of their versions; knowing a hash is not enough.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE, related_name='uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Chunk Upload"
+        verbose_name_plural = "Chunk Uploads"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'chunk'], name='chunkupload_user_chunk_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} uploaded {self.chunk_id}"
+
+class DuplicateReport(models.Model):
+    """The last duplicate scan of a user's drive, written by the 'find_duplicates' job"""
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, related_name='duplicate_report')
+    # Journal cursor when the scan started; the report is current while it matches
+    cursor = models.BigIntegerField(default=0)
+    report = models.JSONField(default=dict)
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name = "Duplicate Report"
+        verbose_name_plural = "Duplicate Reports"
+    
+    def __str__(self):
+        return f"Duplicates of {self.owner.username}"
+
+class MediaMetadata(models.Model):
+    """What the gallery needs about an image or video, extracted once after upload"""
+    KIND_CHOICES = [
+        ('image', 'Image'),
+        ('video', 'Video'),
+    ]
+    
+    file = models.OneToOneField(File, on_delete=models.CASCADE, primary_key=True, related_name='media')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)  # copied from the file for the gallery index
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    width = models.PositiveIntegerField(blank=True, null=True)  # as displayed, after EXIF rotation
+    height = models.PositiveIntegerField(blank=True, null=True)
+    orientation = models.PositiveSmallIntegerField(default=1)  # EXIF orientation, 1-8
+    duration = models.FloatField(blank=True, null=True)  # seconds, for videos when ffprobe is installed
+    captured_at = models.DateTimeField()  # EXIF or container capture time, else the upload time
+    thumbnail = models.CharField(max_length=100, blank=True)  # storage name of the WebP thumbnail
+    extracted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Media Metadata"
+        verbose_name_plural = "Media Metadata"
+        indexes = [
+            models.Index(fields=['owner', '-captured_at', '-file'], name='media_owner_captured_idx'),
+            models.Index(fields=['owner', 'kind', '-captured_at', '-file'], name='media_owner_kind_captured_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.file_id} ({self.width}x{self.height})"
+    
+    def thumbnail_url(self):
+        if not self.thumbnail:
+            return None
+        return reverse('thumbnail', args=[self.file_id, os.path.basename(self.thumbnail)])
+
+class RecentItem(models.Model):
+    """A file in a user's recent list: one row per file, trimmed to DRIVE_RECENT_ITEMS per user"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='+')
+    action = models.CharField(max_length=20)  # the latest of "viewed", "uploaded", "downloaded"
+    accessed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Recent Item"
+        verbose_name_plural = "Recent Items"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'file'], name='recentitem_user_file_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-accessed_at'], name='recentitem_user_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} {self.action} {self.file_id}"
+
+class Star(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, blank=True, null=True, related_name='+')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, blank=True, null=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Star"
+        verbose_name_plural = "Stars"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'file'], name='star_user_file_unique'),
+            models.UniqueConstraint(fields=['user', 'folder'], name='star_user_folder_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='star_user_time_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} {self.action} {self.item_name}"
\ No newline at end of file
+        return f"{self.user.username} starred {self.file_id or self.folder_id}"
@@ -0,0 +1,127 @@
+from django.db.models import Sum
+from .models import Chunk, File, Folder, RecentActivity, StorageSettings, Trash, VersionChunk
+from . import jobs, journal, listing_cache, quick_access, storage
+
+BATCH_SIZE = 500
+
+
+class QuotaExceeded(Exception):
+    """The upload would take its owner over their storage space"""
+
+
+def quota():
+    storage_settings = StorageSettings.objects.first()
+    if not storage_settings:
+        storage_settings = StorageSettings.objects.create()
+    return storage_settings.space_per_user
+
+
+def used_space(user):
+    """
+    Bytes charged to user: whole files by their size, chunked files by the
+    distinct chunks of all their versions, so history costs only what changed
+    """
+    whole = File.objects.filter(owner=user, current_version__isnull=True).aggregate(total=Sum('size'))['total'] or 0
+    chunk_ids = VersionChunk.objects.filter(version__file__owner=user).values('chunk_id')
+    chunked = Chunk.objects.filter(id__in=chunk_ids).aggregate(total=Sum('size'))['total'] or 0
+    return whole + chunked
+
+
+def usage_by_user():
+    """used_space of every user with files, as {user id: bytes}"""
+    usage = dict(
+        File.objects.filter(current_version__isnull=True).order_by()
+        .values_list('owner_id').annotate(total=Sum('size'))
+    )
+    pairs = (
+        VersionChunk.objects.order_by()
+        .values_list('version__file__owner_id', 'chunk_id', 'chunk__size').distinct()
+    )
+    for owner_id, _, size in pairs.iterator():
+        usage[owner_id] = usage.get(owner_id, 0) + size
+    return usage
+
+
+def item_type(item):
+    return 'file' if isinstance(item, File) else 'folder'
+
+
+def create_folder(user, folder):
+    """Save a new folder for user and record it"""
+    folder.owner = user
+    folder.save()
+    journal.record_change(user, 'create', folder)
+    RecentActivity.objects.create(user=user, action="created", item_name=folder.name, item_type="folder")
+    return folder
+
+
+def add_file(user, file_obj):
+    """Save an uploaded file for user, enforcing their quota, and queue post-upload work"""
+    file_obj.owner = user
+    # Auto-populate name from filename if not provided
+    if not file_obj.name and file_obj.file:
+        file_obj.name = file_obj.file.name.split('/')[-1]
+    file_obj.save()
+
+    if used_space(user) > quota():
+        file_obj.delete()
+        raise QuotaExceeded()
+
+    journal.record_change(user, 'create', file_obj)
+    # Hashing and compression run on the workers once the bytes are stored
+    jobs.enqueue('process_upload', file_id=file_obj.id)
+    RecentActivity.objects.create(user=user, action="uploaded", item_name=file_obj.name, item_type="file")
+    quick_access.touch(user, file_obj, 'uploaded', buffered=False)
+    return file_obj
+
+
+def trash(user, item):
+    """Move a file or folder to user's trash"""
+    kind = item_type(item)
+    entry = Trash.objects.create(owner=user, **{kind: item})
+    journal.record_change(user, 'trash', item)
+    RecentActivity.objects.create(user=user, action="deleted", item_name=item.name, item_type=kind)
+    return entry
+
+
+def restore(user, trash_item):
+    """Take an item back out of the trash and return it"""
+    item = trash_item.file or trash_item.folder
+    journal.record_change(user, 'restore', item)
+    RecentActivity.objects.create(user=user, action="restored", item_name=item.name, item_type=item_type(item))
+    trash_item.delete()
+    return item
+
+
+def purge(user, item):
+    """Permanently delete a file, or a folder and everything in it, with the stored bytes"""
+    # Clients drop the whole subtree of a deleted folder
+    journal.record_change(user, 'delete', item)
+    if isinstance(item, File):
+        storage.delete_stored(item)
+        item.delete()
+        return
+    folder_ids = [item.id]
+    level = [item.id]
+    while level:
+        level = [
+            folder_id for start in range(0, len(level), BATCH_SIZE)
+            for folder_id in Folder.objects.filter(parent_id__in=level[start:start + BATCH_SIZE]).values_list('id', flat=True)
+        ]
+        folder_ids.extend(level)
+    for start in range(0, len(folder_ids), BATCH_SIZE):
+        for file_obj in File.objects.filter(folder_id__in=folder_ids[start:start + BATCH_SIZE]).only('id', 'file', 'tier'):
+            storage.delete_stored(file_obj)
+    # Subfolders and files go with it by cascade
+    item.delete()
+
+
+def move_files(user, file_ids, folder):
+    """Move the given files of user into folder in one UPDATE. Returns the number moved."""
+    files = File.objects.filter(id__in=file_ids, owner=user)
+    old_folders = set(files.values_list('folder_id', flat=True).distinct())
+    moved = files.exclude(folder=folder).update(folder=folder)
+    if moved:
+        listing_cache.bump_generations(old_folders)
+        journal.record_changes(user, [('move', file_obj) for file_obj in File.objects.filter(id__in=file_ids, owner=user)])
+    return moved
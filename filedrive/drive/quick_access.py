@@ -0,0 +1,143 @@
+"""
+Recent and starred items for the home page. Each user's recent files are a
+RecentItem row per file, upserted on view, upload and download and trimmed
+to the newest DRIVE_RECENT_ITEMS, so both lists are one query on a
+(user, time) index instead of a scan of the activity log.
+"""
+import atexit
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import File, RecentItem, Star
+
+# Views and downloads are written in batches like the activity log; uploads
+# are written at once
+FLUSH_SIZE = 200
+FLUSH_INTERVAL = 10  # seconds
+
+_lock = threading.Lock()
+_pending = {}  # (user id, file id) -> (action, time)
+_last_flush = time.monotonic()
+_timer = None  # flushes a partial batch FLUSH_INTERVAL after its first entry
+
+
+def limit():
+    return getattr(settings, 'DRIVE_RECENT_ITEMS', 20)
+
+
+def touch(user, file_obj, action, buffered=True):
+    """Move file_obj to the top of user's recent files"""
+    key = (user.id, file_obj.id)
+    now = timezone.now()
+    if not buffered or not getattr(settings, 'DRIVE_BATCH_READ_ACTIVITY', True):
+        write({key: (action, now)})
+        return
+    global _timer
+    with _lock:
+        _pending[key] = (action, now)
+        due = len(_pending) >= FLUSH_SIZE or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if not due and _timer is None:
+            # Written FLUSH_INTERVAL after the first entry even without further reads
+            _timer = threading.Timer(FLUSH_INTERVAL, flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+    if due:
+        flush()
+
+
+def flush_in_background():
+    try:
+        flush()
+    finally:
+        # The timer thread's connection would otherwise stay open
+        connections.close_all()
+
+
+def flush():
+    """Write buffered entries. Returns the number written."""
+    global _last_flush, _timer
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    return write(pending)
+
+
+def write(entries):
+    if not entries:
+        return 0
+    # Files deleted since they were read would fail the foreign key
+    existing = set(File.objects.filter(id__in={file_id for _, file_id in entries}).values_list('id', flat=True))
+    items = [
+        RecentItem(user_id=user_id, file_id=file_id, action=action, accessed_at=accessed_at)
+        for (user_id, file_id), (action, accessed_at) in entries.items() if file_id in existing
+    ]
+    RecentItem.objects.bulk_create(
+        items, update_conflicts=True, unique_fields=['user', 'file'], update_fields=['action', 'accessed_at'],
+    )
+    trim({item.user_id for item in items})
+    return len(items)
+
+
+def trim(user_ids):
+    """Delete all but the newest DRIVE_RECENT_ITEMS entries of each user"""
+    for user_id in user_ids:
+        stale = list(
+            RecentItem.objects.filter(user_id=user_id).order_by('-accessed_at', '-id')
+            .values_list('id', flat=True)[limit():]
+        )
+        if stale:
+            RecentItem.objects.filter(id__in=stale).delete()
+
+
+atexit.register(flush)
+
+
+def recent_files(user, count=10):
+    """The user's recent files that are still visible to them and not in the trash"""
+    # The user's own reads from this process show up at once
+    with _lock:
+        waiting = any(user_id == user.id for user_id, _ in _pending)
+    if waiting:
+        flush()
+    return list(
+        RecentItem.objects.filter(user=user)
+        .filter(Q(file__owner=user) | Q(file__is_public=True))
+        .filter(Q(file__folder__isnull=True) | Q(file__folder__in_trash=False), file__trash__isnull=True)
+        .select_related('file').order_by('-accessed_at')[:count]
+    )
+
+
+def starred(user, count=10):
+    """The user's starred files and folders that they can still see, newest star first"""
+    active_file = Q(file__trash__isnull=True) & (Q(file__folder__isnull=True) | Q(file__folder__in_trash=False))
+    return list(
+        Star.objects.filter(user=user)
+        .filter(Q(file__owner=user) | Q(file__is_public=True) | Q(folder__owner=user) | Q(folder__is_public=True))
+        .filter(Q(file__isnull=False) & active_file | Q(folder__in_trash=False))
+        .select_related('file', 'folder').order_by('-created_at', '-id')[:count]
+    )
+
+
+def item_kind(item):
+    return 'file' if isinstance(item, File) else 'folder'
+
+
+def is_starred(user, item):
+    return Star.objects.filter(user=user, **{item_kind(item): item}).exists()
+
+
+def toggle_star(user, item):
+    """Star a file or folder, or remove its star. Returns whether it is starred now."""
+    kind = item_kind(item)
+    deleted, _ = Star.objects.filter(user=user, **{kind: item}).delete()
+    if deleted:
+        return False
+    Star.objects.get_or_create(user=user, **{kind: item})
+    return True
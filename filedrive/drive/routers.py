@@ -0,0 +1,71 @@
+"""
+Read/write splitting. Writes go to the 'default' database and reads to one
+of DRIVE_READ_REPLICAS, except where a replica could be behind what the
+client already saw:
+
+- inside a transaction on the primary
+- for the rest of a request (or worker) once it has written anything
+- for DRIVE_REPLICA_STICKY_SECONDS after a client's last POST, PUT, PATCH
+  or DELETE, tracked by a cookie so that it works across processes
+"""
+import contextvars
+import random
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'drive_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_pinned = contextvars.ContextVar('drive_pinned', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DRIVE_READ_REPLICAS', [])
+
+
+def pin_to_primary():
+    """Read from the primary for the rest of the request"""
+    _pinned.set(True)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        # Reads after a write must see it
+        _pinned.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """Pin mutating requests, and the same client's requests shortly after them, to the primary"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mutating = request.method not in SAFE_METHODS
+        # Threads serve many requests, so the flag is reset for each one
+        token = _pinned.set(mutating or STICKY_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        if mutating and replicas():
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=getattr(settings, 'DRIVE_REPLICA_STICKY_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
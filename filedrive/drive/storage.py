@@ -0,0 +1,343 @@
+import bisect
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import shutil
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage, default_storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+ENCODING_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+TIER_CHOICES = [
+    ('hot', 'Hot'),
+    ('cold', 'Cold'),
+]
+
+
+def tier_root(tier):
+    """Directory that file names of the given tier are relative to"""
+    if tier == 'cold':
+        return getattr(settings, 'DRIVE_COLD_STORAGE_ROOT', None)
+    return settings.MEDIA_ROOT
+
+
+def path_for(name, tier='hot'):
+    return os.path.join(tier_root(tier), name)
+
+
+class TieredStorage(FileSystemStorage):
+    """
+    Media storage that treats a name as taken while any tier stores it, so a
+    new upload never reuses the name of a file that moved to cold storage
+    """
+
+    def exists(self, name):
+        if super().exists(name):
+            return True
+        cold = tier_root('cold')
+        return cold is not None and os.path.lexists(os.path.join(cold, name))
+
+
+def stored_path(file_obj):
+    """Absolute path of the stored bytes of file_obj on its current tier"""
+    return path_for(file_obj.file.name, file_obj.tier)
+
+
+def chunk_path(chunk_hash):
+    """Path of a stored chunk; chunks always live on the hot tier"""
+    return path_for(os.path.join('chunks', chunk_hash[:2], chunk_hash))
+
+
+def delete_stored(file_obj):
+    """Remove the stored bytes of a whole file. Chunks are collected by prune_versions."""
+    if not file_obj.file.name:
+        return
+    path = stored_path(file_obj)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def compression_encoding():
+    """Return the configured at-rest encoding, or None when compression is off"""
+    return getattr(settings, 'DRIVE_COMPRESSION', None) or None
+
+
+def readable_encodings():
+    """Encodings whose stored files this installation can decompress"""
+    return {encoding for encoding in ENCODING_SUFFIXES if encoding != 'zstd' or zstandard is not None}
+
+
+def check_compression():
+    """Refuse to start with a DRIVE_COMPRESSION the workers could not write or read back"""
+    encoding = compression_encoding()
+    if encoding is not None and encoding not in ENCODING_SUFFIXES:
+        raise ImproperlyConfigured(f"DRIVE_COMPRESSION must be None, 'gzip' or 'zstd', not {encoding!r}")
+    if encoding is not None and encoding not in readable_encodings():
+        raise ImproperlyConfigured(f"DRIVE_COMPRESSION is {encoding!r} but the zstandard package is not installed")
+
+
+def should_compress(category):
+    return compression_encoding() is not None and category in getattr(settings, 'DRIVE_COMPRESSED_CATEGORIES', ['text'])
+
+
+def create_available(name, max_length=None):
+    """
+    Create an empty file under a storage name that no other file uses, based
+    on name. Returns the name and the file opened for writing.
+    """
+    while True:
+        available = default_storage.get_available_name(name, max_length=max_length)
+        path = path_for(available)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            return available, open(path, 'xb')
+        except FileExistsError:
+            # Taken by a concurrent upload after the check
+            continue
+
+
+def compress_path(name, encoding, max_length=None):
+    """
+    Compress the hot-tier file name into a new file under an unused name.
+    Returns the new name and its size, or None when compression does not make
+    the file smaller.
+    """
+    path = path_for(name)
+    target_name, raw = create_available(name + ENCODING_SUFFIXES[encoding], max_length)
+    target = path_for(target_name)
+    with open(path, 'rb') as source, raw:
+        if encoding == 'zstd':
+            with zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False) as writer:
+                while chunk := source.read(CHUNK_SIZE):
+                    writer.write(chunk)
+        else:
+            # A fixed mtime and no filename keep the output deterministic
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as writer:
+                while chunk := source.read(CHUNK_SIZE):
+                    writer.write(chunk)
+
+    compressed_size = os.path.getsize(target)
+    if compressed_size >= os.path.getsize(path):
+        os.remove(target)
+        return None
+    return target_name, compressed_size
+
+
+def compress_file(file_obj):
+    """Replace the stored bytes of file_obj with a compressed copy if worthwhile"""
+    encoding = compression_encoding()
+    if file_obj.encoding or file_obj.tier != 'hot' or not file_obj.file.name or not should_compress(file_obj.category):
+        return False
+
+    path = stored_path(file_obj)
+    result = compress_path(file_obj.file.name, encoding, file_obj._meta.get_field('file').max_length)
+    if result is None:
+        return False
+
+    file_obj.file.name, compressed_size = result
+    file_obj.encoding = encoding
+    file_obj.stored_size = compressed_size
+    file_obj.save(update_fields=['file', 'encoding', 'stored_size'])
+    os.remove(path)
+    return True
+
+
+def open_stored(file_obj):
+    """Open the bytes exactly as they are stored on disk"""
+    try:
+        return open(stored_path(file_obj), 'rb')
+    except FileNotFoundError:
+        # The file may have changed tiers after file_obj was loaded
+        other = 'hot' if file_obj.tier == 'cold' else 'cold'
+        if tier_root(other) is None:
+            raise
+        return open(path_for(file_obj.file.name, other), 'rb')
+
+
+class GzipReader(gzip.GzipFile):
+    """GzipFile over an open stream that it also closes, like a file it opened itself"""
+
+    def __init__(self, raw):
+        super().__init__(fileobj=raw, mode='rb')
+        self.raw = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.raw.close()
+
+
+def decode(raw, encoding):
+    """Wrap a raw stored stream in a decompressor for its encoding"""
+    if encoding and encoding not in readable_encodings():
+        raw.close()
+        raise OSError(f"Stored with {encoding}, which this installation cannot decompress")
+    if encoding == 'gzip':
+        return GzipReader(raw)
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    return raw
+
+
+class ChunkedReader(io.RawIOBase):
+    """Seekable stream over the concatenation of chunk files, given as (path, size) pairs"""
+
+    def __init__(self, parts):
+        self.paths = [path for path, size in parts]
+        self.starts = []
+        offset = 0
+        for path, size in parts:
+            self.starts.append(offset)
+            offset += size
+        self.length = offset
+        self.position = 0
+        self.index = None
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer):
+        if self.position >= self.length or not len(buffer):
+            return 0
+        index = bisect.bisect_right(self.starts, self.position) - 1
+        if index != self.index:
+            if self.current is not None:
+                self.current.close()
+            self.current = open(self.paths[index], 'rb')
+            self.index = index
+        self.current.seek(self.position - self.starts[index])
+        read = self.current.readinto(buffer)
+        if not read:
+            raise OSError(f'Chunk {self.paths[index]} is shorter than recorded')
+        self.position += read
+        return read
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        super().close()
+
+
+def open_content(file_obj):
+    """Open a stream of the logical file content, decompressing if needed"""
+    if file_obj.current_version_id:
+        return io.BufferedReader(file_obj.current_version.open(), HASH_CHUNK_SIZE)
+    return decode(open_stored(file_obj), file_obj.encoding)
+
+
+def accepts_encoding(request, encoding):
+    """Whether the client's Accept-Encoding allows the given content coding"""
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = part.strip().partition(';')
+        if token.strip().lower() != encoding:
+            continue
+        params = params.replace(' ', '')
+        return params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def hash_path(path, encoding):
+    """sha256 and length of the logical content of a stored file"""
+    digest = hashlib.sha256()
+    length = 0
+    with open(path, 'rb') as raw:
+        if encoding:
+            with decode(raw, encoding) as fh:
+                while chunk := fh.read(HASH_CHUNK_SIZE):
+                    digest.update(chunk)
+                    length += len(chunk)
+            return digest.hexdigest(), length
+
+        size = os.fstat(raw.fileno()).st_size
+        if size:
+            # Hash straight from the page cache without copying into Python buffers
+            with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+                        digest.update(view[offset:offset + HASH_CHUNK_SIZE])
+                finally:
+                    view.release()
+        return digest.hexdigest(), size
+
+
+def copy_durably(source, target):
+    """
+    Copy source to target so that target is either absent or complete, even
+    after a crash. Raises FileExistsError instead of replacing an existing target.
+    """
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    partial = target + '.partial'
+    with open(source, 'rb') as src, open(partial, 'wb') as dst:
+        shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+        dst.flush()
+        os.fsync(dst.fileno())
+    try:
+        # Unlike a rename, a link fails when the target exists
+        os.link(partial, target)
+    finally:
+        os.remove(partial)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def move_to_tier(file_obj, tier):
+    """
+    Move the stored bytes of file_obj to another tier. The copy is made durable
+    before the row points at it and the old copy is removed only afterwards,
+    so an interrupted move leaves at worst a stray copy, never a lost file.
+    Returns the number of bytes moved.
+    """
+    if file_obj.tier == tier or tier_root(tier) is None:
+        return 0
+    source = stored_path(file_obj)
+    target = path_for(file_obj.file.name, tier)
+    copy_durably(source, target)
+
+    updated = type(file_obj).objects.filter(
+        id=file_obj.id, tier=file_obj.tier, file=file_obj.file.name,
+    ).update(tier=tier)
+    if not updated:
+        # Moved, compressed or deleted by someone else meanwhile
+        os.remove(target)
+        return 0
+    file_obj.tier = tier
+    os.remove(source)
+    return os.path.getsize(target)
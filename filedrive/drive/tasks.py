@@ -0,0 +1,125 @@
+import hashlib
+import os
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from .jobs import handler
+from .models import File, FileVersion, Folder
+from . import duplicates, journal, media, operations, storage, versions
+
+
+def stream_checksum(fh):
+    digest = hashlib.sha256()
+    while chunk := fh.read(storage.HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_checksum(file_obj):
+    """sha256 of the logical content of a file"""
+    if file_obj.is_chunked():
+        with file_obj.open_content() as fh:
+            return stream_checksum(fh)
+    return storage.hash_path(storage.stored_path(file_obj), file_obj.encoding)[0]
+
+
+@handler('hash_file')
+def hash_file(file_id):
+    file_obj = File.objects.filter(id=file_id).first()
+    if file_obj is None:
+        return
+    checksum = content_checksum(file_obj)
+    File.objects.filter(id=file_id).update(checksum=checksum)
+
+
+@handler('compress_file')
+def compress_file(file_id):
+    file_obj = File.objects.filter(id=file_id).first()
+    if file_obj is None:
+        return
+    storage.compress_file(file_obj)
+
+
+@handler('process_upload')
+def process_upload(file_id):
+    """Post-upload work, run in order so steps never race on the same file"""
+    hash_file(file_id)
+    extract_media(file_id)
+    compress_file(file_id)
+
+
+@handler('extract_media')
+def extract_media(file_id):
+    """Index the dimensions, capture time and thumbnail of an image or video"""
+    file_obj = File.objects.filter(id=file_id).first()
+    if file_obj is None or file_obj.category not in ('image', 'video'):
+        return
+    media.extract(file_obj)
+
+
+@handler('promote_file')
+def promote_file(file_id):
+    """Move a file that is being read again back to hot storage"""
+    file_obj = File.objects.filter(id=file_id).first()
+    if file_obj is None:
+        return
+    storage.move_to_tier(file_obj, 'hot')
+
+
+@handler('hash_version')
+def hash_version(version_id):
+    version = FileVersion.objects.filter(id=version_id).first()
+    if version is None:
+        return
+    with version.open() as fh:
+        checksum = stream_checksum(fh)
+    FileVersion.objects.filter(id=version_id).update(checksum=checksum)
+    File.objects.filter(current_version_id=version_id).update(checksum=checksum)
+
+
+@handler('chunk_file')
+def chunk_file(file_id):
+    """Convert a whole file to chunks so clients can send it new versions as deltas"""
+    file_obj = File.objects.filter(id=file_id).first()
+    if file_obj is None:
+        return
+    versions.convert(file_obj)
+
+
+@handler('find_duplicates')
+def find_duplicates(user_id):
+    """Scan a user's drive for duplicates for the Duplicates page"""
+    owner = User.objects.filter(id=user_id).first()
+    if owner is None:
+        return
+    duplicates.scan(owner)
+
+
+@handler('purge_items')
+def purge_items(files=(), folders=()):
+    """Permanently delete files and folders picked in the admin; missing ids were done already"""
+    for folder in Folder.objects.filter(id__in=folders).select_related('owner'):
+        operations.purge(folder.owner, folder)
+    for file_obj in File.objects.filter(id__in=files).select_related('owner'):
+        operations.purge(file_obj.owner, file_obj)
+
+
+@handler('measure_files')
+def measure_files(file_ids):
+    """Recompute size, stored size and checksum of files from what is actually stored"""
+    for file_obj in File.objects.filter(id__in=file_ids).select_related('owner'):
+        if file_obj.is_chunked():
+            size = file_obj.current_version.chunks.aggregate(total=Sum('chunk__size'))['total'] or 0
+            stored_size, checksum = size, file_obj.checksum
+        else:
+            path = storage.stored_path(file_obj)
+            try:
+                checksum, size = storage.hash_path(path, file_obj.encoding)
+                stored_size = os.path.getsize(path)
+            except FileNotFoundError:
+                # Reported by scrub_storage; nothing to measure
+                continue
+        changed = size != file_obj.size
+        File.objects.filter(id=file_obj.id).update(size=size, stored_size=stored_size, checksum=checksum)
+        if changed:
+            file_obj.size = size
+            journal.record_change(file_obj.owner, 'update', file_obj)
@@ -0,0 +1,18 @@
+from django import template
+from django.urls import reverse
+from drive.avatars import rendition_for
+
+register = template.Library()
+
+
+@register.filter
+def avatar_url(photo, size):
+    """URL of the rendition of a profile photo suited to size pixels"""
+    name = getattr(photo, 'name', '')
+    if not name:
+        return ''
+    rendition = rendition_for(name, int(size))
+    if rendition is None:
+        # Not processed yet (see build_avatars)
+        return photo.url
+    return reverse('avatar', args=[rendition])
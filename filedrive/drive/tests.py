@@ -1,3 +1,248 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import Chunk, File, Folder, MediaMetadata, Trash, UserProfile
+from . import access, logins, media, metrics, operations, quick_access, storage, versions
 
-# Create your tests here.
+
+class StorageTestCase(TestCase):
+    """Runs each test against empty temporary media and cold-tier roots"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.cold_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.cold_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media_root, DRIVE_COLD_STORAGE_ROOT=self.cold_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def add_file(self, owner, name, content, **fields):
+        return File.objects.create(owner=owner, name=name, file=SimpleUploadedFile(name, content), **fields)
+
+    def stored_bytes(self, file_obj):
+        with storage.open_stored(file_obj) as fh:
+            return fh.read()
+
+
+@override_settings(DRIVE_COMPRESSION='gzip')
+class CompressionTests(StorageTestCase):
+    def test_compressed_copy_does_not_overwrite_existing_name(self):
+        existing = self.add_file(self.alice, 'notes.txt.gz', b'uploaded as is')
+        plain = self.add_file(self.bob, 'notes.txt', b'compressible line\n' * 500, category='text')
+
+        self.assertTrue(storage.compress_file(plain))
+
+        self.assertNotEqual(plain.file.name, existing.file.name)
+        self.assertEqual(self.stored_bytes(existing), b'uploaded as is')
+        self.assertEqual(gzip.decompress(self.stored_bytes(plain)), b'compressible line\n' * 500)
+        plain.refresh_from_db()
+        self.assertEqual(plain.encoding, 'gzip')
+        self.assertFalse(os.path.exists(storage.path_for('user_files/notes.txt')))
+
+
+class TieringTests(StorageTestCase):
+    def test_upload_does_not_reuse_name_of_cold_file(self):
+        first = self.add_file(self.alice, 'report.txt', b'AAAAAAAA')
+        storage.move_to_tier(first, 'cold')
+        second = self.add_file(self.bob, 'report.txt', b'BBBBBBBB')
+
+        self.assertNotEqual(second.file.name, first.file.name)
+        storage.move_to_tier(second, 'cold')
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.tier, second.tier), ('cold', 'cold'))
+        self.assertEqual(self.stored_bytes(first), b'AAAAAAAA')
+        self.assertEqual(self.stored_bytes(second), b'BBBBBBBB')
+
+    def test_move_does_not_replace_existing_target(self):
+        file_obj = self.add_file(self.alice, 'report.txt', b'hot copy')
+        target = storage.path_for(file_obj.file.name, 'cold')
+        os.makedirs(os.path.dirname(target))
+        with open(target, 'wb') as fh:
+            fh.write(b'older cold file')
+
+        with self.assertRaises(FileExistsError):
+            storage.move_to_tier(file_obj, 'cold')
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.tier, 'hot')
+        self.assertEqual(self.stored_bytes(file_obj), b'hot copy')
+        with open(target, 'rb') as fh:
+            self.assertEqual(fh.read(), b'older cold file')
+
+
+@override_settings(DRIVE_BATCH_READ_ACTIVITY=True)
+class BufferedWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice')
+        self.file = File.objects.create(owner=self.user, name='a.txt', size=0)
+
+    def test_recent_view_is_listed_and_scheduled(self):
+        self.addCleanup(quick_access.flush)
+        quick_access.touch(self.user, self.file, 'viewed')
+
+        self.assertTrue(quick_access._timer.daemon)
+        self.assertEqual(quick_access._timer.interval, quick_access.FLUSH_INTERVAL)
+        self.assertEqual([item.file for item in quick_access.recent_files(self.user)], [self.file])
+        self.assertIsNone(quick_access._timer)
+
+    def test_access_count_is_scheduled(self):
+        self.addCleanup(access.flush)
+        access.record_access(self.file)
+
+        self.assertTrue(access._timer.daemon)
+        self.assertEqual(access._timer.interval, access.FLUSH_INTERVAL)
+        self.assertEqual(access.flush(), 1)
+        self.assertIsNone(access._timer)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.access_score, 1)
+
+    def test_last_login_is_scheduled(self):
+        self.addCleanup(logins.flush)
+        logins.record_login(None, self.user)
+
+        self.assertTrue(logins._timer.daemon)
+        self.assertEqual(logins._timer.interval, logins.FLUSH_INTERVAL)
+        self.assertEqual(logins.flush(), 1)
+        self.assertIsNone(logins._timer)
+        self.assertIsNotNone(User.objects.get(id=self.user.id).last_login)
+
+
+class TrashFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice')
+        self.root = Folder.objects.create(name='Home', owner=self.user)
+        self.outer = Folder.objects.create(name='outer', owner=self.user, parent=self.root)
+        self.inner = Folder.objects.create(name='inner', owner=self.user, parent=self.outer)
+
+    def add_photo(self, name, folder):
+        file_obj = File.objects.create(owner=self.user, name=name, folder=folder, size=1)
+        MediaMetadata.objects.create(file=file_obj, owner=self.user, kind='image', captured_at=file_obj.created_at)
+        return file_obj
+
+    def gallery_names(self):
+        return {item.file.name for item in media.gallery_page(self.user)[0]}
+
+    def test_trashing_a_folder_marks_its_subtree(self):
+        operations.trash(self.user, self.outer)
+        self.assertEqual(set(Folder.objects.filter(in_trash=True)), {self.outer, self.inner})
+
+        Trash.objects.get(folder=self.outer).delete()
+        self.assertFalse(Folder.objects.filter(in_trash=True).exists())
+
+    def test_moving_into_a_trashed_folder_hides_the_subtree(self):
+        other = Folder.objects.create(name='other', owner=self.user, parent=self.root)
+        operations.trash(self.user, other)
+        self.inner.parent = other
+        self.inner.save()
+        self.assertEqual(set(Folder.objects.filter(in_trash=True)), {other, self.inner})
+        self.assertTrue(Folder.objects.create(name='new', owner=self.user, parent=self.inner).in_trash)
+
+    def test_gallery_leaves_out_trashed_files(self):
+        self.add_photo('kept.jpg', self.root)
+        trashed_file = self.add_photo('trashed.jpg', self.root)
+        self.add_photo('nested.jpg', self.inner)
+        operations.trash(self.user, trashed_file)
+        operations.trash(self.user, self.outer)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.gallery_names(), {'kept.jpg'})
+        operations.restore(self.user, Trash.objects.get(folder=self.outer))
+        self.assertEqual(self.gallery_names(), {'kept.jpg', 'nested.jpg'})
+
+    def test_quick_access_leaves_out_trashed_items(self):
+        kept = File.objects.create(owner=self.user, name='kept.txt', folder=self.root, size=1)
+        nested = File.objects.create(owner=self.user, name='nested.txt', folder=self.inner, size=1)
+        for item in (kept, nested, self.outer, self.inner):
+            quick_access.toggle_star(self.user, item)
+        quick_access.write({(self.user.id, kept.id): ('viewed', kept.created_at), (self.user.id, nested.id): ('viewed', nested.created_at)})
+        operations.trash(self.user, self.outer)
+
+        self.assertEqual([item.file for item in quick_access.recent_files(self.user)], [kept])
+        self.assertEqual([star.file for star in quick_access.starred(self.user)], [kept])
+
+    def test_files_by_type_leaves_out_trashed_files(self):
+        UserProfile.objects.create(user=self.user)
+        self.addCleanup(logins.flush)
+        self.client.force_login(self.user)
+        File.objects.create(owner=self.user, name='kept.txt', folder=self.root, size=1, category='text', mime_type='text/plain')
+        loose = File.objects.create(owner=self.user, name='loose.txt', folder=self.root, size=1, category='text', mime_type='text/plain')
+        File.objects.create(owner=self.user, name='nested.txt', folder=self.inner, size=1, category='text', mime_type='text/plain')
+        operations.trash(self.user, loose)
+        operations.trash(self.user, self.outer)
+
+        response = self.client.get('/type/text/')
+        self.assertEqual([file_obj.name for file_obj in response.context['files']], ['kept.txt'])
+
+    def test_folder_listing_leaves_out_trashed_items(self):
+        from . import listing_cache
+        listing_cache.get_cache().clear()
+        loose = File.objects.create(owner=self.user, name='loose.txt', folder=self.root, size=1)
+        File.objects.create(owner=self.user, name='kept.txt', folder=self.root, size=1)
+        self.root.refresh_from_db()
+        self.assertEqual(listing_cache.get_listing(self.root)['count'], 3)
+
+        operations.trash(self.user, loose)
+        operations.trash(self.user, self.outer)
+        self.root.refresh_from_db()
+        listing = listing_cache.get_listing(self.root)
+        self.assertEqual([row['name'] for row in listing['folders'] + listing['files']], ['kept.txt'])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings = override_settings(DRIVE_METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def total(self, name):
+        counters, _, _ = metrics.aggregate()
+        return sum(value for (counter, _), value in counters.items() if counter == name)
+
+    def test_counts_of_exited_process_are_kept(self):
+        before = self.total('drive_orphans_adopted_total')
+        # No process has a pid this large
+        with open(os.path.join(self.directory, '99999999-1.json'), 'w') as fh:
+            json.dump({'counters': [['drive_orphans_adopted_total', [], 3]], 'histograms': []}, fh)
+
+        self.assertEqual(self.total('drive_orphans_adopted_total'), before + 3)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '99999999-1.json')))
+        self.assertEqual(self.total('drive_orphans_adopted_total'), before + 3)
+
+
+class ChunkGarbageTests(StorageTestCase):
+    def test_reused_chunk_survives_collection(self):
+        chunk, _ = versions.receive_chunk(self.alice, b'chunk data', None)
+        # Uploaded long ago and never used in a version
+        Chunk.objects.filter(id=chunk.id).update(created_at=timezone.now() - timedelta(days=2), last_used_at=timezone.now() - timedelta(days=2))
+
+        versions.receive_chunk(self.bob, b'chunk data', chunk.hash)
+        self.assertEqual(versions.collect_garbage(timedelta(hours=1)), (0, 0))
+        self.assertTrue(os.path.exists(storage.chunk_path(chunk.hash)))
+
+        Chunk.objects.filter(id=chunk.id).update(last_used_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(versions.collect_garbage(timedelta(hours=1)), (1, len(b'chunk data')))
+        self.assertFalse(os.path.exists(storage.chunk_path(chunk.hash)))
+
+    def test_manifest_of_collected_chunk_is_refused(self):
+        chunk, _ = versions.receive_chunk(self.alice, b'chunk data', None)
+        chunks = versions.resolve(self.alice, [chunk.hash])
+        file_obj = File.objects.create(owner=self.alice, name='a.bin', size=0)
+        # Collected between resolving the manifest and writing the version
+        Chunk.objects.filter(id=chunk.id).delete()
+
+        with self.assertRaises(versions.MissingChunks), transaction.atomic():
+            versions.add_manifest(file_obj, [chunk.hash], chunks)
+        self.assertFalse(file_obj.versions.exists())
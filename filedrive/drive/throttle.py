@@ -0,0 +1,202 @@
+import time
+from functools import wraps
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .models import StorageSettings, ThrottleCounter
+from . import metrics
+
+# Seconds a client is asked to wait when it has too many transfers open
+RETRY_AFTER = 5
+# A transfer slot leaked by a crashed worker is forgotten after this long
+SLOT_TIMEOUT = 60 * 60
+
+
+class CacheCounters:
+    """
+    Counters in a Django cache. Increments are atomic on local memory,
+    Redis and Memcached caches; use one of the latter to share limits
+    between servers.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def incr(self, key, delta, timeout):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.add(key, delta, timeout)
+            return delta
+
+
+class DatabaseCounters:
+    """Counters in the ThrottleCounter table, shared by every worker using the database"""
+
+    def incr(self, key, delta, timeout):
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=timeout)
+        # An expired row starts over instead of accumulating
+        updated = ThrottleCounter.objects.filter(key=key).update(
+            value=Case(When(expires_at__gt=now, then=F('value') + delta), default=Value(delta)),
+            expires_at=Case(When(expires_at__gt=now, then=F('expires_at')), default=Value(expires_at)),
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ThrottleCounter.objects.create(key=key, value=delta, expires_at=expires_at)
+            except IntegrityError:
+                return self.incr(key, delta, timeout)
+            ThrottleCounter.objects.filter(expires_at__lt=now).delete()
+            return delta
+        return ThrottleCounter.objects.filter(key=key).values_list('value', flat=True).first() or 0
+
+
+def counters():
+    if getattr(settings, 'DRIVE_THROTTLE_STORE', 'cache') == 'database':
+        return DatabaseCounters()
+    return CacheCounters(getattr(settings, 'DRIVE_THROTTLE_CACHE', 'default'))
+
+
+def limits():
+    storage_settings = StorageSettings.objects.first()
+    if not storage_settings:
+        storage_settings = StorageSettings.objects.create()
+    return storage_settings
+
+
+def buckets_for(user, limits, file_obj=None):
+    """Bandwidth buckets a transfer draws from: the user's, and the shared file's when it is not theirs"""
+    buckets = [(f'user:{user.id}', limits.user_bandwidth_limit)]
+    if file_obj is not None and file_obj.owner_id != user.id:
+        buckets.append((f'share:{file_obj.id}', limits.share_bandwidth_limit))
+    return [(name, rate) for name, rate in buckets if rate]
+
+
+def consume(buckets, nbytes):
+    """
+    Take nbytes from each bucket, sleeping while one is empty. Each bucket
+    holds one second of its rate and refills at the start of every second.
+    """
+    store = counters()
+    for name, rate in buckets:
+        while True:
+            now = time.time()
+            window = int(now)
+            used = store.incr(f'throttle:bw:{name}:{window}', nbytes, 2)
+            # A request bigger than the whole bucket still goes through on its own
+            if used <= rate or used == nbytes:
+                break
+            store.incr(f'throttle:bw:{name}:{window}', -nbytes, 2)
+            time.sleep(window + 1 - now)
+
+
+class ThrottledStream:
+    """
+    Iterate a file in chunks at no more than the buckets' rates. close() is
+    called by the response even if iteration never started, so the file and
+    the transfer slot are always released.
+    """
+
+    def __init__(self, fh, buckets, release=None, chunk_size=64 * 1024):
+        self.fh = fh
+        self.buckets = buckets
+        self.release = release
+        # Never ask a bucket for more than it can hold
+        self.chunk_size = min([chunk_size] + [rate for _, rate in buckets])
+        self.closed = False
+        self.sent = 0
+        self.started = time.perf_counter()
+
+    def __iter__(self):
+        while chunk := self.fh.read(self.chunk_size):
+            if self.buckets:
+                consume(self.buckets, len(chunk))
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.fh.close()
+        if self.release is not None:
+            self.release()
+        metrics.record_transfer('download', self.sent, time.perf_counter() - self.started)
+
+
+def acquire_transfer(user, limits):
+    """Take one of the user's transfer slots. Returns False when all are in use."""
+    if not limits.max_concurrent_transfers:
+        return True
+    store = counters()
+    key = f'throttle:transfers:{user.id}'
+    if store.incr(key, 1, SLOT_TIMEOUT) > limits.max_concurrent_transfers:
+        store.incr(key, -1, SLOT_TIMEOUT)
+        return False
+    return True
+
+
+def release_transfer(user, limits):
+    if limits.max_concurrent_transfers:
+        counters().incr(f'throttle:transfers:{user.id}', -1, SLOT_TIMEOUT)
+
+
+def too_many_transfers():
+    response = HttpResponse("Too many transfers in progress. Try again shortly.", status=429, content_type='text/plain')
+    response['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+class ThrottledUploadHandler(FileUploadHandler):
+    """Upload handler that paces the request body to the uploader's bandwidth limit"""
+
+    def __init__(self, request, buckets):
+        super().__init__(request)
+        self.buckets = buckets
+        self.chunk_size = min([self.chunk_size] + [rate for _, rate in buckets])
+
+    def receive_data_chunk(self, raw_data, start):
+        consume(self.buckets, len(raw_data))
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def throttled_upload(view):
+    """
+    Apply the user's transfer limits to the request body of an upload view.
+    Upload handlers must be installed before anything reads the body, so
+    CSRF is checked here afterwards instead of by the middleware.
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST' or not request.user.is_authenticated:
+            return protected(request, *args, **kwargs)
+        transfer_limits = limits()
+        if not acquire_transfer(request.user, transfer_limits):
+            return too_many_transfers()
+        started = time.perf_counter()
+        try:
+            buckets = buckets_for(request.user, transfer_limits)
+            if buckets:
+                request.upload_handlers.insert(0, ThrottledUploadHandler(request, buckets))
+            response = protected(request, *args, **kwargs)
+        finally:
+            release_transfer(request.user, transfer_limits)
+        if response.status_code < 400:
+            metrics.record_transfer('upload', int(request.META.get('CONTENT_LENGTH') or 0), time.perf_counter() - started)
+        return response
+
+    return csrf_exempt(wrapper)
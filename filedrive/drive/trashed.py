@@ -0,0 +1,42 @@
+"""
+What counts as deleted. Trashing a folder adds one Trash row for the folder
+only, so its files and subfolders are in the trash through their ancestors.
+Folder.in_trash records that for every folder, so listings leave out the
+contents of trashed folders with one indexed join instead of walking the tree.
+"""
+from django.db.models import Q
+from .models import File, Folder, Trash
+
+BATCH_SIZE = 500
+
+
+def refresh(folder_id):
+    """Recompute Folder.in_trash for a folder and every folder below it"""
+    parent_id = Folder.objects.filter(id=folder_id).values_list('parent_id', flat=True).first()
+    hidden = (
+        Trash.objects.filter(folder_id=folder_id).exists()
+        or Folder.objects.filter(id=parent_id, in_trash=True).exists()
+    )
+    level = {folder_id: hidden}
+    while level:
+        for flag in (True, False):
+            ids = [folder_id for folder_id, hidden in level.items() if hidden is flag]
+            for start in range(0, len(ids), BATCH_SIZE):
+                Folder.objects.filter(id__in=ids[start:start + BATCH_SIZE]).exclude(in_trash=flag).update(in_trash=flag)
+        parents = list(level)
+        children = {}
+        for start in range(0, len(parents), BATCH_SIZE):
+            batch = parents[start:start + BATCH_SIZE]
+            own = set(Trash.objects.filter(folder__parent_id__in=batch).values_list('folder_id', flat=True))
+            for child_id, parent_id in Folder.objects.filter(parent_id__in=batch).values_list('id', 'parent_id'):
+                children[child_id] = level[parent_id] or child_id in own
+        level = children
+
+
+def active_files(owner=None):
+    """Files that are neither in the trash themselves nor inside a trashed folder"""
+    files = File.objects.filter(Q(folder__isnull=True) | Q(folder__in_trash=False), trash__isnull=True)
+    if owner is not None:
+        files = files.filter(owner=owner)
+    return files
+
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     # Authentication
@@ -10,8 +10,16 @@ urlpatterns = [
     # Main views
     path('', views.home_view, name='home'),
     path('folder/<int:folder_id>/', views.folder_view, name='folder'),
+    path('folder/<int:folder_id>/listing/', views.folder_listing_view, name='folder_listing'),
+    path('shared/<int:folder_id>/', views.shared_folder_view, name='shared_folder'),
     path('file/<int:file_id>/', views.file_view, name='file'),
     path('download/<int:file_id>/', views.download_file_view, name='download_file'),
+    path('file/<int:file_id>/versions/<int:number>/restore/', views.restore_version_view, name='restore_version'),
+    path('preview/<int:file_id>/', views.preview_file_view, name='preview_file'),
+    path('archive/<int:file_id>/member/', views.archive_member_view, name='archive_member'),
+    path('type/<str:category>/', views.files_by_type_view, name='files_by_type'),
+    path('gallery/', views.gallery_view, name='gallery'),
+    path('thumbnail/<int:file_id>/<str:name>', views.thumbnail_view, name='thumbnail'),
     
     # Create views
     path('create-folder/', views.create_folder_view, name='create_folder'),
@@ -22,11 +30,38 @@ urlpatterns = [
     # Delete/Trash views
     path('delete/<str:item_type>/<int:item_id>/', views.delete_item_view, name='delete_item'),
     path('trash/', views.trash_view, name='trash'),
+    path('duplicates/', views.duplicates_view, name='duplicates'),
+    path('duplicates/trash/', views.trash_duplicates_view, name='trash_duplicates'),
     path('restore/<int:trash_id>/', views.restore_from_trash_view, name='restore_from_trash'),
     path('delete-permanent/<int:trash_id>/', views.delete_from_trash_view, name='delete_from_trash'),
     
     # Other views
     path('toggle-public/<str:item_type>/<int:item_id>/', views.toggle_public_view, name='toggle_public'),
+    path('toggle-star/<str:item_type>/<int:item_id>/', views.toggle_star_view, name='toggle_star'),
     path('profile/', views.profile_view, name='profile'),
+    path('avatar/<str:name>', views.avatar_view, name='avatar'),
     path('search/', views.search_view, name='search'),
+    path('export/', views.export_view, name='export'),
+    
+    # JSON API
+    path('api/files/', api.upload_file, name='api_upload_file'),
+    path('api/files/chunked/', api.create_chunked_file, name='api_create_chunked_file'),
+    path('api/files/<int:file_id>/', api.file_detail, name='api_file'),
+    path('api/files/<int:file_id>/versions/', api.file_versions, name='api_file_versions'),
+    path('api/files/<int:file_id>/archive/', api.archive_listing, name='api_archive_listing'),
+    path('api/gallery/', api.gallery, name='api_gallery'),
+    path('api/chunks/missing/', api.missing_chunks, name='api_missing_chunks'),
+    path('api/chunks/<str:chunk_hash>/', api.upload_chunk, name='api_upload_chunk'),
+    path('api/folders/', api.create_folder, name='api_create_folder'),
+    path('api/folders/<int:folder_id>/', api.folder_detail, name='api_folder'),
+    path('api/folders/<int:folder_id>/children/', api.folder_children, name='api_folder_children'),
+    path('api/stat/', api.batch_stat, name='api_stat'),
+    path('api/<str:item_type>/<int:item_id>/trash/', api.trash_item, name='api_trash'),
+    path('api/<str:item_type>/<int:item_id>/restore/', api.restore_item, name='api_restore'),
+    
+    # Sync
+    path('changes/', views.changes_view, name='changes'),
+    
+    # Monitoring
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,273 @@
+import itertools
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import Chunk, ChunkUpload, File, FileVersion, RecentActivity, VersionChunk
+from . import chunking, filetypes, jobs, journal, operations, quick_access, storage
+
+
+class InvalidChunk(Exception):
+    """Uploaded chunk bytes do not match their hash or are too large"""
+
+
+class MissingChunks(Exception):
+    """A manifest names chunks the server does not have"""
+
+    def __init__(self, hashes):
+        super().__init__(f'{len(hashes)} chunks missing')
+        self.hashes = hashes
+
+
+def write_chunk(data, chunk_hash=None):
+    """Store one chunk, checking it against chunk_hash if given. Returns (chunk, created)."""
+    if len(data) > chunking.MAX_SIZE:
+        raise InvalidChunk(f'Chunks are at most {chunking.MAX_SIZE} bytes')
+    actual = chunking.chunk_hash(data)
+    if chunk_hash is not None and actual != chunk_hash:
+        raise InvalidChunk('Chunk content does not match its hash')
+
+    path = storage.chunk_path(actual)
+    # collect_garbage takes the same row lock, so it can neither remove the
+    # file while it is reused here nor miss the refreshed last_used_at
+    with transaction.atomic():
+        chunk, created = Chunk.objects.select_for_update().get_or_create(hash=actual, defaults={'size': len(data)})
+        if not created:
+            chunk.last_used_at = timezone.now()
+            chunk.save(update_fields=['last_used_at'])
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent writers of the same chunk each use their own partial file
+            partial = f'{path}.{os.getpid()}.{id(data)}.partial'
+            with open(partial, 'wb') as fh:
+                fh.write(data)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(partial, path)
+    return chunk, created
+
+
+def receive_chunk(user, data, chunk_hash):
+    """Store a chunk uploaded by user, who may then use it in manifests. Returns (chunk, created)."""
+    chunk, created = write_chunk(data, chunk_hash)
+    ChunkUpload.objects.get_or_create(user=user, chunk=chunk)
+    return chunk, created
+
+
+def usable_chunks(user, hashes):
+    """
+    The chunks among hashes that user may put in a manifest, by hash, and
+    the ids of those already in one of their versions. Chunks that exist
+    only for other users are left out, as if they did not exist.
+    """
+    unique = list(dict.fromkeys(hashes))
+    chunks = {}
+    for start in range(0, len(unique), 500):
+        chunks.update(Chunk.objects.in_bulk(unique[start:start + 500], field_name='hash'))
+
+    ids = [chunk.id for chunk in chunks.values()]
+    owned = set()
+    uploaded = set()
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        owned.update(VersionChunk.objects.filter(
+            version__file__owner=user, chunk_id__in=batch,
+        ).values_list('chunk_id', flat=True))
+        uploaded.update(ChunkUpload.objects.filter(user=user, chunk_id__in=batch).values_list('chunk_id', flat=True))
+    return {chunk_hash: chunk for chunk_hash, chunk in chunks.items() if chunk.id in owned or chunk.id in uploaded}, owned
+
+
+def missing_chunks(user, hashes):
+    """The hashes, in order and without repeats, that user has to upload"""
+    usable, _ = usable_chunks(user, hashes)
+    return [chunk_hash for chunk_hash in dict.fromkeys(hashes) if chunk_hash not in usable]
+
+
+def resolve(user, hashes):
+    """
+    Chunks of a manifest by hash, checking that user may use all of them and
+    that the bytes new to user fit in their quota
+    """
+    chunks, owned = usable_chunks(user, hashes)
+    missing = [chunk_hash for chunk_hash in dict.fromkeys(hashes) if chunk_hash not in chunks]
+    if missing:
+        raise MissingChunks(missing)
+    new_bytes = sum(chunk.size for chunk in chunks.values() if chunk.id not in owned)
+    if new_bytes and operations.used_space(user) + new_bytes > operations.quota():
+        raise operations.QuotaExceeded()
+    return chunks
+
+
+def lock_chunks(chunks):
+    """
+    Lock the rows of resolved chunks until the transaction commits, so that
+    collect_garbage cannot delete them meanwhile. Raises MissingChunks for
+    chunks it deleted already.
+    """
+    ids = [chunk.id for chunk in chunks.values()]
+    locked = set()
+    for start in range(0, len(ids), 500):
+        locked.update(Chunk.objects.select_for_update().filter(id__in=ids[start:start + 500]).values_list('id', flat=True))
+    missing = [chunk_hash for chunk_hash, chunk in chunks.items() if chunk.id not in locked]
+    if missing:
+        raise MissingChunks(missing)
+
+
+def add_manifest(file_obj, hashes, chunks, checksum=''):
+    """
+    Create the next version of file_obj from resolved chunks, without making
+    it current. Must run in a transaction.
+    """
+    lock_chunks(chunks)
+    number = (file_obj.versions.aggregate(number=Max('number'))['number'] or 0) + 1
+    version = FileVersion.objects.create(
+        file=file_obj, number=number, size=sum(chunks[chunk_hash].size for chunk_hash in hashes), checksum=checksum,
+    )
+    VersionChunk.objects.bulk_create(
+        [VersionChunk(version=version, position=position, chunk=chunks[chunk_hash]) for position, chunk_hash in enumerate(hashes)],
+        batch_size=1000,
+    )
+    return version
+
+
+def set_current(file_obj, version):
+    file_obj.current_version = version
+    file_obj.size = file_obj.stored_size = version.size
+    file_obj.checksum = version.checksum
+    file_obj.save()
+
+
+def create_file(user, name, folder, hashes):
+    """Create a chunked file from already uploaded chunks"""
+    chunks = resolve(user, hashes)
+    file_obj = File(owner=user, name=name, folder=folder, size=0)
+    if hashes:
+        with open(storage.chunk_path(hashes[0]), 'rb') as head:
+            file_obj.category, file_obj.mime_type = filetypes.detect_file_type(name, head)
+    with transaction.atomic():
+        file_obj.save()
+        version = add_manifest(file_obj, hashes, chunks)
+        set_current(file_obj, version)
+    journal.record_change(user, 'create', file_obj)
+    jobs.enqueue('hash_version', version_id=version.id)
+    if file_obj.category in ('image', 'video'):
+        jobs.enqueue('extract_media', file_id=file_obj.id)
+    RecentActivity.objects.create(user=user, action="uploaded", item_name=file_obj.name, item_type="file")
+    quick_access.touch(user, file_obj, 'uploaded', buffered=False)
+    return file_obj
+
+
+def add_version(user, file_obj, hashes, checksum=''):
+    """Make the chunks named by hashes, in order, the new current version of a chunked file"""
+    chunks = resolve(user, hashes)
+    with transaction.atomic():
+        version = add_manifest(file_obj, hashes, chunks, checksum)
+        set_current(file_obj, version)
+    journal.record_change(user, 'update', file_obj)
+    if not checksum:
+        jobs.enqueue('hash_version', version_id=version.id)
+    if file_obj.category in ('image', 'video'):
+        jobs.enqueue('extract_media', file_id=file_obj.id)
+    RecentActivity.objects.create(user=user, action="updated", item_name=file_obj.name, item_type="file")
+    quick_access.touch(user, file_obj, 'uploaded', buffered=False)
+    return version
+
+
+def restore_version(user, version):
+    """Make an old version current again, as a new version with the same chunks"""
+    hashes = list(version.chunks.order_by('position').values_list('chunk__hash', flat=True))
+    return add_version(user, version.file, hashes, version.checksum)
+
+
+def convert(file_obj):
+    """
+    Store a whole file as chunks, making its content version 1. Chunking is
+    pure Python, so this runs on the workers ('chunk_file' jobs).
+    """
+    if file_obj.current_version_id:
+        return None
+    hashes = []
+    chunks = {}
+    with file_obj.open_content() as fh:
+        for data in chunking.iter_chunks(fh):
+            chunk, _ = write_chunk(data)
+            hashes.append(chunk.hash)
+            chunks[chunk.hash] = chunk
+
+    old_name = file_obj.file.name
+    old_path = storage.stored_path(file_obj)
+    with transaction.atomic():
+        version = add_manifest(file_obj, hashes, chunks, file_obj.checksum)
+        # Only switch over if the file was not replaced or deleted meanwhile
+        updated = File.objects.filter(id=file_obj.id, file=old_name, current_version__isnull=True).update(
+            current_version=version, file='', encoding='', stored_size=version.size, tier='hot',
+        )
+        if not updated:
+            transaction.set_rollback(True)
+            return None
+    if os.path.exists(old_path):
+        os.remove(old_path)
+    if not version.checksum:
+        jobs.enqueue('hash_version', version_id=version.id)
+    return version
+
+
+def prunable(keep_last, keep_days, now=None):
+    """
+    Ids of versions outside the retention policy: neither current, nor one of
+    the keep_last newest of their file, nor younger than keep_days
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=keep_days)
+    current = set(File.objects.filter(current_version__isnull=False).values_list('current_version_id', flat=True))
+    rows = FileVersion.objects.order_by('file_id', '-number').values_list('id', 'file_id', 'created_at')
+    for _, versions in itertools.groupby(rows.iterator(), key=lambda row: row[1]):
+        for index, (version_id, _, created_at) in enumerate(versions):
+            if index >= keep_last and created_at < cutoff and version_id not in current:
+                yield version_id
+
+
+def retention():
+    policy = getattr(settings, 'DRIVE_VERSION_RETENTION', {})
+    return policy.get('keep_last', 10), policy.get('keep_days', 30)
+
+
+def collect_garbage(grace, batch_size=500, dry_run=False):
+    """
+    Delete chunks no version refers to. Chunks stored or reused within grace
+    are kept, since a client may have uploaded them for a version it has not
+    committed yet. Returns (chunks, bytes) removed.
+    """
+    cutoff = timezone.now() - grace
+    removed = removed_bytes = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # The row locks of write_chunk and add_manifest; rows they touched
+            # meanwhile no longer match once the lock is granted
+            batch = list(
+                Chunk.objects.select_for_update().filter(id__gt=last_id, last_used_at__lt=cutoff)
+                .exclude(id__in=VersionChunk.objects.values('chunk_id'))
+                .order_by('id').values_list('id', 'hash', 'size')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            # Checked again under the lock for versions committed meanwhile
+            used = set(VersionChunk.objects.filter(chunk_id__in=[row[0] for row in batch]).values_list('chunk_id', flat=True))
+            batch = [row for row in batch if row[0] not in used]
+            if not dry_run:
+                Chunk.objects.filter(id__in=[row[0] for row in batch]).delete()
+                # Still under the lock, so a concurrent write_chunk waits and
+                # then writes the file again
+                for _, chunk_hash, _ in batch:
+                    try:
+                        os.remove(storage.chunk_path(chunk_hash))
+                    except FileNotFoundError:
+                        pass
+        for _, _, size in batch:
+            removed += 1
+            removed_bytes += size
+    return removed, removed_bytes
@@ -1,18 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
-from django.db.models import Sum
-from django.http import HttpResponse, JsonResponse, Http404
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.urls import reverse
 from django.core.paginator import Paginator
+from django.core.files.storage import default_storage
 from django.utils import timezone
-from .models import UserProfile, Folder, File, Trash, RecentActivity, StorageSettings
+from django.utils.dateparse import parse_datetime
+from django.utils.crypto import constant_time_compare
+from django.utils.http import content_disposition_header, url_has_allowed_host_and_scheme
+from .models import UserProfile, Folder, File, FileVersion, MediaMetadata, Trash, RecentActivity
 from .forms import UserProfileForm, FolderForm, FileForm
+from .filetypes import CATEGORY_CHOICES
+from . import journal
+from .export import iter_export
+from . import access, activity, archives, avatars, duplicates, filetypes, listing_cache, media, metrics, operations, quick_access, storage, throttle, trashed, versions
+import logging
+import mimetypes
 import os
+import time
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+FOLDER_SORTS = [(name, label) for name, (label, _, _) in listing_cache.SORTS.items()]
+
 def dp(user):
     User = UserProfile.objects.get(user=user)
     profileIMG = User.photo
@@ -38,14 +53,10 @@ def login_view(request):
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                return redirect('home')
-            else:
-                messages.error(request, "Invalid username or password.")
+            # The form has already authenticated the user; checking the
+            # password again would run the slow hash twice
+            login(request, form.get_user())
+            return redirect('home')
         else:
             messages.error(request, "Invalid username or password.")
     else:
@@ -56,6 +67,15 @@ def logout_view(request):
     logout(request)
     return redirect('login')
 
+def metrics_view(request):
+    """Prometheus metrics of all processes, read from their snapshots without touching the database"""
+    # Scrapers send the token; without one only staff can look
+    token = getattr(settings, 'DRIVE_METRICS_TOKEN', None)
+    authorized = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponse(status=401 if token or not request.user.is_authenticated else 403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def home_view(request):
     user = UserProfile.objects.get(user=request.user)
@@ -65,8 +85,6 @@ def home_view(request):
         if root_folders.exists():
             if root_folders.count() > 1:
                 # If multiple root folders exist, use the first one and log a warning
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.warning(f"User {request.user.username} has {root_folders.count()} root folders. Using the first one.")
                 root_folder = root_folders.first()
             else:
@@ -76,8 +94,6 @@ def home_view(request):
             root_folder = Folder.objects.create(name='Home', owner=request.user, parent=None)
     except Exception as e:
         # Handle any other exceptions
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error getting root folder for user {request.user.username}: {str(e)}")
         # Create a new root folder as fallback
         root_folder = Folder.objects.create(name='Home', owner=request.user, parent=None)
@@ -85,58 +101,51 @@ def home_view(request):
     # Get recent activities
     recent_activities = RecentActivity.objects.filter(user=request.user)[:6]
     
-    # Get storage usage
-    storage_settings = StorageSettings.objects.first()
-    if not storage_settings:
-        storage_settings = StorageSettings.objects.create()
+    # Quick access lists, each one query on a (user, time) index
+    recent_files = quick_access.recent_files(request.user, 8)
+    starred = quick_access.starred(request.user, 8)
     
-    used_space = File.objects.filter(owner=request.user).aggregate(total=Sum('size'))['total'] or 0
-    total_space = storage_settings.space_per_user
+    # Get storage usage
+    used_space = operations.used_space(request.user)
+    total_space = operations.quota()
     used_percentage = (used_space / total_space) * 100 if total_space > 0 else 0
     
-    # Debug: Print information to console
-    print(f"Root folder: {root_folder}")
-    print(f"Subfolders count: {root_folder.children.count()}")
-    print(f"Files count: {root_folder.files.count()}")
-    
-    # If there are files/folders not showing in the root folder, 
-    # let's also check for files/folders that might be orphaned
-    all_user_folders = Folder.objects.filter(owner=request.user)
-    all_user_files = File.objects.filter(owner=request.user)
+    # Files and folders outside any folder would never be listed, so adopt
+    # them into the root folder
+    orphaned_folders = Folder.objects.filter(owner=request.user, parent=None).exclude(id=root_folder.id)
+    orphaned_files = File.objects.filter(owner=request.user, folder=None)
     
-    print(f"All user folders: {all_user_folders.count()}")
-    print(f"All user files: {all_user_files.count()}")
-    
-    # Check for orphaned files/folders (not in any folder)
-    orphaned_folders = all_user_folders.filter(parent=None).exclude(id=root_folder.id)
-    orphaned_files = all_user_files.filter(folder=None)
-    
-    print(f"Orphaned folders: {orphaned_folders.count()}")
-    print(f"Orphaned files: {orphaned_files.count()}")
-    
-    # If there are orphaned items, move them to the root folder
+    moved = []
     for folder in orphaned_folders:
-        print(f"Moving orphaned folder '{folder.name}' to root")
+        logger.info("Moving orphaned folder %s of %s to root", folder.id, request.user.username)
         folder.parent = root_folder
         folder.save()
+        moved.append(('move', folder))
     
     for file in orphaned_files:
-        print(f"Moving orphaned file '{file.name}' to root")
+        logger.info("Moving orphaned file %s of %s to root", file.id, request.user.username)
         file.folder = root_folder
         file.save()
+        moved.append(('move', file))
+    if moved:
+        metrics.inc('drive_orphans_adopted_total', len(moved))
+    journal.record_changes(request.user, moved)
     
     # Now get the updated counts
-    subfolders = root_folder.children.all()
-    files = root_folder.files.all()
+    subfolders = root_folder.children.filter(trash__isnull=True)
+    files = root_folder.files.filter(trash__isnull=True)
     
     context = {
         'root_folder': root_folder,
         'subfolders': subfolders,
         'files': files,
         'recent_activities': recent_activities,
+        'recent_files': recent_files,
+        'starred': starred,
         'used_space': used_space,
         'total_space': total_space,
         'used_percentage': used_percentage,
+        'categories': CATEGORY_CHOICES,
         'img': user.photo,
     }
     return render(request, 'drive/home.html', context)
@@ -150,26 +159,139 @@ def folder_view(request, folder_id):
     if not folder.is_public and folder.owner != request.user:
         raise Http404("Folder not found or you don't have permission to access it.")
     
-    subfolders = folder.children.all()
-    files = folder.files.all()
+    # Optional filter on the stored file category
+    category = request.GET.get('type', '')
+    if category not in dict(CATEGORY_CHOICES):
+        category = ''
+    sort = request.GET.get('sort', listing_cache.DEFAULT_SORT)
+    if sort not in listing_cache.SORTS:
+        sort = listing_cache.DEFAULT_SORT
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
     
     # Record activity if user is not the owner
     if folder.owner != request.user:
-        RecentActivity.objects.create(
-            user=request.user,
-            action="viewed",
-            item_name=folder.name,
-            item_type="folder"
-        )
+        activity.record_read(request.user, "viewed", folder.name, "folder")
     
     context = {
         'folder': folder,
-        'subfolders': subfolders,
-        'files': files,
+        'listing_html': listing_cache.get_listing_html(folder, sort, category, page),
+        'category': category,
+        'categories': CATEGORY_CHOICES,
+        'sort': sort,
+        'sorts': FOLDER_SORTS,
+        'starred': quick_access.is_starred(request.user, folder),
         'img': user.photo,
     }
     return render(request, 'drive/folder.html', context)
 
+@login_required
+def folder_listing_view(request, folder_id):
+    """JSON version of the folder listing, served from the same cache as folder_view"""
+    folder = get_object_or_404(Folder, id=folder_id, owner=request.user)
+    
+    category = request.GET.get('type', '')
+    sort = request.GET.get('sort', listing_cache.DEFAULT_SORT)
+    if category and category not in dict(CATEGORY_CHOICES):
+        return JsonResponse({'error': 'Unknown type.'}, status=400)
+    if sort not in listing_cache.SORTS:
+        return JsonResponse({'error': 'Unknown sort.'}, status=400)
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page.'}, status=400)
+    
+    return JsonResponse(listing_cache.get_listing(folder, sort, category, page))
+
+@login_required
+def shared_folder_view(request, folder_id):
+    """Read-only view of another user's public folder, listing what in it is public"""
+    user = UserProfile.objects.get(user=request.user)
+    folder = get_object_or_404(Folder.objects.select_related('owner'), id=folder_id)
+    if folder.owner == request.user:
+        return redirect('folder', folder_id=folder.id)
+    if not folder.is_public or folder.in_trash:
+        raise Http404("Folder not found or you don't have permission to access it.")
+    
+    subfolders = folder.children.filter(is_public=True, in_trash=False).order_by('name', 'id')
+    files = folder.files.filter(is_public=True, trash__isnull=True).order_by('name', 'id')
+    page = Paginator(files, 100).get_page(request.GET.get('page'))
+    
+    context = {
+        'folder': folder,
+        'subfolders': subfolders,
+        'page': page,
+        'files': page.object_list,
+        'starred': quick_access.is_starred(request.user, folder),
+        'img': user.photo,
+    }
+    return render(request, 'drive/shared_folder.html', context)
+
+@login_required
+def files_by_type_view(request, category):
+    user = UserProfile.objects.get(user=request.user)
+    labels = dict(CATEGORY_CHOICES)
+    if category not in labels:
+        raise Http404("Unknown file type.")
+    
+    # Served from the (owner, category, created_at) index
+    files = trashed.active_files(request.user).filter(category=category).order_by('-created_at')
+    page = Paginator(files, 48).get_page(request.GET.get('page'))
+    
+    context = {
+        'category': category,
+        'category_label': labels[category],
+        'categories': CATEGORY_CHOICES,
+        'page': page,
+        'files': page.object_list,
+        'img': user.photo,
+    }
+    return render(request, 'drive/by_type.html', context)
+
+@login_required
+def gallery_view(request):
+    """Photos and videos across all folders, newest capture first, from the media index"""
+    user = UserProfile.objects.get(user=request.user)
+    try:
+        filters = media.parse_filters(request.GET)
+    except ValueError:
+        return redirect('gallery')
+    items, next_cursor = media.gallery_page(request.user, **filters)
+    
+    # Links to the next page keep the filters
+    params = request.GET.copy()
+    params.pop('after', None)
+    if next_cursor:
+        params['after'] = next_cursor
+    
+    context = {
+        'items': items,
+        'filters': filters,
+        'kinds': MediaMetadata.KIND_CHOICES,
+        'next_query': params.urlencode() if next_cursor else '',
+        'img': user.photo,
+    }
+    return render(request, 'drive/gallery.html', context)
+
+@login_required
+def thumbnail_view(request, file_id, name):
+    """Serve a file's thumbnail; the name changes with the content, so it is cached for good"""
+    row = MediaMetadata.objects.filter(file_id=file_id).values_list('owner_id', 'file__is_public', 'thumbnail').first()
+    if row is None or row[2] != f'{media.THUMBNAIL_DIR}/{name}':
+        raise Http404("Thumbnail not found")
+    owner_id, is_public, thumbnail = row
+    if not is_public and owner_id != request.user.id:
+        raise Http404("Thumbnail not found")
+    try:
+        fh = default_storage.open(thumbnail, 'rb')
+    except FileNotFoundError:
+        raise Http404("Thumbnail not found")
+    response = FileResponse(fh, content_type='image/webp')
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
 @login_required
 def create_folder_view(request, parent_id=None):
     user = UserProfile.objects.get(user=request.user)
@@ -181,17 +303,8 @@ def create_folder_view(request, parent_id=None):
         form = FolderForm(request.POST)
         if form.is_valid():
             folder = form.save(commit=False)
-            folder.owner = request.user
             folder.parent = parent_folder
-            folder.save()
-            
-            # Record activity
-            RecentActivity.objects.create(
-                user=request.user,
-                action="created",
-                item_name=folder.name,
-                item_type="folder"
-            )
+            operations.create_folder(request.user, folder)
             
             messages.success(request, "Folder created successfully!")
             if parent_folder:
@@ -208,6 +321,7 @@ def create_folder_view(request, parent_id=None):
     return render(request, 'drive/create_folder.html', context)
 
 @login_required
+@throttle.throttled_upload
 def upload_file_view(request, folder_id=None):
     user = UserProfile.objects.get(user=request.user)
     folder = None
@@ -218,36 +332,15 @@ def upload_file_view(request, folder_id=None):
         form = FileForm(request.POST, request.FILES)
         if form.is_valid():
             file_obj = form.save(commit=False)
-            file_obj.owner = request.user
             file_obj.folder = folder
-            
-            # Auto-populate name from filename if not provided
-            if not file_obj.name and file_obj.file:
-                file_obj.name = file_obj.file.name.split('/')[-1]
-            
-            file_obj.save()
-            
-            # Check storage space
-            storage_settings = StorageSettings.objects.first()
-            if not storage_settings:
-                storage_settings = StorageSettings.objects.create()
-            
-            used_space = File.objects.filter(owner=request.user).aggregate(total=Sum('size'))['total'] or 0
-            if used_space > storage_settings.space_per_user:
-                file_obj.delete()
+            try:
+                operations.add_file(request.user, file_obj)
+            except operations.QuotaExceeded:
                 messages.error(request, "Not enough storage space!")
                 if folder:
                     return redirect('folder', folder_id=folder.id)
                 return redirect('home')
             
-            # Record activity
-            RecentActivity.objects.create(
-                user=request.user,
-                action="uploaded",
-                item_name=file_obj.name,
-                item_type="file"
-            )
-            
             messages.success(request, "File uploaded successfully!")
             if folder:
                 return redirect('folder', folder_id=folder.id)
@@ -273,18 +366,24 @@ def file_view(request, file_id):
     
     # Record activity if user is not the owner
     if file_obj.owner != request.user:
-        RecentActivity.objects.create(
-            user=request.user,
-            action="viewed",
-            item_name=file_obj.name,
-            item_type="file"
-        )
+        activity.record_read(request.user, "viewed", file_obj.name, "file")
+    quick_access.touch(request.user, file_obj, 'viewed')
     
     # Get file extension to determine how to display it
     extension = file_obj.get_extension()
+    archive = archive_error = None
+    if file_obj.get_file_category() == 'archive':
+        try:
+            archive = archives.get_listing(file_obj)
+        except (archives.ArchiveError, OSError) as e:
+            archive_error = str(e)
     context = {
         'file': file_obj,
         'extension': extension,
+        'versions': file_obj.versions.all() if file_obj.is_chunked() else [],
+        'archive': archive,
+        'archive_error': archive_error,
+        'starred': quick_access.is_starred(request.user, file_obj),
         'img': user.photo,
     }
     return render(request, 'drive/file.html', context)
@@ -298,44 +397,133 @@ def download_file_view(request, file_id):
         raise Http404("File not found or you don't have permission to access it.")
     
     # Record activity
-    RecentActivity.objects.create(
-        user=request.user,
-        action="downloaded",
-        item_name=file_obj.name,
-        item_type="file"
+    activity.record_read(request.user, "downloaded", file_obj.name, "file")
+    quick_access.touch(request.user, file_obj, 'downloaded')
+    
+    content_type = file_obj.mime_type or "application/octet-stream"
+    version = None
+    if request.GET.get('version'):
+        if not request.GET['version'].isdigit():
+            raise Http404("Version not found")
+        version = get_object_or_404(FileVersion, file=file_obj, number=request.GET['version'])
+    passthrough = version is None and bool(file_obj.encoding) and storage.accepts_encoding(request, file_obj.encoding)
+    try:
+        if version is not None:
+            fh = version.open()
+        else:
+            fh = storage.open_stored(file_obj) if passthrough else file_obj.open_content()
+    except FileNotFoundError:
+        raise Http404("File not found")
+    
+    limits = throttle.limits()
+    if not throttle.acquire_transfer(request.user, limits):
+        fh.close()
+        return throttle.too_many_transfers()
+    access.record_access(file_obj)
+    
+    stream = throttle.ThrottledStream(
+        fh, throttle.buckets_for(request.user, limits, file_obj),
+        release=lambda: throttle.release_transfer(request.user, limits),
     )
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    if passthrough:
+        # Pass compressed bytes through and let the client decode them
+        response['Content-Encoding'] = file_obj.encoding
+        response['Content-Length'] = os.fstat(fh.fileno()).st_size
+    else:
+        response['Content-Length'] = version.size if version is not None else file_obj.size
+    if file_obj.encoding:
+        response['Vary'] = 'Accept-Encoding'
+    response['Content-Disposition'] = content_disposition_header(True, file_obj.name)
+    return response
+
+@login_required
+def preview_file_view(request, file_id):
+    """Serve file content for the previews on the file page"""
+    file_obj = get_object_or_404(File, id=file_id)
+    
+    if not file_obj.is_public and file_obj.owner != request.user:
+        raise Http404("File not found or you don't have permission to access it.")
+    
+    try:
+        fh = file_obj.open_content()
+    except FileNotFoundError:
+        raise Http404("File not found")
+    
+    limits = throttle.limits()
+    if not throttle.acquire_transfer(request.user, limits):
+        fh.close()
+        return throttle.too_many_transfers()
+    access.record_access(file_obj)
+    
+    stream = throttle.ThrottledStream(
+        fh, throttle.buckets_for(request.user, limits, file_obj),
+        release=lambda: throttle.release_transfer(request.user, limits),
+    )
+    # Only media and PDFs render inline; the rest downloads, so an uploaded
+    # HTML or SVG file cannot run script on this site
+    inline = filetypes.is_inline_safe(file_obj.mime_type)
+    response = StreamingHttpResponse(stream, content_type=file_obj.mime_type if inline else "application/octet-stream")
+    response['Content-Length'] = file_obj.size
+    response['Content-Disposition'] = content_disposition_header(not inline, file_obj.name)
+    response['Content-Security-Policy'] = 'sandbox'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@login_required
+def archive_member_view(request, file_id):
+    """Download one member of a zip or tar file, reading only that member"""
+    file_obj = get_object_or_404(File, id=file_id)
     
-    file_path = file_obj.file.path
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as fh:
-            response = HttpResponse(fh.read(), content_type="application/octet-stream")
-            response['Content-Disposition'] = 'attachment; filename=' + os.path.basename(file_path)
-            return response
-    raise Http404("File not found")
+    if not file_obj.is_public and file_obj.owner != request.user:
+        raise Http404("File not found or you don't have permission to access it.")
+    
+    name = request.GET.get('path', '')
+    try:
+        fh, size = archives.open_member(file_obj, name)
+    except archives.ArchiveError as e:
+        raise Http404(str(e))
+    except FileNotFoundError:
+        raise Http404("File not found")
+    
+    limits = throttle.limits()
+    if not throttle.acquire_transfer(request.user, limits):
+        fh.close()
+        return throttle.too_many_transfers()
+    access.record_access(file_obj)
+    activity.record_read(request.user, "downloaded", f"{file_obj.name}/{name}"[:255], "file")
+    quick_access.touch(request.user, file_obj, 'downloaded')
+    
+    stream = throttle.ThrottledStream(
+        fh, throttle.buckets_for(request.user, limits, file_obj),
+        release=lambda: throttle.release_transfer(request.user, limits),
+    )
+    response = StreamingHttpResponse(stream, content_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+    response['Content-Length'] = size
+    response['Content-Disposition'] = content_disposition_header(True, name.rstrip('/').rsplit('/', 1)[-1])
+    return response
+
+@login_required
+def restore_version_view(request, file_id, number):
+    file_obj = get_object_or_404(File, id=file_id, owner=request.user)
+    version = get_object_or_404(FileVersion, file=file_obj, number=number)
+    try:
+        restored = versions.restore_version(request.user, version)
+    except operations.QuotaExceeded:
+        messages.error(request, "Not enough storage space to restore this version.")
+    else:
+        messages.success(request, f"Version {version.number} of '{file_obj.name}' restored as version {restored.number}.")
+    return redirect('file', file_id=file_obj.id)
 
 @login_required
 def delete_item_view(request, item_type, item_id):
     if item_type == 'file':
         item = get_object_or_404(File, id=item_id, owner=request.user)
-        Trash.objects.create(owner=request.user, file=item)
-        # Record activity
-        RecentActivity.objects.create(
-            user=request.user,
-            action="deleted",
-            item_name=item.name,
-            item_type="file"
-        )
+        operations.trash(request.user, item)
         messages.success(request, f"File '{item.name}' moved to trash.")
     elif item_type == 'folder':
         item = get_object_or_404(Folder, id=item_id, owner=request.user)
-        Trash.objects.create(owner=request.user, folder=item)
-        # Record activity
-        RecentActivity.objects.create(
-            user=request.user,
-            action="deleted",
-            item_name=item.name,
-            item_type="folder"
-        )
+        operations.trash(request.user, item)
         messages.success(request, f"Folder '{item.name}' moved to trash.")
     
     # Redirect to the parent folder or home if it's a root folder
@@ -359,26 +547,9 @@ def trash_view(request):
 def restore_from_trash_view(request, trash_id):
     trash_item = get_object_or_404(Trash, id=trash_id, owner=request.user)
     
-    if trash_item.file:
-        # Record activity
-        RecentActivity.objects.create(
-            user=request.user,
-            action="restored",
-            item_name=trash_item.file.name,
-            item_type="file"
-        )
-        trash_item.delete()
-        messages.success(request, f"File '{trash_item.file.name}' restored from trash.")
-    elif trash_item.folder:
-        # Record activity
-        RecentActivity.objects.create(
-            user=request.user,
-            action="restored",
-            item_name=trash_item.folder.name,
-            item_type="folder"
-        )
-        trash_item.delete()
-        messages.success(request, f"Folder '{trash_item.folder.name}' restored from trash.")
+    if trash_item.file or trash_item.folder:
+        item = operations.restore(request.user, trash_item)
+        messages.success(request, f"{operations.item_type(item).capitalize()} '{item.name}' restored from trash.")
     
     return redirect('trash')
 
@@ -387,24 +558,10 @@ def delete_from_trash_view(request, trash_id):
     trash_item = get_object_or_404(Trash, id=trash_id, owner=request.user)
     
     if trash_item.file:
-        file_path = trash_item.file.file.path
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        trash_item.file.delete()
+        operations.purge(request.user, trash_item.file)
         messages.success(request, f"File '{trash_item.file.name}' permanently deleted.")
     elif trash_item.folder:
-        # Delete folder and all its contents
-        def delete_folder(folder):
-            for subfolder in folder.children.all():
-                delete_folder(subfolder)
-            for file in folder.files.all():
-                file_path = file.file.path
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                file.delete()
-            folder.delete()
-        
-        delete_folder(trash_item.folder)
+        operations.purge(request.user, trash_item.folder)
         messages.success(request, f"Folder '{trash_item.folder.name}' permanently deleted.")
     
     trash_item.delete()
@@ -416,12 +573,14 @@ def toggle_public_view(request, item_type, item_id):
         item = get_object_or_404(File, id=item_id, owner=request.user)
         item.is_public = not item.is_public
         item.save()
+        journal.record_change(request.user, 'update', item)
         status = "public" if item.is_public else "private"
         messages.success(request, f"File '{item.name}' is now {status}.")
     elif item_type == 'folder':
         item = get_object_or_404(Folder, id=item_id, owner=request.user)
         item.is_public = not item.is_public
         item.save()
+        journal.record_change(request.user, 'update', item)
         status = "public" if item.is_public else "private"
         messages.success(request, f"Folder '{item.name}' is now {status}.")
     
@@ -432,6 +591,30 @@ def toggle_public_view(request, item_type, item_id):
         return redirect('folder', folder_id=item.parent.id)
     return redirect('home')
 
+@login_required
+def toggle_star_view(request, item_type, item_id):
+    """Star or unstar a file or folder the user can see"""
+    if request.method != 'POST':
+        return redirect('home')
+    model = {'file': File, 'folder': Folder}.get(item_type)
+    if model is None:
+        raise Http404("Unknown item type.")
+    item = get_object_or_404(model, id=item_id)
+    if not item.is_public and item.owner != request.user:
+        raise Http404(f"{item_type.capitalize()} not found or you don't have permission to access it.")
+    
+    if quick_access.toggle_star(request.user, item):
+        messages.success(request, f"Starred '{item.name}'.")
+    else:
+        messages.success(request, f"Removed the star from '{item.name}'.")
+    
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        return redirect(next_url)
+    if item_type == 'folder' and item.owner != request.user:
+        return redirect('shared_folder', folder_id=item.id)
+    return redirect(item_type, **{f'{item_type}_id': item.id})
+
 @login_required
 def profile_view(request):
     user = UserProfile.objects.get(user=request.user)
@@ -440,10 +623,18 @@ def profile_view(request):
     except UserProfile.DoesNotExist:
         profile = UserProfile.objects.create(user=request.user)
     
+    previous_photo = profile.photo.name
     if request.method == 'POST':
         form = UserProfileForm(request.POST, request.FILES, instance=profile)
         if form.is_valid():
             form.save()
+            if profile.photo.name != previous_photo:
+                # Keep only small renditions of the upload, and drop the old ones
+                try:
+                    avatars.process(profile)
+                except OSError:
+                    messages.error(request, "The photo could not be processed.")
+                avatars.remove_photo(previous_photo)
             messages.success(request, "Profile updated successfully!")
             return redirect('profile')
     else:
@@ -455,10 +646,24 @@ def profile_view(request):
     }
     return render(request, 'drive/profile.html', context)
 
+@login_required
+def avatar_view(request, name):
+    """Serve a profile photo rendition; names are content hashes, so they never change"""
+    if not avatars.FILE_RE.match(name):
+        raise Http404("Avatar not found")
+    try:
+        fh = default_storage.open(f'{avatars.AVATAR_DIR}/{name}', 'rb')
+    except FileNotFoundError:
+        raise Http404("Avatar not found")
+    response = FileResponse(fh, content_type='image/webp')
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
 @login_required
 def search_view(request):
     user = UserProfile.objects.get(user=request.user)
     query = request.GET.get('q', '')
+    category = request.GET.get('type', '')
     
     folders = []
     files = []
@@ -473,11 +678,126 @@ def search_view(request):
             owner=request.user,
             name__icontains=query
         )
+        
+        if category:
+            folders = Folder.objects.none()
+            files = files.filter(category=category)
     
     context = {
         'query': query,
+        'category': category,
+        'categories': CATEGORY_CHOICES,
         'folders': folders,
         'files': files,
         'img': user.photo,
     }
-    return render(request, 'drive/search.html', context)
\ No newline at end of file
+    return render(request, 'drive/search.html', context)
+
+@login_required
+def changes_view(request):
+    """
+    Delta sync for clients: returns the changes after ?cursor= in batches.
+    ?cursor=latest returns the current cursor without changes, and ?wait=
+    holds the request open for up to that many seconds until a change arrives.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 500)), 1000))
+        wait = max(0.0, min(float(request.GET.get('wait', 0)), 60.0))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit or wait.'}, status=400)
+    
+    value, floor = journal.current_cursor(request.user)
+    cursor = request.GET.get('cursor', '0')
+    if cursor == 'latest':
+        return JsonResponse({'cursor': value, 'has_more': False, 'fields': journal.CHANGE_FIELDS, 'changes': []})
+    try:
+        cursor = int(cursor)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    
+    # Changes before the floor were compacted away; the client must re-crawl
+    if cursor < floor:
+        return JsonResponse({'reset': True, 'cursor': value}, status=410)
+    
+    # Long poll on the cursor row, which is a single primary key lookup
+    deadline = time.monotonic() + wait
+    while value <= cursor and time.monotonic() < deadline:
+        time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+        value, floor = journal.current_cursor(request.user)
+    
+    changes, next_cursor, has_more = journal.changes_since(request.user, cursor, limit)
+    return JsonResponse({
+        'cursor': next_cursor,
+        'has_more': has_more,
+        'fields': journal.CHANGE_FIELDS,
+        'changes': changes,
+    })
+
+@login_required
+def export_view(request):
+    """
+    Stream a tar archive of the user's drive. Pass ?since= and ?cursor= from
+    a previous manifest.json for an incremental export.
+    """
+    since = parse_datetime(request.GET.get('since', ''))
+    try:
+        since_cursor = int(request.GET['cursor']) if 'cursor' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    
+    filename = f"{request.user.username}-{timezone.now():%Y%m%d-%H%M%S}.tar"
+    response = StreamingHttpResponse(
+        iter_export(request.user, since=since, since_cursor=since_cursor),
+        content_type='application/x-tar',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def duplicates_view(request):
+    """Show the last duplicate scan; scans run as a job so the page never waits for one"""
+    user = UserProfile.objects.get(user=request.user)
+    if request.GET.get('refresh') == '1':
+        duplicates.request_scan(request.user)
+        messages.info(request, "Scanning your files for duplicates. Reload the page in a moment.")
+        return redirect('duplicates')
+    
+    report, current = duplicates.latest_report(request.user)
+    if not current:
+        duplicates.request_scan(request.user)
+    groups = []
+    if report is not None:
+        file_ids = [file_id for group in report['groups'] for file_id in group['files']]
+        files = File.objects.select_related('folder').in_bulk(file_ids)
+        groups = [
+            dict(group, files=[files[file_id] for file_id in group['files'] if file_id in files])
+            for group in report['groups']
+        ]
+    
+    context = {
+        'groups': groups,
+        'scanned': report is not None,
+        'current': current,
+        'reclaimable': report['reclaimable'] if report else 0,
+        'computed_at': parse_datetime(report['computed_at']) if report else None,
+        'img': user.photo,
+    }
+    return render(request, 'drive/duplicates.html', context)
+
+@login_required
+def trash_duplicates_view(request):
+    if request.method != 'POST':
+        return redirect('duplicates')
+    
+    count, reclaimed = duplicates.trash_duplicates(request.user, checksum=request.POST.get('checksum'))
+    if count:
+        RecentActivity.objects.create(
+            user=request.user,
+            action="deleted",
+            item_name=f"{count} duplicate file{'s' if count != 1 else ''}",
+            item_type="file"
+        )
+        messages.success(request, f"Moved {count} duplicate file{'s' if count != 1 else ''} to trash.")
+    else:
+        messages.info(request, "No duplicates to remove.")
+    return redirect('duplicates')
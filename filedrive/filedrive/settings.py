@@ -31,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'drive.metrics.MetricsMiddleware',
+    'drive.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +72,14 @@ DATABASES = {
     }
 }
 
+# Reads go to the aliases in DRIVE_READ_REPLICAS (none here; see
+# settings_production.py) and writes to 'default'. A client reads from the
+# primary for DRIVE_REPLICA_STICKY_SECONDS after a write, which should exceed
+# the replication lag.
+DATABASE_ROUTERS = ['drive.routers.PrimaryReplicaRouter']
+DRIVE_READ_REPLICAS = []
+DRIVE_REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,5 +131,69 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads get names that are free in every storage tier
+STORAGES = {
+    'default': {'BACKEND': 'drive.storage.TieredStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 # Storage settings
-DEFAULT_STORAGE_SPACE = 1024 * 1024 * 1024 * 1  # 1GB in bytes
\ No newline at end of file
+DEFAULT_STORAGE_SPACE = 1024 * 1024 * 1024 * 1  # 1GB in bytes
+
+# Compression at rest for compressible categories: None, 'gzip' or 'zstd'
+# ('zstd' requires the zstandard package)
+DRIVE_COMPRESSION = None
+DRIVE_COMPRESSED_CATEGORIES = ['text']
+
+# Hot/cold tiering: `manage.py apply_tiering` moves files that have not been
+# read for DRIVE_COLD_AFTER_DAYS to DRIVE_COLD_STORAGE_ROOT (off when None);
+# they move back on the next download or preview
+DRIVE_COLD_STORAGE_ROOT = None
+DRIVE_COLD_AFTER_DAYS = 30
+DRIVE_COLD_MAX_SCORE = 1.0
+DRIVE_ACCESS_HALF_LIFE_DAYS = 7
+
+# Counters for bandwidth limits and concurrent transfers (the limits
+# themselves are on StorageSettings): 'cache' uses DRIVE_THROTTLE_CACHE, which
+# must be shared (e.g. Redis) to apply across servers; 'database' uses the
+# ThrottleCounter table
+DRIVE_THROTTLE_STORE = 'cache'
+DRIVE_THROTTLE_CACHE = 'default'
+
+# Cache for rendered folder listings; entries are keyed by a per-folder
+# generation number, so any backend works without explicit invalidation
+DRIVE_LISTING_CACHE = 'default'
+
+# Sessions live in the database. With the default local-memory cache every
+# process would hold its own stale copy, so 'cached_db' is only used once a
+# shared cache is configured (see settings_production)
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+# Write users' last_login in batches rather than with an UPDATE per login
+DRIVE_BATCH_LAST_LOGIN = True
+
+# Write "viewed" and "downloaded" activity in batches, so that reads do not
+# take the database write lock
+DRIVE_BATCH_READ_ACTIVITY = True
+
+# Length of each user's recent files list on the home page index
+DRIVE_RECENT_ITEMS = 20
+
+# File versions kept by `manage.py prune_versions`: the current version, the
+# keep_last newest of each file and any younger than keep_days
+DRIVE_VERSION_RETENTION = {
+    'keep_last': 10,
+    'keep_days': 30,
+}
+
+# Prometheus metrics at /metrics. Each process writes its counters to
+# DRIVE_METRICS_DIR (a temporary directory when None), which must be shared
+# by all processes of a server; gauges come from `manage.py collect_metrics`.
+# Scrapers authenticate with "Authorization: Bearer <DRIVE_METRICS_TOKEN>";
+# otherwise only logged-in staff can read the endpoint.
+DRIVE_METRICS_DIR = None
+DRIVE_METRICS_TOKEN = None
+
+# Background jobs run by `manage.py run_workers`; set to True to run them
+# inline in the request instead (development only)
+DRIVE_JOBS_EAGER = False
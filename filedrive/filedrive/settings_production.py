@@ -0,0 +1,83 @@
+"""
+Production settings. Select with DJANGO_SETTINGS_MODULE=filedrive.settings_production
+and configure through the environment:
+
+- DJANGO_SECRET_KEY, DJANGO_ALLOWED_HOSTS (comma separated)
+- DRIVE_DB_ENGINE: 'sqlite' (default) or 'postgresql'
+- For SQLite: DRIVE_DB_NAME, the database file
+- For PostgreSQL (requires psycopg): DRIVE_DB_NAME, DRIVE_DB_USER,
+  DRIVE_DB_PASSWORD, DRIVE_DB_HOST, DRIVE_DB_PORT, and DRIVE_DB_REPLICA_HOSTS
+  (comma separated) for streaming replicas to read from
+- DRIVE_DB_CONN_MAX_AGE: seconds to keep connections open (default 60)
+- DRIVE_CACHE_URL: the cache shared by all processes, 'redis://host:6379/0'
+  (requires redis) or 'memcached://host1:11211,host2:11211' (requires
+  pymemcache). Sessions, throttle counters and folder listings live there.
+  'locmem://' keeps a cache per process, for a single-process server only.
+"""
+import os
+from django.core.exceptions import ImproperlyConfigured
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+DEBUG = False
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
+
+DB_ENGINE = os.environ.get('DRIVE_DB_ENGINE', 'sqlite')
+CONN_MAX_AGE = int(os.environ.get('DRIVE_DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    primary = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DRIVE_DB_NAME', 'filedrive'),
+        'USER': os.environ.get('DRIVE_DB_USER', 'filedrive'),
+        'PASSWORD': os.environ.get('DRIVE_DB_PASSWORD', ''),
+        'HOST': os.environ.get('DRIVE_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DRIVE_DB_PORT', '5432'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        # Persistent connections are checked before reuse after a failover
+        'CONN_HEALTH_CHECKS': True,
+    }
+    DATABASES = {'default': primary}
+    replica_hosts = [host for host in os.environ.get('DRIVE_DB_REPLICA_HOSTS', '').split(',') if host]
+    for number, host in enumerate(replica_hosts, 1):
+        DATABASES[f'replica{number}'] = {**primary, 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DRIVE_READ_REPLICAS = [f'replica{number}' for number in range(1, len(replica_hosts) + 1)]
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DRIVE_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'OPTIONS': {
+                # WAL lets readers run alongside the writer; NORMAL syncs at
+                # checkpoints instead of every commit, which WAL keeps safe
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                # Take the write lock when a transaction starts. Deferred
+                # transactions that read and then write fail with "database
+                # is locked" at once instead of waiting for the lock.
+                'transaction_mode': 'IMMEDIATE',
+                # Seconds to wait for the write lock
+                'timeout': 20,
+            },
+        }
+    }
+    # One SQLite file has no replicas; WAL readers do not block on writers
+    DRIVE_READ_REPLICAS = []
+
+CACHE_URL = os.environ.get('DRIVE_CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL.startswith('memcached://'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': CACHE_URL[len('memcached://'):].split(','),
+    }}
+elif CACHE_URL != 'locmem://':
+    # Every worker would keep its own throttle counters, listings and
+    # sessions, so limits would apply per process and logouts go unseen
+    raise ImproperlyConfigured("Set DRIVE_CACHE_URL to a redis:// or memcached:// URL (or locmem:// for one process)")
+
+if CACHE_URL != 'locmem://':
+    # Sessions come from the shared cache and only hit the database on a miss
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'